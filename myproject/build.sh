@@ -5,4 +5,6 @@ cd myproject
 pip install -r requirements.txt
 python manage.py collectstatic --noinput
 python manage.py migrate
+# Customer search keys for users the post_save signal never saw (see myapp.order_filters)
+python manage.py rebuild_customer_keys
 python create_live_admin.py
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Hot/archive split for orders.
+
+Completed and cancelled orders that have not changed for ARCHIVE_AFTER_DAYS
+are moved, with their items and feedback, into the Archived* tables by
+``manage.py archive_orders``. The live Order/OrderItem/OrderFeedback tables
+then hold only recent and in-flight orders, and every live query (admin
+board, change feeds, stock checks) stays small.
+
+Rows keep their primary keys, so order ids in URLs and emails remain valid.
+Reads that must see history go through this module: find_order for a single
+order, and the ``archive`` querysets that CursorPaginator merges for order
+history and fish reviews. Archived orders never change again. Moving them
+does not touch the Fish rating/sales counters (the live rows are deleted
+without firing the order signals), and recompute_fish_stats counts both
+tables.
+"""
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import (
+    ArchivedOrder, ArchivedOrderFeedback, ArchivedOrderItem, Order, OrderFeedback, OrderItem,
+)
+
+TERMINAL_STATUSES = ('completed', 'cancelled')
+ARCHIVE_AFTER_DAYS = 90
+
+
+def _copy(model, archive_model, queryset):
+    """Bulk-insert archive copies of ``queryset`` rows, column for column."""
+    columns = [field.attname for field in model._meta.concrete_fields]
+    archive_model.objects.bulk_create([archive_model(**row) for row in queryset.values(*columns)])
+
+
+def _raw_delete(model, column, ids):
+    # Plain DELETE: QuerySet.delete() would fire the order signals and take
+    # the archived sales and ratings off the Fish counters
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {column} IN ({placeholders})', ids)
+
+
+def archivable_orders(cutoff):
+    return Order.objects.filter(status__in=TERMINAL_STATUSES, updated_at__lt=cutoff)
+
+
+def archive_orders(cutoff, chunk_size=500, dry_run=False):
+    """Move terminal orders last changed before ``cutoff`` to the archive, one chunk per transaction.
+
+    Returns the number of orders archived (or that would be, with ``dry_run``).
+    """
+    if dry_run:
+        return archivable_orders(cutoff).count()
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(archivable_orders(cutoff).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return archived
+            _copy(Order, ArchivedOrder, Order.objects.filter(id__in=ids))
+            _copy(OrderItem, ArchivedOrderItem, OrderItem.objects.filter(order_id__in=ids))
+            _copy(OrderFeedback, ArchivedOrderFeedback, OrderFeedback.objects.filter(order_id__in=ids))
+            _raw_delete(OrderFeedback, 'order_id', ids)
+            _raw_delete(OrderItem, 'order_id', ids)
+            _raw_delete(Order, 'id', ids)
+        archived += len(ids)
+
+
+def find_order(order_id, user=None):
+    """The live Order with this id, else the ArchivedOrder, else None."""
+    condition = Q(id=order_id) if user is None else Q(id=order_id, user=user)
+    return Order.objects.filter(condition).first() or ArchivedOrder.objects.filter(condition).first()
+
+
+def user_archived_orders(user):
+    return ArchivedOrder.objects.filter(user=user)
+
+
+def archived_fish_reviews(fish):
+    """Archived counterpart of views._fish_reviews."""
+    return ArchivedOrderFeedback.objects.filter(
+        order__items__fish=fish,
+        order__status='completed',
+    ).select_related('buyer')
@@ -0,0 +1,359 @@
+"""
+Cart helpers: cached counters for the navbar badge and the guest cart.
+
+The item count (kg) and total of each user's cart are kept in the shared
+cache under ``cart_counters:<user_id>``. Cart views write the fresh values
+after every change, CartItem signals drop the key for changes made anywhere
+else, and a miss falls back to one aggregate query (never a write).
+
+Anonymous visitors get a guest cart in their session ({fish_id: kg}); it is
+merged into the database Cart with one bulk upsert when they log in or
+register (see merge_guest_cart, connected to user_logged_in).
+
+Abandoned lines are removed by ``manage.py sweep_stale_carts``, which deletes
+in short primary-key-range chunks so the site keeps writing in between.
+Staleness is judged by CartItem.updated_at, so a line the buyer just edited
+or merged stays. Each chunk is one DELETE that re-checks its conditions, so
+a line changed (or a cart refilled) while the sweep runs is never removed.
+"""
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from . import holds
+from .locking import run_with_lock_retry
+from .models import SHIPPING_FEE, Cart, CartItem, Fish
+
+COUNTERS_TIMEOUT = 24 * 60 * 60  # seconds
+ZERO = Decimal('0.00')
+
+
+def _key(user_id):
+    return f'cart_counters:{user_id}'
+
+
+def _compute(user_id):
+    totals = Cart.aggregate_items(CartItem.objects.filter(cart__user_id=user_id))
+    return {'items': totals['quantity'], 'total': totals['total']}
+
+
+def get_cart_counters(user):
+    """{'items': Decimal kg, 'total': Decimal} for the user's cart; no query on a cache hit."""
+    counters = cache.get(_key(user.pk))
+    if counters is None:
+        counters = refresh_cart_counters(user)
+    return counters
+
+
+def refresh_cart_counters(user):
+    """Recompute the counters from the database and store them. Call after a cart change."""
+    counters = _compute(user.pk)
+    cache.set(_key(user.pk), counters, COUNTERS_TIMEOUT)
+    return counters
+
+
+def set_cart_counters(user, items=ZERO, total=ZERO):
+    """Store known counters without a query (e.g. zero after checkout)."""
+    counters = {'items': items, 'total': total}
+    cache.set(_key(user.pk), counters, COUNTERS_TIMEOUT)
+    return counters
+
+
+def invalidate_cart_counters(user_id):
+    cache.delete(_key(user_id))
+
+
+# --- Batched mutations ---
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+
+
+def apply_cart_operations(quantities, operations, owner=None):
+    """Apply a list of add/set/remove operations to {fish_id: kg}.
+
+    Operations look like {'op': 'add', 'fish_id': 3, 'quantity': '1.5'}.
+    Available stock (net of other owners' holds) for every fish involved is
+    checked with one Fish query; any invalid operation raises ValueError and
+    nothing is applied. Returns the new {fish_id: kg} mapping (removed lines
+    have quantity 0).
+    """
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise ValueError('Invalid cart operation')
+        try:
+            fish_id = int(operation.get('fish_id'))
+            quantity = Decimal(str(operation.get('quantity', '0')))
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValueError('Invalid fish or quantity')
+        if operation['op'] == 'add' and quantity <= 0 or operation['op'] == 'set' and quantity < 0:
+            raise ValueError('Invalid quantity')
+        parsed.append((operation['op'], fish_id, quantity))
+
+    fish_by_id = holds.with_available_stock(Fish.objects.all(), exclude_owner=owner).in_bulk(
+        {fish_id for _, fish_id, _ in parsed}
+    )
+    quantities = dict(quantities)
+    for op, fish_id, quantity in parsed:
+        fish = fish_by_id.get(fish_id)
+        if fish is None:
+            raise ValueError('Fish not found')
+        if op == 'remove':
+            quantities[fish_id] = Decimal('0')
+            continue
+        if op == 'add' and not fish.is_available:
+            raise ValueError(f'{fish.name} is not available')
+        new_quantity = quantity + quantities.get(fish_id, Decimal('0')) if op == 'add' else quantity
+        if new_quantity > fish.stock_kg - fish.held_kg:
+            raise ValueError(f'Not enough stock available for {fish.name}')
+        quantities[fish_id] = new_quantity
+    return quantities
+
+
+def reserve_cart_lines(owner, current, quantities):
+    """Move ``owner``'s holds from the ``current`` cart quantities to the new ones.
+
+    Raises ValueError (and puts the previous holds back) if any line can no
+    longer be reserved.
+    """
+    changed = {fish_id: q for fish_id, q in quantities.items() if q != current.get(fish_id, Decimal('0'))}
+    short = holds.reserve(owner, changed)
+    if short:
+        holds.reserve(owner, {fish_id: current.get(fish_id, Decimal('0')) for fish_id in changed})
+        names = Fish.objects.filter(id__in=short).values_list('name', flat=True)
+        raise ValueError(f"Not enough stock available for {', '.join(names)}")
+
+
+def apply_cart_batch(user, operations):
+    """Apply operations to the user's Cart in one transaction. Returns the fresh counters.
+
+    The holds change in the same transaction, so a failure leaves both the
+    cart and its reservations as they were.
+    """
+    run_with_lock_retry(_apply_cart_batch, user, operations, holds.user_owner(user))
+    # bulk_create skips CartItem signals, so refresh the badge explicitly
+    return refresh_cart_counters(user)
+
+
+def _apply_cart_batch(user, operations, owner):
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        current = dict(cart.items.values_list('fish_id', 'quantity_kg'))
+        quantities = apply_cart_operations(current, operations, owner)
+        reserve_cart_lines(owner, current, quantities)
+
+        changed = [
+            CartItem(cart=cart, fish_id=fish_id, quantity_kg=quantity)
+            for fish_id, quantity in quantities.items()
+            if quantity > 0 and quantity != current.get(fish_id)
+        ]
+        if changed:
+            CartItem.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['cart', 'fish'],
+                update_fields=['quantity_kg', 'updated_at'],
+            )
+        removed = [fish_id for fish_id, quantity in quantities.items() if quantity <= 0 and fish_id in current]
+        if removed:
+            cart.items.filter(fish_id__in=removed).select_related('cart').delete()
+
+
+# --- Guest cart (session-backed) ---
+
+GUEST_CART_SESSION_KEY = 'guest_cart'
+
+
+class GuestCartLine:
+    """Quacks like a CartItem for templates; ``id`` is the fish id."""
+
+    def __init__(self, fish, quantity_kg):
+        self.id = fish.id
+        self.fish = fish
+        self.quantity_kg = quantity_kg
+
+    @property
+    def total_price(self):
+        return self.quantity_kg * self.fish.price_per_kg
+
+
+def get_guest_cart(request):
+    """{fish_id: Decimal kg} from the session; malformed entries are dropped."""
+    raw = request.session.get(GUEST_CART_SESSION_KEY) or {}
+    items = {}
+    for fish_id, quantity in raw.items():
+        try:
+            quantity = Decimal(quantity)
+            fish_id = int(fish_id)
+        except (InvalidOperation, TypeError, ValueError):
+            continue
+        if quantity > 0:
+            items[fish_id] = quantity
+    return items
+
+
+def save_guest_cart(request, items):
+    # Session values must be JSON-serializable
+    request.session[GUEST_CART_SESSION_KEY] = {str(k): str(v) for k, v in items.items() if v > 0}
+
+
+class GuestCart:
+    """Read-only stand-in for Cart in templates while the visitor is anonymous."""
+
+    def __init__(self, request):
+        items = get_guest_cart(request)
+        fish_by_id = Fish.objects.select_related('category').in_bulk(list(items))
+        self.lines = [
+            GuestCartLine(fish_by_id[fish_id], qty) for fish_id, qty in items.items() if fish_id in fish_by_id
+        ]
+
+    def get_total_items(self):
+        return sum((line.quantity_kg for line in self.lines), Decimal('0'))
+
+    def get_total_amount(self):
+        return sum((line.total_price for line in self.lines), Decimal('0.00'))
+
+    def get_total_with_shipping(self):
+        return self.get_total_amount() + SHIPPING_FEE
+
+
+def guest_cart_count(request):
+    return sum(get_guest_cart(request).values(), Decimal('0'))
+
+
+def merge_guest_cart(request, user):
+    """Move the session guest cart into the user's Cart with one bulk upsert.
+
+    Quantities already in the user's cart are added to, capped at the stock
+    not held by anyone else, and reserved for the user in the same
+    transaction. Lines that had to be cut (or dropped, if another buyer
+    reserved the last kilos meanwhile) are named in a message. Returns the
+    number of lines merged.
+    """
+    items = get_guest_cart(request)
+    if not items:
+        return 0
+
+    request.session.pop(GUEST_CART_SESSION_KEY, None)
+    # The session's holds become the user's: drop them first so they do not count against the merge
+    guest_owner = request.session.pop(holds.HOLD_OWNER_SESSION_KEY, None)
+    if guest_owner:
+        holds.release(guest_owner)
+    merged, trimmed = run_with_lock_retry(_merge_guest_cart, user, items, holds.user_owner(user))
+    if trimmed:
+        messages.warning(
+            request,
+            f"Not enough stock for all of your {', '.join(trimmed)}; your cart holds what is left.",
+            fail_silently=True,
+        )
+    # bulk_create skips CartItem signals, so refresh the badge explicitly
+    refresh_cart_counters(user)
+    return merged
+
+
+def _merge_guest_cart(user, items, owner):
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        fish = holds.with_available_stock(Fish.objects.filter(id__in=list(items), is_available=True), owner)
+        available = {
+            fish_id: (name, max(stock - held, ZERO))
+            for fish_id, name, stock, held in fish.values_list('id', 'name', 'stock_kg', 'held_kg')
+        }
+        existing = dict(
+            CartItem.objects.filter(cart=cart, fish_id__in=list(items)).values_list('fish_id', 'quantity_kg')
+        )
+        quantities, trimmed = {}, []
+        for fish_id, quantity in items.items():
+            name, left = available.get(fish_id, (None, ZERO))
+            wanted = existing.get(fish_id, ZERO) + quantity
+            if name is not None and min(wanted, left) > existing.get(fish_id, ZERO):
+                quantities[fish_id] = min(wanted, left)
+            if name is not None and wanted > left:
+                trimmed.append(name)
+
+        # Lines another buyer reserved first keep what the cart had before
+        short = holds.reserve(owner, quantities)
+        for fish_id in short:
+            del quantities[fish_id]
+            trimmed.append(available[fish_id][0])
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, fish_id=fish_id, quantity_kg=quantity) for fish_id, quantity in quantities.items()],
+            update_conflicts=True,
+            unique_fields=['cart', 'fish'],
+            update_fields=['quantity_kg', 'updated_at'],
+        )
+    return len(quantities), sorted(set(trimmed))
+
+
+# --- Stale cart sweeping ---
+
+def _pk_ranges(queryset, chunk_size):
+    """Yield (low, high) primary-key bounds covering ``queryset`` in steps of ``chunk_size``."""
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        yield low, low + chunk_size
+
+
+def _delete_stale_items(low, high, cutoff):
+    """One DELETE for the stale lines in [low, high); returns the number removed."""
+    table = CartItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id >= %s AND id < %s AND updated_at < %s',
+            [low, high, cutoff],
+        )
+        return cursor.rowcount
+
+
+def _delete_empty_carts(low, high, cutoff):
+    """One DELETE for the carts in [low, high) that are stale and still empty at delete time."""
+    cart_table, item_table = Cart._meta.db_table, CartItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {cart_table} WHERE id >= %s AND id < %s AND updated_at < %s '
+            f'AND NOT EXISTS (SELECT 1 FROM {item_table} WHERE {item_table}.cart_id = {cart_table}.id)',
+            [low, high, cutoff],
+        )
+        return cursor.rowcount
+
+
+def sweep_stale_carts(cutoff, chunk_size=1000, empty_carts=True, dry_run=False, pause=0.0):
+    """Delete cart lines not changed since ``cutoff`` and carts left empty since then.
+
+    Each primary-key range is its own short statement, so a live site is
+    only blocked for one chunk at a time; ``pause`` seconds are slept between
+    chunks to let other writers in. Returns {'items': n, 'carts': n}.
+    """
+    counts = {'items': 0, 'carts': 0}
+
+    stale_items = CartItem.objects.filter(updated_at__lt=cutoff)
+    for low, high in _pk_ranges(stale_items, chunk_size):
+        chunk = stale_items.filter(pk__gte=low, pk__lt=high)
+        if dry_run:
+            counts['items'] += chunk.count()
+            continue
+        user_ids = set(chunk.values_list('cart__user_id', flat=True))
+        # Plain DELETE (no per-row signals), so drop the affected badges here
+        counts['items'] += _delete_stale_items(low, high, cutoff)
+        for user_id in user_ids:
+            invalidate_cart_counters(user_id)
+        if pause:
+            time.sleep(pause)
+
+    if empty_carts:
+        # Carts are created on demand (add to cart, login merge), so empty ones can go
+        stale_carts = Cart.objects.filter(updated_at__lt=cutoff, items__isnull=True)
+        for low, high in _pk_ranges(stale_carts, chunk_size):
+            if dry_run:
+                counts['carts'] += stale_carts.filter(pk__gte=low, pk__lt=high).count()
+                continue
+            counts['carts'] += _delete_empty_carts(low, high, cutoff)
+            if pause:
+                time.sleep(pause)
+    return counts
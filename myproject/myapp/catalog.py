@@ -0,0 +1,111 @@
+"""
+Shared, versioned cache for catalog data.
+
+Every cached catalog fragment is keyed by a global catalog version. Saving or
+deleting a Fish or FishCategory bumps the version (see myapp.signals), which
+makes every old fragment unreachable at once; they then age out of the cache
+on their own. Fragments are shared by all users, so memory use grows with the
+catalog rather than with the number of users.
+
+Orders move stock on nearly every checkout, so they bump the catalog version
+with ``stock_only=True``. A second counter, the names version, moves only on
+the other changes (names, categories, a fish going on or off sale), for
+consumers that do not show stock, such as the suggest index.
+"""
+from functools import partial
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Fish, FishCategory
+
+CATALOG_VERSION_KEY = 'catalog_version'
+NAMES_VERSION_KEY = 'catalog_names_version'
+FRAGMENT_TIMEOUT = 60 * 60  # seconds; invalidation is by version, not by expiry
+
+
+def _get_counter(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def _bump_counter(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key missing (evicted or first write): start a fresh sequence
+        cache.add(key, 1, None)
+        return cache.incr(key)
+
+
+def get_catalog_version():
+    return _get_counter(CATALOG_VERSION_KEY)
+
+
+def get_names_version():
+    return _get_counter(NAMES_VERSION_KEY)
+
+
+def bump_catalog_version(stock_only=False):
+    """Invalidate every catalog fragment. Call after any catalog write.
+
+    ``stock_only`` marks writes that changed only stock and sales figures,
+    which leave the names version alone.
+    """
+    if not stock_only:
+        _bump_counter(NAMES_VERSION_KEY)
+    return _bump_counter(CATALOG_VERSION_KEY)
+
+
+bump_stock_version = partial(bump_catalog_version, stock_only=True)
+
+
+def catalog_key(name, *parts):
+    # Hash the parts so free-text (search terms) is safe in any cache backend
+    suffix = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'catalog:{get_catalog_version()}:{name}:{suffix}'
+
+
+def cached_fragment(name, builder, *parts, timeout=FRAGMENT_TIMEOUT):
+    """Return the cached value for (name, parts) at the current catalog version, building it on a miss."""
+    key = catalog_key(name, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, timeout)
+    return value
+
+
+def featured_fish(limit=6):
+    return cached_fragment(
+        'featured_fish',
+        lambda: list(
+            Fish.objects.select_related('category')
+            .filter(is_available=True, stock_kg__gt=0)
+            .order_by('-created_at')[:limit]
+        ),
+        limit,
+    )
+
+
+def category_counts(limit=4):
+    """Categories that have fish in stock, with a ``fish_count`` attribute."""
+    return cached_fragment(
+        'category_counts',
+        lambda: list(
+            FishCategory.objects.annotate(
+                fish_count=Count(
+                    'fish',
+                    filter=Q(fish__is_available=True) & Q(fish__stock_kg__gt=0),
+                    distinct=True,
+                )
+            )
+            .filter(fish_count__gt=0)
+            .order_by('name')[:limit]
+        ),
+        limit,
+    )
@@ -0,0 +1,102 @@
+"""
+Cheap validators for conditional GET (ETag / Last-Modified).
+
+Each function here is used with ``django.views.decorators.http.condition`` so
+an unchanged page or feed is answered with a 304 before the view queries and
+serializes anything. Validators are memoized on the request because
+``condition`` asks for the ETag and the Last-Modified date separately.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+
+from .catalog import cached_fragment
+from .context_processors import cart_info
+from .models import Fish, Order
+
+
+def _memoize_on_request(request, name, compute):
+    cache_attr = f'_validator_{name}'
+    if not hasattr(request, cache_attr):
+        setattr(request, cache_attr, compute())
+    return getattr(request, cache_attr)
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def catalog_state():
+    """(max Fish.updated_at, fish count), computed once per catalog version."""
+    return cached_fragment(
+        'validator',
+        lambda: tuple(Fish.objects.aggregate(last=Max('updated_at'), count=Count('id')).values()),
+    )
+
+
+def user_marker(request):
+    """Per-user bits rendered into every page (user and cart badge)."""
+    return f"{request.user.pk}:{cart_info(request)['cart_item_count']}"
+
+
+def fish_list_etag(request):
+    last, count = catalog_state()
+    return _etag('fish_list', last, count, request.get_full_path(), user_marker(request))
+
+
+def fish_detail_etag(request, fish_id):
+    # recommendation__built_at: rebuilding "frequently bought together" changes the page
+    fish = Fish.objects.filter(pk=fish_id, is_available=True).values(
+        'updated_at', 'rating_sum', 'rating_count', 'sold_kg', 'recommendation__built_at'
+    ).first()
+    if fish is None:
+        return None
+    last, count = catalog_state()
+    # The user's orders decide has_purchased/can_leave_feedback
+    orders_changed = _user_orders_state(request)[0]
+    return _etag('fish_detail', fish_id, *fish.values(), last, count, orders_changed, user_marker(request))
+
+
+def _user_orders_state(request):
+    if not request.user.is_authenticated:
+        return (None, 0)
+    return _memoize_on_request(
+        request,
+        'user_orders',
+        lambda: tuple(
+            Order.objects.filter(user=request.user)
+            .aggregate(last=Max('updated_at'), count=Count('id'))
+            .values()
+        ),
+    )
+
+
+def user_orders_etag(request):
+    if request.GET.get('since'):
+        return None  # change feeds are already tiny; skip the full-table aggregate
+    last, count = _user_orders_state(request)
+    return _etag('user_orders', request.user.pk, last, count)
+
+
+def user_orders_last_modified(request):
+    if request.GET.get('since'):
+        return None  # see user_orders_etag
+    return _user_orders_state(request)[0]
+
+
+def _admin_orders_state(request, orders):
+    return _memoize_on_request(
+        request,
+        'admin_orders',
+        lambda: tuple(orders.aggregate(last=Max('updated_at'), count=Count('id')).values()),
+    )
+
+
+def admin_orders_etag(request, orders):
+    # ETag only: an order moved out of the filter or archived lowers the count
+    # but not the filtered max(updated_at), so a Last-Modified would stay
+    # unchanged and revalidate the stale board
+    if not request.user.is_staff or request.GET.get('since'):
+        return None
+    last, count = _admin_orders_state(request, orders)
+    return _etag('admin_orders', request.get_full_path(), last, count)
@@ -1,4 +1,4 @@
-from .models import Cart
+from .cart import get_cart_counters, guest_cart_count
 
 
 def location(request):
@@ -23,11 +23,13 @@ def cart_info(request):
     user = getattr(request, 'user', None)
     if user and user.is_authenticated:
         try:
-            cart, _ = Cart.objects.get_or_create(user=user)
-            count = cart.get_total_items()
+            # Cached counters; only a cache miss touches the database
+            count = get_cart_counters(user)['items']
         except Exception:
             count = 0
+    elif hasattr(request, 'session'):
+        # Guest cart lives in the session; no database access
+        count = guest_cart_count(request)
     return {
         'cart_item_count': count,
     }
-
@@ -0,0 +1,142 @@
+"""
+Live order events for the Server-Sent Events stream (views.order_events).
+
+Order post_save publishes a small event (after the transaction commits) to
+an in-process bus. Every open SSE connection is a subscriber with its own
+asyncio queue, so an update reaches the browser as soon as it is saved,
+with no polling.
+
+The bus only spans one process. A stream therefore also re-reads the order
+change feed (myapp.pagination.changes_since) on connect, starting at the
+Last-Event-ID the browser sends on reconnect, and every CATCH_UP_INTERVAL
+seconds. That picks up anything saved by other worker processes, management
+commands or bulk updates. Event ids are the stream's change-feed cursor, and
+clients upsert orders by id, so a repeated event is harmless.
+
+Django 4.2's ASGI handler does not notice a client that goes away while a
+response streams, so a stream would otherwise run (and poll) forever after
+its tab closed. Each stream therefore ends after STREAM_LIFETIME; the
+browser's EventSource reconnects on its own with the Last-Event-ID, which
+every keep-alive refreshes, so nothing is missed.
+"""
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.utils.timezone import localtime
+
+from .models import Order
+from .pagination import changes_since, feed_cursor
+
+QUEUE_SIZE = 100
+CATCH_UP_INTERVAL = 10  # seconds; also the keep-alive period
+CATCH_UP_LIMIT = 200
+RETRY_MS = 3000  # browser reconnect delay
+STREAM_LIFETIME = 5 * 60  # seconds; bounds a stream whose client has gone
+
+
+class EventBus:
+    """Thread-safe fan-out from sync publishers to asyncio subscribers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        subscriber = (queue, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # Loop already closed; the stream's finally block will unsubscribe
+                pass
+
+
+def _offer(queue, event):
+    # A subscriber that cannot keep up drops events; its periodic catch-up recovers them
+    if not queue.full():
+        queue.put_nowait(event)
+
+
+order_events = EventBus()
+
+
+def order_event(order, change):
+    """The event payload for one order; ``change`` is 'created', 'status' or 'changed' (catch-up)."""
+    return {
+        'type': change,
+        'user_id': order.user_id,
+        'order': {
+            'id': order.id,
+            'status': order.status,
+            'status_display': order.get_status_display(),
+            'total': float(order.total_amount),
+            'created_at': localtime(order.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+        },
+    }
+
+
+def publish_order(order, created):
+    order_events.publish(order_event(order, 'created' if created else 'status'))
+
+
+def _format(event, cursor):
+    return f'id: {cursor}\nevent: order\ndata: {json.dumps(event, separators=(",", ":"))}\n\n'
+
+
+def _keep_alive(cursor):
+    # No data, so no event fires, but the browser still stores the id for its reconnect
+    return f'id: {cursor}\n: keep-alive\n\n'
+
+
+def _catch_up(orders, cursor):
+    """Pending catch-up events and the advanced cursor (runs in a worker thread)."""
+    events = []
+    while True:
+        changes = changes_since(orders, cursor, limit=CATCH_UP_LIMIT)
+        if changes is None:
+            # No or unreadable cursor: start from now, nothing to replay
+            return events, feed_cursor(orders)
+        rows, cursor, has_more = changes
+        events.extend(order_event(order, 'changed') for order in rows)
+        if not has_more:
+            return events, cursor
+
+
+async def order_event_stream(user, cursor=None):
+    """SSE body for ``user``: their own orders, or every order for staff."""
+    orders = Order.objects.all() if user.is_staff else Order.objects.filter(user=user)
+    subscriber = order_events.subscribe()
+    queue, loop = subscriber
+    ends = loop.time() + STREAM_LIFETIME
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while loop.time() < ends:
+            # Anything this process did not see (other workers, bulk updates, a reconnect gap)
+            missed, cursor = await sync_to_async(_catch_up)(orders, cursor)
+            for event in missed:
+                yield _format(event, cursor)
+            yield _keep_alive(cursor)
+            deadline = min(loop.time() + CATCH_UP_INTERVAL, ends)
+            try:
+                while True:
+                    event = await asyncio.wait_for(queue.get(), timeout=max(deadline - loop.time(), 0))
+                    if user.is_staff or event['user_id'] == user.id:
+                        yield _format(event, cursor)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        order_events.unsubscribe(subscriber)
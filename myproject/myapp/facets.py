@@ -0,0 +1,104 @@
+"""
+Facet counts for the fish_list filters.
+
+Counts are computed for the current filter context: the category facet
+ignores the selected category (so the other choices still show how many
+fish they would give), while the stock and price facets honour every
+filter. Results are cached per normalized filter set and per catalog
+version, so any catalog write invalidates them.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Q
+
+from .catalog import cached_fragment
+from .models import Fish
+from .search import search_fish, search_terms
+
+LOW_STOCK_KG = Decimal('5')
+
+STOCK_FACETS = [
+    ('available', 'In Stock', Q(stock_kg__gt=LOW_STOCK_KG)),
+    ('low', 'Low Stock', Q(stock_kg__gt=0, stock_kg__lte=LOW_STOCK_KG)),
+    ('out', 'Out of Stock', Q(stock_kg__lte=0)),
+]
+
+PRICE_FACETS = [
+    ('0-100', 'Under ₱100', Q(price_per_kg__lt=100)),
+    ('100-250', '₱100 – ₱250', Q(price_per_kg__gte=100, price_per_kg__lt=250)),
+    ('250-500', '₱250 – ₱500', Q(price_per_kg__gte=250, price_per_kg__lt=500)),
+    ('500+', '₱500 and up', Q(price_per_kg__gte=500)),
+]
+
+_STOCK_CONDITIONS = {key: condition for key, _, condition in STOCK_FACETS}
+_PRICE_CONDITIONS = {key: condition for key, _, condition in PRICE_FACETS}
+
+
+def normalize_filters(params):
+    """Reduce fish_list GET params to a canonical dict (also used as the cache key)."""
+    category = (params.get('category') or '').strip()
+    stock = params.get('stock') or ''
+    price = params.get('price') or ''
+    return {
+        'search': ' '.join(search_terms(params.get('search', ''))),
+        'category': int(category) if category.isdigit() else None,
+        'stock': stock if stock in _STOCK_CONDITIONS else '',
+        'price': price if price in _PRICE_CONDITIONS else '',
+    }
+
+
+def filter_fish(queryset, filters, skip=()):
+    """Apply normalized filters to a Fish queryset, leaving out the names in ``skip``."""
+    if filters['search'] and 'search' not in skip:
+        queryset = search_fish(queryset, filters['search'])
+    if filters['category'] and 'category' not in skip:
+        queryset = queryset.filter(category_id=filters['category'])
+    if filters['stock'] and 'stock' not in skip:
+        queryset = queryset.filter(_STOCK_CONDITIONS[filters['stock']])
+    if filters['price'] and 'price' not in skip:
+        queryset = queryset.filter(_PRICE_CONDITIONS[filters['price']])
+    return queryset
+
+
+def _compute_facets(filters):
+    base = Fish.objects.filter(is_available=True)
+
+    # One grouped query for the category facet
+    categories = list(
+        filter_fish(base, filters, skip=('category',))
+        .values('category_id', 'category__name')
+        .annotate(count=Count('id'))
+        .order_by('category__name')
+    )
+
+    # Stock and price buckets together in one conditional aggregate
+    buckets = filter_fish(base, filters).aggregate(
+        **{f'stock_{key}': Count('id', filter=condition) for key, _, condition in STOCK_FACETS},
+        **{f'price_{key}': Count('id', filter=condition) for key, _, condition in PRICE_FACETS},
+    )
+
+    return {
+        'categories': [
+            {
+                'id': row['category_id'],
+                'name': row['category__name'],
+                'count': row['count'],
+                'selected': row['category_id'] == filters['category'],
+            }
+            for row in categories
+        ],
+        'stock': [
+            {'key': key, 'label': label, 'count': buckets[f'stock_{key}'], 'selected': key == filters['stock']}
+            for key, label, _ in STOCK_FACETS
+        ],
+        'price': [
+            {'key': key, 'label': label, 'count': buckets[f'price_{key}'], 'selected': key == filters['price']}
+            for key, label, _ in PRICE_FACETS
+        ],
+    }
+
+
+def get_facets(filters):
+    """Facet counts for the given normalized filters, cached until the catalog changes."""
+    key = (filters['search'], filters['category'], filters['stock'], filters['price'])
+    return cached_fragment('facets', lambda: _compute_facets(filters), *key)
@@ -0,0 +1,156 @@
+"""
+Time-limited stock reservations.
+
+Adding fish to a cart (or placing an Order Now purchase) reserves the kilos
+with a StockHold row that expires after HOLD_TTL. Available stock is
+``stock_kg`` minus the active holds of everyone else, read from one indexed
+aggregate. A reservation is an upsert of the buyer's own hold followed by a
+re-check against the holds of others, in one transaction. Reservations of
+the same fish take its row lock first, so each re-check sees every hold
+committed before it and at most one buyer gets the last kilos. The lock is
+held only for that short transaction (or the caller's, e.g. a cart batch).
+SQLite has no row locks, so there the first statement is a no-op UPDATE of
+the fish: the transaction starts as the writer and queues behind others
+instead of failing when it upgrades from a read, and a lost race still
+retries the whole reservation (myapp.locking).
+
+Holds are keyed by an owner string: 'u:<user id>' for logged-in users and
+'s:<token>' for anonymous sessions. The token lives in the session so it
+survives the key rotation on login, when merge_guest_cart re-reserves the
+merged cart for the user. Expired holds are ignored everywhere and swept by
+``manage.py expire_stock_holds``.
+"""
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .locking import run_with_lock_retry
+from .models import Fish, StockHold
+
+HOLD_TTL = timedelta(minutes=15)
+HOLD_OWNER_SESSION_KEY = 'hold_owner'
+ZERO = Decimal('0.00')
+KG_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def hold_owner(request):
+    """The hold owner key for this request's user or anonymous session."""
+    if request.user.is_authenticated:
+        return user_owner(request.user)
+    owner = request.session.get(HOLD_OWNER_SESSION_KEY)
+    if not owner:
+        owner = request.session[HOLD_OWNER_SESSION_KEY] = f's:{uuid.uuid4().hex}'
+    return owner
+
+
+def user_owner(user):
+    return f'u:{user.pk}'
+
+
+def active_holds(now=None):
+    return StockHold.objects.filter(expires_at__gt=now or timezone.now())
+
+
+def held_kg(exclude_owner=None):
+    """Expression for the kilos of the outer Fish row held by owners other than ``exclude_owner``."""
+    held = active_holds().filter(fish=OuterRef('pk'))
+    if exclude_owner:
+        held = held.exclude(owner=exclude_owner)
+    held = held.order_by().values('fish').annotate(total=Sum('quantity_kg')).values('total')
+    return Coalesce(Subquery(held, output_field=KG_FIELD), Value(ZERO), output_field=KG_FIELD)
+
+
+def with_available_stock(queryset, exclude_owner=None):
+    """Annotate a Fish queryset with ``held_kg``, the active holds of owners other than ``exclude_owner``.
+
+    Available stock is ``stock_kg - held_kg``.
+    """
+    return queryset.annotate(held_kg=held_kg(exclude_owner))
+
+
+def available_stock(fish_ids, exclude_owner=None):
+    """{fish_id: kg} that can still be reserved, never negative; one query."""
+    rows = with_available_stock(Fish.objects.filter(id__in=list(fish_ids)), exclude_owner).values_list(
+        'id', 'stock_kg', 'held_kg'
+    )
+    return {fish_id: max(stock - (held or ZERO), ZERO) for fish_id, stock, held in rows}
+
+
+def _lock_fish(fish_ids):
+    """Serialize reservations of these fish until the transaction ends."""
+    fish = Fish.objects.filter(id__in=fish_ids)
+    if connection.features.has_select_for_update:
+        # Fixed order, no deadlocks
+        list(fish.select_for_update().order_by('id').values_list('id', flat=True))
+    else:
+        # No row locks (SQLite): take the database write lock up front instead
+        fish.update(updated_at=F('updated_at'))
+
+
+def reserve(owner, quantities, ttl=HOLD_TTL):
+    """Set ``owner``'s holds to {fish_id: kg}; a quantity of 0 releases that hold.
+
+    Returns the fish ids that could not be reserved (their previous hold is
+    kept as it was, expiry included); an empty list means every hold is in
+    place.
+    """
+    return run_with_lock_retry(_reserve, owner, quantities, ttl)
+
+
+def _reserve(owner, quantities, ttl):
+    wanted = {fish_id: quantity for fish_id, quantity in quantities.items() if quantity > 0}
+    with transaction.atomic():
+        if wanted:
+            _lock_fish(sorted(wanted))
+        release(owner, [fish_id for fish_id, quantity in quantities.items() if quantity <= 0])
+        if not wanted:
+            return []
+
+        previous = {
+            fish_id: (hold_id, quantity, expires_at)
+            for hold_id, fish_id, quantity, expires_at in StockHold.objects.filter(
+                owner=owner, fish_id__in=list(wanted)
+            ).values_list('id', 'fish_id', 'quantity_kg', 'expires_at')
+        }
+        expires_at = timezone.now() + ttl
+        StockHold.objects.bulk_create(
+            [StockHold(fish_id=fish_id, owner=owner, quantity_kg=q, expires_at=expires_at) for fish_id, q in wanted.items()],
+            update_conflicts=True,
+            unique_fields=['fish', 'owner'],
+            update_fields=['quantity_kg', 'expires_at'],
+        )
+
+        # Re-check against everyone else's holds
+        available = available_stock(wanted, exclude_owner=owner)
+        short = [fish_id for fish_id, quantity in wanted.items() if quantity > available.get(fish_id, ZERO)]
+        if short:
+            release(owner, [fish_id for fish_id in short if fish_id not in previous])
+            restore = [
+                StockHold(id=previous[fish_id][0], quantity_kg=previous[fish_id][1], expires_at=previous[fish_id][2])
+                for fish_id in short
+                if fish_id in previous
+            ]
+            if restore:
+                StockHold.objects.bulk_update(restore, ['quantity_kg', 'expires_at'])
+    return short
+
+
+def release(owner, fish_ids=None):
+    """Drop ``owner``'s holds, on the given fish or all of them."""
+    holds = StockHold.objects.filter(owner=owner)
+    if fish_ids is not None:
+        if not fish_ids:
+            return 0
+        holds = holds.filter(fish_id__in=list(fish_ids))
+    return holds.delete()[0]
+
+
+def expire_holds(now=None):
+    """Delete every expired hold in one statement. Returns the number removed."""
+    # StockHold has no signals or dependants, so this is a single DELETE
+    return StockHold.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
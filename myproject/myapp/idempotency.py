@@ -0,0 +1,160 @@
+"""
+Idempotency-Key support for order-placing POSTs.
+
+A client sends the same ``Idempotency-Key`` header (or ``idempotency_key``
+form field) on every retry of one logical request. The first request claims
+the key by inserting an IdempotencyKey row; its final response (a redirect,
+or a JSON reply below 400) is stored there and replayed for every retry until
+the key expires. Responses that invite a corrected resubmission (validation
+errors, out of stock) are not stored, and the key is freed again.
+
+The view runs in one transaction with the update that stores its response,
+holding a row lock on the key. An order therefore commits together with its
+stored response, and a worker that crashes midway rolls back both, so a
+pending key taken over after PENDING_TIMEOUT never had an order placed. The
+lock is taken with a no-op UPDATE as the transaction's first statement, which
+also makes it the writer on SQLite; a "database is locked" error retries the
+whole transaction (myapp.locking), since the view's own retries cannot run
+inside it.
+
+A duplicate that arrives while the first request is still running gets a
+409 with Retry-After at once rather than tying up a worker; its retry then
+replays the stored result, or claims the key afresh if the first request
+failed. Expired keys are removed by ``manage.py expire_idempotency_keys``.
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .locking import run_with_lock_retry
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FORM_FIELD = 'idempotency_key'
+KEY_TTL = timedelta(hours=24)
+# A claim older than this with no response is treated as abandoned (crashed worker)
+PENDING_TIMEOUT = timedelta(minutes=2)
+RETRY_AFTER = 1  # seconds a duplicate of a running request is told to wait
+
+
+def _request_hash(request):
+    body = request.body if request.content_type != 'multipart/form-data' else request.POST.urlencode().encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+def _claim(user, endpoint, key, request_hash):
+    """Insert the pending row. Returns (record, created)."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, endpoint=endpoint, key=key, request_hash=request_hash, expires_at=now + KEY_TTL
+            ), True
+    except IntegrityError:
+        pass
+    record = IdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first()
+    abandoned = record is not None and record.status_code is None and record.created_at < now - PENDING_TIMEOUT
+    if record is None or record.expires_at <= now or abandoned:
+        # Expired or abandoned: take it over (only one contender's delete succeeds).
+        # A still-running first request holds the row lock, so this waits for
+        # it and then finds the response stored.
+        if record is not None:
+            IdempotencyKey.objects.filter(
+                pk=record.pk, created_at=record.created_at, status_code=record.status_code
+            ).delete()
+        return _claim(user, endpoint, key, request_hash)
+    return record, False
+
+
+def _run(record, view, request, args, kwargs):
+    """Run the view and store its response (or free the key) in one transaction.
+
+    Returns None if the key was taken over as abandoned before the lock was won.
+    """
+    with transaction.atomic():
+        locked = IdempotencyKey.objects.filter(
+            pk=record.pk, created_at=record.created_at, status_code__isnull=True
+        ).update(expires_at=F('expires_at'))
+        if not locked:
+            return None
+        response = view(request, *args, **kwargs)
+        if _is_final(response) and not getattr(response, 'streaming', False):
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status_code=response.status_code,
+                content_type=response.get('Content-Type', ''),
+                location=response.get('Location', ''),
+                content=response.content.decode(response.charset or 'utf-8'),
+            )
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+    return response
+
+
+def _in_progress():
+    response = JsonResponse(
+        {'success': False, 'message': 'A request with this Idempotency-Key is still being processed'},
+        status=409,
+    )
+    response['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+def _replay(record):
+    response = HttpResponse(record.content, status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _is_final(response):
+    """Whether a response records a completed operation worth replaying."""
+    if 300 <= response.status_code < 400:
+        return True
+    return response.status_code < 400 and response.get('Content-Type', '').startswith('application/json')
+
+
+def idempotent(endpoint):
+    """Make a POST view replay its stored response for a repeated Idempotency-Key.
+
+    Requests without a key, anonymous users and non-POST requests are passed
+    straight through.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = (request.META.get(HEADER) or request.POST.get(FORM_FIELD) or '').strip()[:255]
+            if request.method != 'POST' or not key or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            request_hash = _request_hash(request)
+            record, created = _claim(request.user, endpoint, key, request_hash)
+            if not created:
+                if record.request_hash != request_hash:
+                    return JsonResponse(
+                        {'success': False, 'message': 'This Idempotency-Key was already used for a different request'},
+                        status=422,
+                    )
+                if record.status_code is None:
+                    return _in_progress()
+                return _replay(record)
+
+            try:
+                response = run_with_lock_retry(_run, record, view, request, args, kwargs)
+            except Exception:
+                # Everything the view wrote rolled back; free the key for a retry
+                IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+                raise
+            return _in_progress() if response is None else response
+        return wrapper
+    return decorator
+
+
+def expire_keys(now=None):
+    """Delete expired keys in one statement. Returns the number removed."""
+    return IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
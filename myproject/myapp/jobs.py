@@ -0,0 +1,135 @@
+"""
+Durable job queue stored in the database (transactional outbox).
+
+Request code calls ``enqueue`` inside the same transaction as the change
+that triggers it, so a job exists if and only if that change committed.
+``manage.py run_worker`` claims due jobs in batches, runs the registered
+handler for each, and on failure retries with exponential backoff until
+``max_attempts`` is reached. Needs nothing but the database: on SQLite the
+claim is a conditional UPDATE, on backends that support it a
+``SELECT ... FOR UPDATE SKIP LOCKED``, so several workers never run the same
+job twice.
+
+Handlers are registered with ``@job('name')`` (see myapp.tasks) and take the
+payload as keyword arguments; payloads must be JSON-serializable.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+BACKOFF_BASE = 30  # seconds; doubled per failed attempt
+BACKOFF_MAX = 60 * 60
+# A running job whose worker has been silent this long is given to another worker
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+
+def job(name):
+    """Register a handler function under ``name``."""
+    def decorator(func):
+        HANDLERS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, run_after=None, max_attempts=5, **payload):
+    """Queue a job. Call inside the transaction of the change that triggers it."""
+    if name not in HANDLERS:
+        raise ValueError(f'Unknown job: {name}')
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        run_after=run_after or timezone.now(),
+        max_attempts=max_attempts,
+    )
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def requeue_stale(now=None):
+    """Put jobs left 'running' by a dead worker back in the queue."""
+    now = now or timezone.now()
+    return Job.objects.filter(status='running', locked_at__lt=now - LOCK_TIMEOUT).update(
+        status='pending', locked_by='', locked_at=None, updated_at=now
+    )
+
+
+def claim_jobs(worker_id, batch_size=20):
+    """Mark up to ``batch_size`` due jobs as running for this worker and return them."""
+    now = timezone.now()
+    due = Job.objects.filter(status='pending', run_after__lte=now).order_by('run_after', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+        else:
+            ids = list(due.values_list('id', flat=True)[:batch_size])
+        # The status condition makes the claim safe when another worker got there first
+        Job.objects.filter(id__in=ids, status='pending').update(
+            status='running', locked_by=worker_id, locked_at=now, updated_at=now
+        )
+    return list(Job.objects.filter(id__in=ids, status='running', locked_by=worker_id, locked_at=now).order_by('id'))
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+
+def run_job(job_row):
+    """Run one claimed job and record the outcome. Returns True on success."""
+    handler = HANDLERS.get(job_row.name)
+    job_row.attempts += 1
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for {job_row.name}')
+        handler(**job_row.payload)
+    except Exception as e:
+        logger.warning(f'Job {job_row} failed (attempt {job_row.attempts}): {e}', exc_info=True)
+        job_row.last_error = f'{type(e).__name__}: {e}'
+        if job_row.attempts >= job_row.max_attempts:
+            job_row.status = 'failed'
+        else:
+            job_row.status = 'pending'
+            job_row.run_after = timezone.now() + _backoff(job_row.attempts)
+        job_row.locked_by, job_row.locked_at = '', None
+        job_row.save(update_fields=['attempts', 'last_error', 'status', 'run_after', 'locked_by', 'locked_at', 'updated_at'])
+        return False
+    job_row.status = 'done'
+    job_row.locked_by, job_row.locked_at = '', None
+    job_row.save(update_fields=['attempts', 'status', 'locked_by', 'locked_at', 'updated_at'])
+    return True
+
+
+def work(worker_id=None, batch_size=20, idle_sleep=2.0, once=False, stop=None):
+    """Claim and run jobs until ``stop()`` is true (or the queue is empty with ``once``).
+
+    Returns {'done': n, 'failed': n}.
+    """
+    worker_id = worker_id or default_worker_id()
+    counts = {'done': 0, 'failed': 0}
+    requeue_stale()
+    while not (stop and stop()):
+        batch = claim_jobs(worker_id, batch_size)
+        for job_row in batch:
+            counts['done' if run_job(job_row) else 'failed'] += 1
+        if not batch:
+            if once:
+                break
+            time.sleep(idle_sleep)
+            requeue_stale()
+    return counts
+
+
+def purge_jobs(older_than):
+    """Delete finished jobs (done or failed) last touched before ``older_than``."""
+    return Job.objects.filter(status__in=['done', 'failed'], updated_at__lt=older_than).delete()[0]
@@ -0,0 +1,39 @@
+"""
+Retrying transactions that lose a "database is locked" race.
+
+SQLite allows one writer at a time. A transaction that writes as its first
+statement waits for the current writer (up to the busy timeout), but one
+that read first and then writes fails at once with "database is locked",
+because waiting could deadlock. The only remedy is to run the whole
+transaction again, which run_with_lock_retry does with a short randomized
+backoff.
+
+Only the outermost transaction can be retried: a savepoint restarted inside
+it keeps the outer transaction's read lock and fails the same way. Inside
+an atomic block the function therefore runs once and the error is left for
+the outermost caller to retry.
+"""
+import random
+import time
+
+from django.db import OperationalError, connection
+
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05  # seconds, doubled on each retry
+
+
+def is_locked(error):
+    return 'locked' in str(error).lower()
+
+
+def run_with_lock_retry(func, *args, **kwargs):
+    """Call ``func`` (which opens its own transaction), retrying it if the database was locked."""
+    if connection.in_atomic_block:
+        return func(*args, **kwargs)
+    for attempt in range(LOCK_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as e:
+            if not is_locked(e) or attempt == LOCK_RETRIES:
+                raise
+            time.sleep(LOCK_BACKOFF * (2 ** attempt) * (1 + random.random()))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from myapp.archive import ARCHIVE_AFTER_DAYS, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move completed and cancelled orders older than N days (with items and feedback) to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='Archive orders unchanged for this many days')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Orders moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        moved = archive_orders(cutoff, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} orders older than {options['days']} days"))
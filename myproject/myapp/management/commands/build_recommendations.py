@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from myapp.recommendations import TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Build "frequently bought together" recommendations from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Neighbours to keep per fish')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Order lines fetched per round trip')
+
+    def handle(self, *args, **options):
+        stored = build_recommendations(top_k=options['top_k'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Stored recommendations for {stored} fish'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from myapp.idempotency import expire_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses past their expiry'
+
+    def handle(self, *args, **options):
+        removed = expire_keys()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired idempotency keys'))
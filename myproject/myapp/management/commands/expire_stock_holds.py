@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from myapp.holds import expire_holds
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations (run every few minutes)'
+
+    def handle(self, *args, **options):
+        removed = expire_holds()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired holds'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from myapp.exports import EXPORT_FORMATS, export_orders
+from myapp.order_filters import filter_admin_orders, filter_archived_orders
+
+
+class Command(BaseCommand):
+    help = 'Stream orders (archived ones too) and their lines as CSV or NDJSON, with the admin order board filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv', help='Output format')
+        parser.add_argument('--status', default='', help='Only orders with this status')
+        parser.add_argument('--user', default='', help='Customer username or name words start with these')
+        parser.add_argument('--from', dest='from', default='', help='Orders created at or after this date/datetime')
+        parser.add_argument('--to', default='', help='Orders created before this datetime (a date includes that day)')
+        parser.add_argument('--date', default='', help='Only orders created on this date (YYYY-MM-DD)')
+        parser.add_argument('--output', default='-', help='File to write to (default: stdout)')
+
+    def handle(self, *args, **options):
+        orders = filter_admin_orders(options)
+        chunks = export_orders(orders, options['format'], extra=[filter_archived_orders(options)])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        try:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+        except OSError as e:
+            raise CommandError(f'Cannot write {options["output"]}: {e}')
+        self.stdout.write(self.style.SUCCESS(f"Exported orders to {options['output']}"))
@@ -0,0 +1,14 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from myapp.order_filters import rebuild_customer_keys
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the customer search keys used by the admin order filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users read per query')
+
+    def handle(self, *args, **options):
+        keys = rebuild_customer_keys(User.objects.all(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {keys} customer search keys'))
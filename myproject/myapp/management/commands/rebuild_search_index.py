@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from myapp.models import Fish
+from myapp.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for the fish catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if rebuild_search_index(using):
+            count = Fish.objects.using(using).count()
+            self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {count} fish'))
+        else:
+            self.stdout.write(self.style.WARNING('Full-text search is not supported on this database; using icontains fallback'))
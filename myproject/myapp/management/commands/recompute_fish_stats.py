@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from myapp.stats import recompute_fish_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized rating and sales counters on Fish'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk update')
+
+    def handle(self, *args, **options):
+        updated = recompute_fish_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated counters on {updated} fish'))
@@ -0,0 +1,38 @@
+import signal
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from myapp.jobs import default_worker_id, purge_jobs, work
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (emails, admin alerts) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Jobs claimed per round trip')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no jobs are due (for cron)')
+        parser.add_argument('--purge-days', type=int, default=7, help='Delete finished jobs older than this on start')
+        parser.add_argument('--worker-id', default=None, help='Name recorded on claimed jobs (default host:pid)')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        purged = purge_jobs(timezone.now() - timedelta(days=options['purge_days']))
+        if purged:
+            self.stdout.write(f'Purged {purged} finished jobs')
+
+        # Finish the current job on Ctrl-C / SIGTERM instead of dying mid-way
+        stopping = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stopping.append(True))
+
+        self.stdout.write(f'Worker {worker_id} started')
+        counts = work(
+            worker_id=worker_id,
+            batch_size=options['batch_size'],
+            idle_sleep=options['sleep'],
+            once=options['once'],
+            stop=lambda: bool(stopping),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker_id} stopped: {counts['done']} done, {counts['failed']} failed"))
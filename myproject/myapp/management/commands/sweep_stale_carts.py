@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from myapp.cart import sweep_stale_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned cart items (and empty carts) older than a given age, in small chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Remove cart items not changed for this many days')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Primary-key range deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between chunks')
+        parser.add_argument('--keep-empty-carts', action='store_true', help='Do not delete carts left without items')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted (carts that are empty right now)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        counts = sweep_stale_carts(
+            cutoff,
+            chunk_size=options['chunk_size'],
+            empty_carts=not options['keep_empty_carts'],
+            dry_run=options['dry_run'],
+            pause=options['pause'],
+        )
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {counts['items']} cart items and {counts['carts']} empty carts older than {options['days']} days"
+        ))
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
+SHIPPING_FEE = Decimal('50.00')
+
 class FishCategory(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
@@ -25,12 +27,26 @@ class Fish(models.Model):
     image = models.ImageField(upload_to='fish_images/', blank=True, null=True)
     image_url = models.URLField(blank=True, help_text="External image URL if no local image")
     is_available = models.BooleanField(default=True)
+    # Denormalized counters, maintained by myapp.stats (see recompute_fish_stats)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    sold_kg = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Fish"
+        # Partial indexes on is_available rather than a leading is_available
+        # column: Django renders the filter as a bare boolean ("WHERE
+        # is_available"), which SQLite can only match against an index WHERE.
+        indexes = [
+            # fish_list: available fish by name, optionally within a category
+            models.Index(fields=['name'], condition=models.Q(is_available=True), name='fish_avail_name_idx'),
+            models.Index(fields=['category', 'name'], condition=models.Q(is_available=True), name='fish_avail_cat_name_idx'),
+            # home/featured and stock facets
+            models.Index(fields=['stock_kg'], condition=models.Q(is_available=True), name='fish_avail_stock_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -55,37 +71,54 @@ class Fish(models.Model):
             
     @property
     def total_sold(self):
-        """Calculate total quantity of this fish sold across all completed orders"""
-        from django.db.models import Sum, Q
-        
-        total = self.orderitem_set.filter(
-            order__status='completed'
-        ).aggregate(
-            total_sold=Sum('quantity_kg')
-        )['total_sold']
-        
-        return total or 0
+        """Total quantity of this fish sold across all completed orders"""
+        return self.sold_kg
     
     @property
     def average_rating(self):
-        """Calculate average rating from order feedback"""
-        from django.db.models import Avg, Count, Q
-        
-        # Get all order items for this fish that have feedback
-        ratings = OrderFeedback.objects.filter(
-            order__items__fish=self,
-            order__status='completed',
-            rating__isnull=False
-        ).aggregate(
-            avg_rating=Avg('rating'),
-            count=Count('id')
-        )
-        
+        """Average rating from feedback on completed orders containing this fish"""
+        average = self.rating_sum / self.rating_count if self.rating_count else 0
         return {
-            'average': round(ratings['avg_rating'] or 0, 1),
-            'count': ratings['count'] or 0
+            'average': round(average, 1),
+            'count': self.rating_count
         }
 
+class FishRecommendation(models.Model):
+    """Top co-purchased fish for one fish, built offline by build_recommendations."""
+    fish = models.OneToOneField(Fish, on_delete=models.CASCADE, primary_key=True, related_name='recommendation')
+    fish_ids = models.JSONField(default=list, help_text="Neighbour fish ids, best first")
+    scores = models.JSONField(default=list, help_text="Co-purchase counts matching fish_ids")
+    built_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Recommendations for {self.fish_id}"
+
+class StockHold(models.Model):
+    """Time-limited reservation of stock for a cart line or an Order Now purchase.
+
+    ``owner`` is 'u:<user id>' or 's:<token>' for an anonymous session (see
+    myapp.holds). Expired rows are ignored and removed by expire_stock_holds.
+    """
+    fish = models.ForeignKey(Fish, on_delete=models.CASCADE, related_name='holds')
+    owner = models.CharField(max_length=64)
+    quantity_kg = models.DecimalField(max_digits=10, decimal_places=2)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fish', 'owner'], name='stockhold_fish_owner_uniq'),
+        ]
+        indexes = [
+            # Covers the per-fish "active holds" sum without touching the table
+            models.Index(fields=['fish', 'expires_at', 'quantity_kg'], name='stockhold_fish_active_idx'),
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+            models.Index(fields=['owner'], name='stockhold_owner_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity_kg}kg of {self.fish_id} held by {self.owner}"
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -97,6 +130,8 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    is_archived = False  # ArchivedOrder rows say True; lets templates tell them apart
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     payment_method = models.CharField(max_length=10, choices=[('cod', 'Cash on Delivery'), ('gcash', 'GCash')], default='cod')
     delivery_address = models.TextField(blank=True, help_text="Snapshot of delivery address at time of order")
@@ -108,16 +143,60 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # order_history / user_orders_data
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # admin order board filtered by status
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # admin order board unfiltered, newest first
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+            # "changed since" polling feeds (admin board, buyer order history)
+            models.Index(fields=['updated_at', 'id'], name='order_updated_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='order_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.user.username} - {self.created_at.strftime('%Y-%m-%d')}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so signals can detect transitions
+        if 'status' in field_names:
+            instance._original_status = instance.status
+        return instance
+    
     def calculate_total(self):
         total = sum(item.total_price for item in self.items.all())
         self.total_amount = total
         self.save()
         return total
 
+class IdempotencyKey(models.Model):
+    """Stored outcome of an order-placing POST, replayed for retries (see myapp.idempotency)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    content = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='idempotency_user_endpoint_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.endpoint} {self.key} for {self.user_id}"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     fish = models.ForeignKey(Fish, on_delete=models.CASCADE)
@@ -126,6 +205,10 @@ class OrderItem(models.Model):
     
     class Meta:
         unique_together = ['order', 'fish']
+        indexes = [
+            # reviews, purchase checks and sales counters look up by fish
+            models.Index(fields=['fish', 'order'], name='orderitem_fish_order_idx'),
+        ]
     
     def __str__(self):
         return f"{self.fish.name} - {self.quantity_kg}kg"
@@ -142,20 +225,73 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.username}"
     
+    @staticmethod
+    def aggregate_items(items):
+        """Line count, total kg and total amount of a CartItem queryset in one query"""
+        totals = items.aggregate(
+            lines=models.Count('id'),
+            quantity=models.Sum('quantity_kg'),
+            total=models.Sum(
+                models.F('quantity_kg') * models.F('fish__price_per_kg'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        return {
+            'lines': totals['lines'],
+            'quantity': totals['quantity'] or Decimal('0.00'),
+            'total': (totals['total'] or Decimal('0.00')).quantize(Decimal('0.01')),
+        }
+    
+    def summary(self):
+        """Cart totals plus line items (with their fish), memoized on this instance.
+        
+        Views and templates that share the Cart object share one result; call
+        invalidate_summary() after changing the cart in the same request.
+        """
+        if getattr(self, '_summary', None) is None:
+            self._summary = CartSummary(self)
+        return self._summary
+    
+    def invalidate_summary(self):
+        self._summary = None
+    
     def get_total_items(self):
-        return sum(item.quantity_kg for item in self.items.all())
+        return self.summary().quantity
     
     def get_total_amount(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.summary().total
     
     def get_total_with_shipping(self):
-        return self.get_total_amount() + Decimal('50.00')
+        return self.get_total_amount() + SHIPPING_FEE
+
+
+class CartSummary:
+    """Totals for one cart from a single aggregate; line items load on first use."""
+    
+    def __init__(self, cart):
+        self.cart = cart
+        totals = Cart.aggregate_items(cart.items.all())
+        self.line_count = totals['lines']
+        self.quantity = totals['quantity']
+        self.total = totals['total']
+        self._lines = None
+    
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = list(self.cart.items.select_related('fish', 'fish__category').order_by('added_at', 'id'))
+        return self._lines
+    
+    @property
+    def total_with_shipping(self):
+        return self.total + SHIPPING_FEE
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     fish = models.ForeignKey(Fish, on_delete=models.CASCADE)
     quantity_kg = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # last add/edit/merge; sweep_stale_carts goes by this
     
     class Meta:
         unique_together = ['cart', 'fish']
@@ -207,6 +343,10 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # unread badge in message_center
+            models.Index(fields=['recipient', 'is_read'], name='message_recipient_read_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} to {self.recipient.username} - {self.subject}"
@@ -233,3 +373,123 @@ class OrderFeedback(models.Model):
     
     def __str__(self):
         return f"Feedback for Order #{self.order.id} - {self.rating} stars"
+
+
+# --- Archive of old completed/cancelled orders (see myapp.archive) ---
+# Same columns and primary keys as the live tables, without auto_now so
+# archived timestamps are copied verbatim.
+
+class ArchivedOrder(models.Model):
+    is_archived = True
+    
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    payment_method = models.CharField(max_length=10, choices=[('cod', 'Cash on Delivery'), ('gcash', 'GCash')], default='cod')
+    delivery_address = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archorder_user_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived order #{self.id} - {self.user.username} - {self.created_at.strftime('%Y-%m-%d')}"
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    fish = models.ForeignKey(Fish, on_delete=models.CASCADE, related_name='archived_order_items')
+    quantity_kg = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['fish', 'order'], name='architem_fish_order_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.fish.name} - {self.quantity_kg}kg"
+    
+    @property
+    def total_price(self):
+        return self.quantity_kg * self.unit_price
+
+class ArchivedOrderFeedback(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.OneToOneField(ArchivedOrder, on_delete=models.CASCADE, related_name='feedback')
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_order_feedbacks')
+    rating = models.IntegerField(choices=OrderFeedback.RATING_CHOICES)
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Feedback for archived order #{self.order_id} - {self.rating} stars"
+
+
+class Job(models.Model):
+    """Deferred side effect (email, admin alert, ...) run by manage.py run_worker; see myapp.jobs."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Worker claim: next due pending jobs
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+class CustomerSearchKey(models.Model):
+    """One normalized word (lowercase, no accents) of a user's username or name.
+
+    The admin order filters match customers by key prefix with a plain
+    range scan on this table instead of icontains across auth_user; see
+    myapp.order_filters. Rows are kept in sync from User post_save; users
+    written without it (bulk_create, QuerySet.update) are covered by
+    ``manage.py rebuild_customer_keys``, which build.sh runs on every deploy.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_keys')
+    key = models.CharField(max_length=150)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='customerkey_user_key_uniq'),
+        ]
+        indexes = [
+            # Prefix lookup answered from the index alone: a key range on SQLite,
+            # LIKE 'q%' on PostgreSQL (pattern ops make that indexable under any collation)
+            models.Index(
+                fields=['key', 'user'], name='customerkey_key_user_idx', opclasses=['varchar_pattern_ops', 'int8_ops']
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} -> user {self.user_id}"
@@ -0,0 +1,146 @@
+"""
+Filters for the admin order board, its JSON feed and the order export.
+
+normalize_order_filters turns GET params (or command options) into one
+canonical dict and filter_admin_orders applies it, so every admin order
+view filters the same way. Each condition is written so that an index can
+answer it:
+
+* ``from``/``to`` are a half-open range on created_at (``>= from`` and
+  ``< to``), made timezone-aware in the current timezone. A date-only ``to``
+  includes that whole day. The old ``date`` param becomes the range of that
+  day. Comparing the bare column keeps the Order created_at indexes usable,
+  where ``created_at__date`` wrapped the column in a function.
+* ``user`` matches customers by word prefix through CustomerSearchKey: every
+  word of the username and name is stored lowercased and without accents,
+  and each search word becomes an index scan that yields user ids. On
+  PostgreSQL that is ``key LIKE 'w%'`` on a varchar_pattern_ops index, which
+  works whatever the database collation; elsewhere (binary collation) it is
+  the range ``key >= w AND key < w'``, where w' is w with its last character
+  incremented. That replaces three icontains over a join to auth_user, which
+  had to read every order.
+
+Keys are written from User post_save. Users created or changed without it
+(bulk_create, QuerySet.update, rows that predate the table) are indexed by
+``manage.py rebuild_customer_keys``, which build.sh runs after migrate.
+"""
+import datetime
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ArchivedOrder, CustomerSearchKey, Order
+
+MAX_CUSTOMER_TERMS = 4
+KEY_LENGTH = CustomerSearchKey._meta.get_field('key').max_length
+_STATUSES = {value for value, _ in Order.STATUS_CHOICES}
+
+
+def customer_terms(text):
+    """Lowercase, accent-free word tokens of ``text``."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [word[:KEY_LENGTH] for word in re.findall(r'\w+', text.casefold())]
+
+
+def customer_keys(user):
+    return set(customer_terms(f'{user.username} {user.first_name} {user.last_name}'))
+
+
+def index_customer(user):
+    """Replace the user's CustomerSearchKey rows with their current keys."""
+    keys = customer_keys(user)
+    with transaction.atomic():
+        CustomerSearchKey.objects.filter(user=user).exclude(key__in=keys).delete()
+        CustomerSearchKey.objects.bulk_create(
+            [CustomerSearchKey(user=user, key=key) for key in keys], ignore_conflicts=True
+        )
+
+
+def rebuild_customer_keys(users, batch_size=1000):
+    """Rebuild the keys of every user in ``users`` (a queryset). Returns the number of keys written."""
+    written = 0
+    fields = ('id', 'username', 'first_name', 'last_name')
+    for user in users.only(*fields).order_by('id').iterator(chunk_size=batch_size):
+        index_customer(user)
+        written += len(customer_keys(user))
+    return written
+
+
+def _prefix_match(term):
+    """Condition on CustomerSearchKey.key for keys starting with ``term``."""
+    if connection.vendor == 'postgresql':
+        return Q(key__startswith=term)
+    # Every string starting with term sorts between term and term with its last character bumped
+    return Q(key__gte=term, key__lt=term[:-1] + chr(ord(term[-1]) + 1))
+
+
+def _parse_bound(value, end=False):
+    """A timezone-aware datetime from 'YYYY-MM-DD' or an ISO datetime, or None.
+
+    A date-only upper bound (``end``) means the start of the next day, so the
+    half-open range still covers the whole day.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        # Dates first: parse_datetime also accepts a bare date, as midnight
+        day = parse_date(value)
+        if day is not None:
+            if end:
+                day += datetime.timedelta(days=1)
+            moment = datetime.datetime.combine(day, datetime.time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                return None
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def normalize_order_filters(params):
+    """Reduce admin order GET params (status, user, from, to, date) to a canonical dict."""
+    status = params.get('status') or ''
+    start = _parse_bound(params.get('from'))
+    end = _parse_bound(params.get('to'), end=True)
+    day = params.get('date') or ''
+    if day and start is None and end is None:
+        start, end = _parse_bound(day), _parse_bound(day, end=True)
+    return {
+        'status': status if status in _STATUSES else '',
+        'customer': customer_terms(params.get('user'))[:MAX_CUSTOMER_TERMS],
+        'from': start,
+        'to': end,
+    }
+
+
+def filter_orders(queryset, filters):
+    """Apply normalized filters to an Order queryset."""
+    if filters['status']:
+        queryset = queryset.filter(status=filters['status'])
+    for term in filters['customer']:
+        users = CustomerSearchKey.objects.filter(_prefix_match(term)).values('user_id')
+        queryset = queryset.filter(user_id__in=users)
+    if filters['from']:
+        queryset = queryset.filter(created_at__gte=filters['from'])
+    if filters['to']:
+        queryset = queryset.filter(created_at__lt=filters['to'])
+    return queryset
+
+
+def filter_admin_orders(params):
+    """Orders matching the admin order board filters in ``params``."""
+    return filter_orders(Order.objects.all(), normalize_order_filters(params))
+
+
+def filter_archived_orders(params):
+    """Archived orders (myapp.archive) matching the same filters."""
+    return filter_orders(ArchivedOrder.objects.all(), normalize_order_filters(params))
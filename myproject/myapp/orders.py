@@ -0,0 +1,180 @@
+"""
+Order placement and bulk status transitions.
+
+Checkout and Order Now both go through place_order, which runs in one
+transaction. Stock is taken with one conditional UPDATE per fish
+(``stock_kg = stock_kg - q WHERE stock_kg >= q + <active holds of others>``).
+That statement is atomic on every backend, so two buyers can never both take
+the last kilos, and no Python-side read-modify-write is lost. Kilos held in
+someone else's cart (myapp.holds) are not for sale, even to a buyer whose own
+hold has expired. The order lines are then bulk-created,
+and the ordered cart lines and the buyer's stock holds are removed in the same
+transaction, so a committed order never leaves its cart or holds behind.
+SQLite allows one writer at a time; a "database is locked" error retries the
+whole transaction with a short backoff (myapp.locking).
+
+QuerySet.update() skips Fish signals, so the catalog version is bumped
+explicitly once the transaction commits. The confirmation email and the
+low-stock alert are queued as jobs in the same transaction (myapp.jobs).
+
+transition_orders moves many orders to a new status with one conditional
+UPDATE (``WHERE id IN (...) AND status IN (<allowed from>)``). Like stock
+taking, that skips the Order signals, so it applies their effects itself:
+Fish sales/rating counters for completions, stock put back for
+cancellations, and live events once the transaction commits.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, ExpressionWrapper, F, Sum, Value, When
+from django.utils import timezone
+
+from . import events, holds, stats
+from .catalog import bump_catalog_version, bump_stock_version
+from .jobs import enqueue
+from .locking import run_with_lock_retry
+from .models import CartItem, Fish, Order, OrderItem
+
+
+class OutOfStock(Exception):
+    """Raised when a fish no longer has the requested quantity; nothing is written."""
+
+    def __init__(self, fish_ids, names):
+        self.fish_ids = fish_ids
+        self.names = names
+        super().__init__(f"Not enough stock available for {', '.join(names)}")
+
+
+def _take_stock(fish_id, quantity, now, hold_owner=None):
+    """Conditionally decrement one fish. Returns False if not enough is left beside others' holds."""
+    needed = ExpressionWrapper(Value(quantity) + holds.held_kg(hold_owner), output_field=holds.KG_FIELD)
+    return Fish.objects.filter(id=fish_id, is_available=True, stock_kg__gte=needed).update(
+        stock_kg=F('stock_kg') - quantity,
+        updated_at=now,
+    ) == 1
+
+
+def _place(user, quantities, order_fields, cart=None, hold_owner=None):
+    now = timezone.now()
+    with transaction.atomic():
+        # Fixed order so concurrent multi-line orders take row locks consistently
+        short = [fish_id for fish_id in sorted(quantities) if not _take_stock(fish_id, quantities[fish_id], now, hold_owner)]
+        if short:
+            names = list(Fish.objects.filter(id__in=short).values_list('name', flat=True))
+            raise OutOfStock(short, names)
+        sold_out = Fish.objects.filter(id__in=list(quantities), stock_kg__lte=0).update(
+            stock_kg=Decimal('0.00'), is_available=False, updated_at=now
+        )
+
+        # Prices read inside the transaction, after the stock is ours
+        prices = dict(Fish.objects.filter(id__in=list(quantities)).values_list('id', 'price_per_kg'))
+        total = sum((quantities[fish_id] * prices[fish_id] for fish_id in quantities), Decimal('0.00'))
+        order = Order.objects.create(user=user, total_amount=total, **order_fields)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, fish_id=fish_id, quantity_kg=quantity, unit_price=prices[fish_id])
+            for fish_id, quantity in quantities.items()
+        ])
+        # The ordered lines leave the cart and the holds go, together with the order
+        if cart is not None:
+            CartItem.objects.filter(cart=cart, fish_id__in=list(quantities)).delete()
+        if hold_owner is not None:
+            holds.release(hold_owner)
+        # Outbox: the follow-up jobs commit (or roll back) with the order
+        enqueue('order_confirmation_email', order_id=order.id)
+        enqueue('low_stock_alert', fish_ids=sorted(quantities), order_id=order.id)
+        # A sold-out fish leaves the listings; otherwise only stock moved
+        transaction.on_commit(bump_catalog_version if sold_out else bump_stock_version)
+    return order
+
+
+def place_order(user, quantities, cart=None, hold_owner=None, **order_fields):
+    """Create an order for {fish_id: kg}, taking the stock atomically.
+
+    ``order_fields`` are passed to Order (notes, payment_method,
+    delivery_address, ...). The ordered fish are removed from ``cart`` and
+    ``hold_owner``'s holds are released in the same transaction. Raises
+    OutOfStock if any line cannot be filled; then nothing changes.
+    """
+    quantities = {int(fish_id): Decimal(quantity) for fish_id, quantity in quantities.items()}
+    if not quantities or any(quantity <= 0 for quantity in quantities.values()):
+        raise ValueError('Invalid quantity')
+
+    return run_with_lock_retry(_place, user, quantities, order_fields, cart, hold_owner)
+
+
+# Order lifecycle: target status -> statuses it may be reached from
+ALLOWED_FROM = {
+    'confirmed': ('pending',),
+    'preparing': ('confirmed',),
+    'ready': ('preparing',),
+    'out_for_delivery': ('ready',),
+    'completed': ('ready', 'out_for_delivery'),  # picked up or delivered
+    'cancelled': ('pending', 'confirmed', 'preparing', 'ready'),
+}
+TRANSITION_BATCH_LIMIT = 1000
+
+
+def _restore_stock(order_ids, now):
+    """Put the quantities of cancelled orders back, one UPDATE per fish.
+
+    Returns whether a sold-out fish went back on sale.
+    """
+    quantities = list(
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('fish_id')
+        .annotate(quantity=Sum('quantity_kg'))
+        .order_by('fish_id')
+    )
+    reopened = Fish.objects.filter(id__in=[row['fish_id'] for row in quantities], stock_kg__lte=0).exists()
+    for row in quantities:
+        Fish.objects.filter(id=row['fish_id']).update(
+            stock_kg=F('stock_kg') + row['quantity'],
+            # Fish that place_order marked sold out are back on sale
+            is_available=Case(When(stock_kg__lte=0, then=Value(True)), default=F('is_available')),
+            updated_at=now,
+        )
+    return reopened
+
+
+def _publish_transitions(order_ids):
+    for order in Order.objects.filter(id__in=order_ids):
+        events.publish_order(order, False)
+
+
+def _transition(order_ids, status, allowed_from):
+    now = timezone.now()
+    with transaction.atomic():
+        matching = Order.objects.filter(id__in=order_ids, status__in=allowed_from)
+        # Lock the rows first so the ids reported are exactly the ones updated
+        ids = sorted(matching.select_for_update().values_list('id', flat=True))
+        if not ids:
+            return []
+        Order.objects.filter(id__in=ids, status__in=allowed_from).update(status=status, updated_at=now)
+        if status == stats.COMPLETED:
+            stats.apply_bulk_completion(ids)
+        elif status == 'cancelled':
+            reopened = _restore_stock(ids, now)
+            transaction.on_commit(bump_catalog_version if reopened else bump_stock_version)
+        transaction.on_commit(lambda: _publish_transitions(ids))
+    return ids
+
+
+def transition_orders(order_ids, status):
+    """Move every order in ``order_ids`` that may reach ``status`` to it, in one transaction.
+
+    Orders whose current status does not allow the move are left alone.
+    Returns the sorted ids that changed. Raises ValueError for an unknown
+    status or too many ids.
+    """
+    if not isinstance(status, str) or status not in ALLOWED_FROM:
+        raise ValueError(f'Cannot move orders to {status!r}')
+    try:
+        order_ids = {int(order_id) for order_id in order_ids}
+    except (TypeError, ValueError):
+        raise ValueError('Invalid order id')
+    if len(order_ids) > TRANSITION_BATCH_LIMIT:
+        raise ValueError(f'At most {TRANSITION_BATCH_LIMIT} orders per request')
+    if not order_ids:
+        return []
+
+    return run_with_lock_retry(_transition, order_ids, status, ALLOWED_FROM[status])
@@ -0,0 +1,283 @@
+"""
+Keyset (cursor) pagination.
+
+Paginator does a COUNT(*) plus OFFSET per page, so deep pages get slower the
+further you go. CursorPaginator instead remembers the ordering key of the last
+row it returned and asks for rows strictly after it, which stays an index
+range scan no matter how deep the page is.
+
+Usage::
+
+    paginator = CursorPaginator(Order.objects.filter(user=user).order_by('-created_at'), 10)
+    page_obj = paginator.get_page(request.GET)
+
+Rows that live in more than one table with the same ordering fields and a
+shared id space (live and archived orders, see myapp.archive) can be paged
+as one list by passing the other querysets as ``extra``.
+
+The cursor is opaque to the client: a urlsafe base64 blob holding the
+ordering values of the boundary row plus its id. Ordering keys must not be
+NULL.
+
+The same cursors drive ``changes_since``, which returns only the rows created
+or modified after a poll's cursor (keyset on ``updated_at``, id), so polling
+costs what changed rather than the size of the table.
+"""
+import base64
+import binascii
+import datetime
+import functools
+import hashlib
+import json
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+
+CURSOR_PARAM = 'cursor'
+SINCE_PARAM = 'since'
+TOTAL_CACHE_TIMEOUT = 60  # seconds
+# A change feed only serves rows changed before "now - SETTLE", so rows
+# written by transactions that commit a little after their updated_at are
+# still picked up by the next poll. Paging within that window is exact on
+# (updated_at, id), however many rows share one updated_at.
+SETTLE = datetime.timedelta(seconds=2)
+
+
+def _dump_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        # Keep full microsecond precision (DjangoJSONEncoder truncates it)
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': [_dump_value(v) for v in values], 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (values, direction) or None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values, direction = data['v'], data['d']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+    if direction not in ('n', 'p') or not isinstance(values, list):
+        return None
+    return values, direction
+
+
+class CursorPage:
+    """One page of results; iterable like a Paginator Page."""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, params=None, approximate_total=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_total = approximate_total
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _query(self, cursor):
+        params = self._params.copy() if self._params is not None else {}
+        if hasattr(params, 'setlist'):
+            params.setlist(CURSOR_PARAM, [cursor] if cursor else [])
+            return params.urlencode()
+        if cursor:
+            params[CURSOR_PARAM] = cursor
+        else:
+            params.pop(CURSOR_PARAM, None)
+        return urlencode(params)
+
+    @property
+    def next_query(self):
+        """Query string (without '?') for the next page, keeping other GET params."""
+        return self._query(self.next_cursor) if self.next_cursor else ''
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor) if self.previous_cursor else ''
+
+    @property
+    def first_query(self):
+        return self._query(None)
+
+
+class CursorPaginator:
+    """Paginate an ordered queryset with keyset cursors instead of OFFSET."""
+
+    def __init__(self, queryset, per_page, with_total=False, extra=()):
+        self.queryset = queryset
+        self.extra = list(extra)
+        self.per_page = int(per_page)
+        self.with_total = with_total
+        self.ordering = self._resolve_ordering(queryset)
+
+    @staticmethod
+    def _resolve_ordering(queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering or [])
+        ordering = [o for o in ordering if isinstance(o, str)]
+        if not ordering:
+            ordering = ['-pk']
+        names = [o.lstrip('-') for o in ordering]
+        if 'pk' not in names and 'id' not in names:
+            # id breaks ties so every row has a unique position
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def _keyset_filter(self, values, forward):
+        """Build (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... for the ordering."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _key(self, obj):
+        values = []
+        for field in self.ordering:
+            value = obj
+            for attr in field.lstrip('-').split('__'):
+                value = value.pk if attr == 'pk' else getattr(value, attr)
+            values.append(value)
+        return values
+
+    def _compare(self, a, b, forward):
+        for field, value_a, value_b in zip(self.ordering, self._key(a), self._key(b)):
+            if value_a != value_b:
+                a_first = (value_a < value_b) if field.startswith('-') != forward else (value_a > value_b)
+                return -1 if a_first else 1
+        return 0
+
+    def approximate_total(self):
+        """Row count cached briefly per query, so COUNT(*) runs at most once a minute."""
+        total = 0
+        for queryset in [self.queryset, *self.extra]:
+            sql, params = queryset.order_by().query.sql_with_params()
+            key = 'cursor_total_' + hashlib.md5(f'{sql}|{params}'.encode()).hexdigest()
+            count = cache.get(key)
+            if count is None:
+                count = queryset.order_by().count()
+                cache.set(key, count, TOTAL_CACHE_TIMEOUT)
+            total += count
+        return total
+
+    def get_page(self, params=None):
+        """Return the page addressed by ``params['cursor']`` (first page if absent or invalid).
+
+        ``params`` is usually ``request.GET``; it is also used to build the
+        next/previous query strings.
+        """
+        raw = params.get(CURSOR_PARAM) if params is not None else None
+        decoded = decode_cursor(raw)
+        if decoded is not None and len(decoded[0]) != len(self.ordering):
+            decoded = None
+
+        querysets = [self.queryset, *self.extra]
+        forward = True
+        if decoded is not None:
+            values, direction = decoded
+            try:
+                condition = self._keyset_filter(values, direction == 'n')
+                querysets = [qs.filter(condition) for qs in querysets]
+                forward = direction == 'n'
+            except (ValidationError, ValueError, TypeError):
+                # Tampered cursor values; start over from the first page
+                decoded = None
+                querysets = [self.queryset, *self.extra]
+
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = [o[1:] if o.startswith('-') else f'-{o}' for o in self.ordering]
+
+        rows = []
+        for qs in querysets:
+            rows.extend(qs.order_by(*ordering)[:self.per_page + 1])
+        if len(querysets) > 1:
+            rows.sort(key=functools.cmp_to_key(lambda a, b: self._compare(a, b, forward)))
+            rows = rows[:self.per_page + 1]
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if (forward and has_more) or (not forward and decoded is not None):
+                next_cursor = encode_cursor(self._key(rows[-1]), 'n')
+            if (forward and decoded is not None) or (not forward and has_more):
+                previous_cursor = encode_cursor(self._key(rows[0]), 'p')
+
+        total = self.approximate_total() if self.with_total else None
+        return CursorPage(rows, next_cursor, previous_cursor, params=params, approximate_total=total)
+
+
+def _settled_cursor(key):
+    settle = timezone.now() - SETTLE
+    if key is None or key[0] > settle:
+        return encode_cursor([settle, 0], 'n')
+    return encode_cursor(key, 'n')
+
+
+def feed_cursor(queryset, field='updated_at'):
+    """Cursor marking "now" for ``queryset``: pass it as ``since`` on the next poll."""
+    latest = queryset.order_by(f'-{field}', '-id').values_list(field, 'id').first()
+    return _settled_cursor(latest)
+
+
+def changes_since(queryset, cursor, limit, field='updated_at'):
+    """Rows created or modified after ``cursor``, oldest change first.
+
+    Returns (rows, next_cursor, has_more), or None if the cursor is missing or
+    malformed (the caller should then send a full listing with feed_cursor).
+    When ``has_more`` is true the client should poll again right away. Rows
+    changed in the last SETTLE are left for a later poll.
+    """
+    decoded = decode_cursor(cursor)
+    if decoded is None or len(decoded[0]) != 2:
+        return None
+    (changed_at, last_id), _ = decoded
+    after = Q(**{f'{field}__gt': changed_at}) | Q(**{field: changed_at, 'id__gt': last_id})
+    try:
+        rows = list(
+            queryset.filter(after, **{f'{field}__lte': timezone.now() - SETTLE})
+            .order_by(field, 'id')[:limit + 1]
+        )
+    except (ValidationError, ValueError, TypeError):
+        return None
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return rows, cursor, False
+    return rows, encode_cursor([getattr(rows[-1], field), rows[-1].id], 'n'), has_more
@@ -0,0 +1,132 @@
+"""
+"Frequently bought together" recommendations.
+
+The co-purchase matrix is built offline (``manage.py build_recommendations``)
+from OrderItem rows grouped by order, and the top-K neighbours of each fish
+are stored in FishRecommendation. Request-time lookups are a primary-key read
+plus one fetch of the neighbour Fish rows.
+"""
+from array import array
+from itertools import chain
+
+from django.db import transaction
+
+from .catalog import bump_catalog_version
+from .models import ArchivedOrderItem, Fish, FishRecommendation, OrderItem
+
+TOP_K = 8
+
+
+def _order_lines(chunk_size):
+    """Yield (order_id, fish_id) pairs for non-cancelled live and archived orders."""
+    return chain.from_iterable(
+        model.objects.exclude(order__status='cancelled')
+        .order_by('order_id', 'fish_id')
+        .values_list('order_id', 'fish_id')
+        .iterator(chunk_size=chunk_size)
+        for model in (OrderItem, ArchivedOrderItem)
+    )
+
+
+def compute_copurchase_topk(order_ids, fish_ids, top_k=TOP_K):
+    """Top-K co-purchased neighbours per fish from parallel order/fish id arrays.
+
+    Returns {fish_id: [(neighbour_id, count), ...]} with the most frequent
+    neighbour first. The matrix is never materialized densely: pair counts are
+    kept as sorted (pair code, count) arrays.
+    """
+    import numpy as np  # only needed by the offline batch job
+
+    order_ids = np.asarray(order_ids, dtype=np.int64)
+    fish_ids = np.asarray(fish_ids, dtype=np.int64)
+    if order_ids.size == 0:
+        return {}
+
+    # Dense fish indices and rows grouped by order
+    fish_values, fish_index = np.unique(fish_ids, return_inverse=True)
+    n_fish = fish_values.size
+    order = np.lexsort((fish_index, order_ids))
+    order_ids, fish_index = order_ids[order], fish_index[order]
+
+    # For every line, pair it with every line of the same order
+    boundaries = np.flatnonzero(np.diff(order_ids)) + 1
+    starts = np.concatenate(([0], boundaries))
+    sizes = np.diff(np.concatenate((starts, [order_ids.size])))
+    line_start = np.repeat(starts, sizes)
+    line_size = np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(order_ids.size), line_size)
+    offsets = np.arange(left.size) - np.repeat(np.cumsum(line_size) - line_size, line_size)
+    right = np.repeat(line_start, line_size) + offsets
+    keep = left != right
+    a, b = fish_index[left[keep]], fish_index[right[keep]]
+
+    # Sparse counts: one code per (a, b) cell
+    codes, counts = np.unique(a * n_fish + b, return_counts=True)
+    a, b = codes // n_fish, codes % n_fish
+
+    # Rank neighbours within each fish: by count desc, then fish id asc
+    rank_order = np.lexsort((b, -counts, a))
+    a, b, counts = a[rank_order], b[rank_order], counts[rank_order]
+    group_start = np.concatenate(([0], np.flatnonzero(np.diff(a)) + 1))
+    position = np.arange(a.size) - np.repeat(group_start, np.diff(np.concatenate((group_start, [a.size]))))
+    top = position < top_k
+    a, b, counts = a[top], b[top], counts[top]
+
+    result = {}
+    for fish, neighbour, count in zip(fish_values[a].tolist(), fish_values[b].tolist(), counts.tolist()):
+        result.setdefault(fish, []).append((neighbour, count))
+    return result
+
+
+def build_recommendations(top_k=TOP_K, chunk_size=10000, batch_size=500):
+    """Recompute and store every fish's neighbours. Returns the number of fish stored."""
+    import numpy as np
+
+    # Typed arrays keep millions of lines at 16 bytes each
+    order_ids, fish_ids = array('q'), array('q')
+    for order_id, fish_id in _order_lines(chunk_size):
+        order_ids.append(order_id)
+        fish_ids.append(fish_id)
+    neighbours = compute_copurchase_topk(
+        np.frombuffer(order_ids, dtype=np.int64) if order_ids else [],
+        np.frombuffer(fish_ids, dtype=np.int64) if fish_ids else [],
+        top_k=top_k,
+    )
+
+    rows = [
+        FishRecommendation(
+            fish_id=fish_id,
+            fish_ids=[n for n, _ in pairs],
+            scores=[c for _, c in pairs],
+        )
+        for fish_id, pairs in neighbours.items()
+    ]
+    with transaction.atomic():
+        FishRecommendation.objects.all().delete()
+        FishRecommendation.objects.bulk_create(rows, batch_size=batch_size)
+        # Cached pages and validators must not keep serving the old neighbours
+        transaction.on_commit(bump_catalog_version)
+    return len(rows)
+
+
+def recommended_fish(fish_ids, limit=4):
+    """Available fish most often bought together with ``fish_ids``, best first.
+
+    Scores of several source fish (e.g. a whole cart) are summed. Returns an
+    empty list when nothing has been built yet.
+    """
+    fish_ids = set(fish_ids)
+    if not fish_ids:
+        return []
+    scores = {}
+    for rec in FishRecommendation.objects.filter(fish_id__in=fish_ids):
+        for neighbour, count in zip(rec.fish_ids, rec.scores):
+            if neighbour not in fish_ids:
+                scores[neighbour] = scores.get(neighbour, 0) + count
+    if not scores:
+        return []
+    ranked = sorted(scores, key=lambda n: (-scores[n], n))
+    # At most TOP_K neighbours per source fish, so one query covers them all
+    # and unavailable top picks never leave the list short
+    fish_by_id = Fish.objects.filter(id__in=ranked, is_available=True).in_bulk()
+    return [fish_by_id[n] for n in ranked if n in fish_by_id][:limit]
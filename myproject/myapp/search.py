@@ -0,0 +1,162 @@
+"""
+Full-text search for the fish catalog.
+
+SQLite uses an FTS5 virtual table (``myapp_fish_fts``) keyed by the fish id
+and kept in sync from the Fish post_save/post_delete signals. PostgreSQL uses
+an expression GIN index over ``to_tsvector(name || description)`` so no
+sync is needed there. Any other backend falls back to ``icontains``.
+"""
+import logging
+import re
+
+from django.db import DatabaseError, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'myapp_fish_fts'
+PG_INDEX = 'myapp_fish_search_gin'
+PG_VECTOR = "to_tsvector('simple', coalesce(myapp_fish.name, '') || ' ' || coalesce(myapp_fish.description, ''))"
+
+# Name hits weigh more than description hits in the BM25 score
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# (alias, database name) pairs whose index is known to exist
+_ready = set()
+# Aliases where the index could not be created (e.g. SQLite built without FTS5)
+_unsupported = set()
+
+
+def _key(connection):
+    return (connection.alias, str(connection.settings_dict.get('NAME')))
+
+
+def search_terms(query):
+    """Split a raw search string into lowercase word tokens."""
+    return re.findall(r'\w+', (query or '').lower())
+
+
+def ensure_search_index(using='default'):
+    """Create (and backfill) the search index if it does not exist yet.
+
+    Returns True when indexed search is available on this connection.
+    """
+    connection = connections[using]
+    key = _key(connection)
+    if key in _ready:
+        return True
+    if key in _unsupported:
+        return False
+
+    vendor = connection.vendor
+    try:
+        with connection.cursor() as cursor:
+            if vendor == 'sqlite':
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+                )
+                if cursor.fetchone() is None:
+                    cursor.execute(
+                        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                        "name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+                    )
+                    cursor.execute(
+                        f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+                        "SELECT id, name, description FROM myapp_fish"
+                    )
+            elif vendor == 'postgresql':
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON myapp_fish USING GIN ({PG_VECTOR})"
+                )
+            else:
+                _unsupported.add(key)
+                return False
+    except DatabaseError as e:
+        logger.warning(f'Full-text search index unavailable on {using}: {e}')
+        _unsupported.add(key)
+        return False
+
+    _ready.add(key)
+    return True
+
+
+def rebuild_search_index(using='default'):
+    """Drop and repopulate the SQLite FTS table from myapp_fish."""
+    connection = connections[using]
+    key = _key(connection)
+    _ready.discard(key)
+    _unsupported.discard(key)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    return ensure_search_index(using)
+
+
+def index_fish(fish, using='default'):
+    """Insert or refresh one fish row in the FTS table."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not ensure_search_index(using):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [fish.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)",
+            [fish.pk, fish.name or '', fish.description or ''],
+        )
+
+
+def unindex_fish(fish_id, using='default'):
+    """Remove one fish row from the FTS table."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not ensure_search_index(using):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [fish_id])
+
+
+def search_fish(queryset, query):
+    """Filter a Fish queryset by a search string.
+
+    Matching is prefix-based on every word (all words must match). The result
+    is annotated with ``search_rank`` where lower is better, so callers can
+    ``order_by('search_rank')``. Returns the queryset unchanged for an empty
+    query.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+
+    using = queryset.db
+    vendor = connections[using].vendor
+
+    if ensure_search_index(using):
+        if vendor == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            # One join to the FTS table: MATCH runs once and bm25() reads the
+            # matched row, so ordering and keyset filters on search_rank reuse it
+            return queryset.extra(
+                tables=[FTS_TABLE],
+                where=[f'{FTS_TABLE}.rowid = myapp_fish.id', f'{FTS_TABLE} MATCH %s'],
+                params=[match],
+            ).annotate(search_rank=RawSQL(
+                f'bm25({FTS_TABLE}, %s, %s)', [NAME_WEIGHT, DESCRIPTION_WEIGHT], output_field=FloatField()
+            ))
+
+        if vendor == 'postgresql':
+            tsquery = ' & '.join(f'{term}:*' for term in terms)
+            # ts_rank_cd is higher-is-better; negate so ordering matches bm25()
+            rank = RawSQL(
+                f"-ts_rank_cd({PG_VECTOR}, to_tsquery('simple', %s))", [tsquery], output_field=FloatField()
+            )
+            # Same expression as the GIN index, so the planner uses it directly
+            return queryset.extra(
+                where=[f"{PG_VECTOR} @@ to_tsquery('simple', %s)"], params=[tsquery]
+            ).annotate(search_rank=rank)
+
+    # Fallback: unindexed substring scan
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
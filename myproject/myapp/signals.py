@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import CartItem, Fish, FishCategory, Order, OrderFeedback
+from . import cart, catalog, events, order_filters, search, stats
+
+
+@receiver(post_save, sender=Fish)
+def fish_saved(sender, instance, using, **kwargs):
+    """Keep the full-text search index in sync with Fish edits."""
+    search.index_fish(instance, using=using)
+    catalog.bump_catalog_version()
+
+
+@receiver(post_delete, sender=Fish)
+def fish_deleted(sender, instance, using, **kwargs):
+    search.unindex_fish(instance.pk, using=using)
+    catalog.bump_catalog_version()
+
+
+@receiver(post_save, sender=FishCategory)
+@receiver(post_delete, sender=FishCategory)
+def category_changed(sender, **kwargs):
+    catalog.bump_catalog_version()
+
+
+def create_search_index(sender, using='default', **kwargs):
+    """Create the search index after migrate so the first query doesn't pay for it."""
+    search.ensure_search_index(using)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    """Move sales/rating counters when an order enters or leaves 'completed'; notify live streams."""
+    previous = None if created else getattr(instance, '_original_status', None)
+    if previous != instance.status:
+        if instance.status == stats.COMPLETED:
+            stats.apply_order_completion(instance, 1)
+        elif previous == stats.COMPLETED:
+            stats.apply_order_completion(instance, -1)
+        transaction.on_commit(lambda: events.publish_order(instance, created))
+    instance._original_status = instance.status
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance, **kwargs):
+    # Ratings are removed by the cascaded OrderFeedback delete below
+    if getattr(instance, '_original_status', instance.status) == stats.COMPLETED:
+        stats.apply_order_quantities(instance, -1)
+
+
+@receiver(post_save, sender=OrderFeedback)
+def feedback_saved(sender, instance, created, **kwargs):
+    if created and instance.order.status == stats.COMPLETED:
+        stats.apply_feedback(instance, 1)
+
+
+@receiver(pre_delete, sender=OrderFeedback)
+def feedback_deleting(sender, instance, **kwargs):
+    if instance.order.status == stats.COMPLETED:
+        stats.apply_feedback(instance, -1)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(pre_delete, sender=CartItem)
+def cart_item_changed(sender, instance, **kwargs):
+    """Drop cached cart counters for changes made outside the cart views."""
+    cart.invalidate_cart_counters(instance.cart.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    """Keep the customer search keys in sync with username and name edits."""
+    # Logins save only last_login
+    if update_fields is not None and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        return
+    order_filters.index_customer(instance)
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    """Carry an anonymous visitor's session cart over on login or registration."""
+    if request is not None and hasattr(request, 'session'):
+        cart.merge_guest_cart(request, user)
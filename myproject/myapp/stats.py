@@ -0,0 +1,110 @@
+"""
+Incremental maintenance of the Fish rating/sales counters.
+
+Fish.rating_sum, rating_count and sold_kg only count completed orders, so
+they change when an order enters or leaves 'completed' and when feedback is
+added to or removed from a completed order. Updates use F() expressions so
+concurrent writers don't lose increments.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import ArchivedOrderItem, Fish, OrderFeedback, OrderItem
+
+COMPLETED = 'completed'
+
+
+def _order_lines(order_id):
+    return list(OrderItem.objects.filter(order_id=order_id).values_list('fish_id', 'quantity_kg'))
+
+
+def apply_order_completion(order, sign):
+    """Add (sign=1) or remove (sign=-1) an order's quantities and rating from its fish."""
+    lines = _order_lines(order.pk)
+    if not lines:
+        return
+    rating = OrderFeedback.objects.filter(order_id=order.pk).values_list('rating', flat=True).first()
+    with transaction.atomic():
+        for fish_id, quantity in lines:
+            updates = {'sold_kg': F('sold_kg') + sign * quantity}
+            if rating is not None:
+                updates['rating_sum'] = F('rating_sum') + sign * rating
+                updates['rating_count'] = F('rating_count') + sign
+            Fish.objects.filter(pk=fish_id).update(**updates)
+
+
+def apply_order_quantities(order, sign):
+    """Add or remove only the sold quantities of a completed order."""
+    lines = _order_lines(order.pk)
+    with transaction.atomic():
+        for fish_id, quantity in lines:
+            Fish.objects.filter(pk=fish_id).update(sold_kg=F('sold_kg') + sign * quantity)
+
+
+def apply_feedback(feedback, sign):
+    """Add or remove one feedback rating on every fish in its (completed) order."""
+    fish_ids = OrderItem.objects.filter(order_id=feedback.order_id).values_list('fish_id', flat=True)
+    Fish.objects.filter(pk__in=list(fish_ids)).update(
+        rating_sum=F('rating_sum') + sign * feedback.rating,
+        rating_count=F('rating_count') + sign,
+    )
+
+
+def apply_bulk_completion(order_ids):
+    """Add the quantities and ratings of newly completed orders, one UPDATE per fish."""
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('fish_id')
+        .annotate(
+            sold=Sum('quantity_kg'),
+            rating_total=Sum('order__feedback__rating'),
+            ratings=Count('order__feedback__id'),
+        )
+        .order_by('fish_id')
+    )
+    for row in rows:
+        Fish.objects.filter(pk=row['fish_id']).update(
+            sold_kg=F('sold_kg') + row['sold'],
+            rating_sum=F('rating_sum') + (row['rating_total'] or 0),
+            rating_count=F('rating_count') + row['ratings'],
+        )
+
+
+def recompute_fish_stats(batch_size=500):
+    """Rebuild every Fish counter from one grouped query per table (live and archived orders).
+
+    Returns the number of fish updated.
+    """
+    totals = {}
+    for model in (OrderItem, ArchivedOrderItem):
+        rows = (
+            model.objects.filter(order__status=COMPLETED)
+            .values('fish_id')
+            .annotate(
+                sold=Sum('quantity_kg'),
+                rating_total=Sum('order__feedback__rating'),
+                ratings=Count('order__feedback__id'),
+            )
+            .order_by()
+        )
+        for row in rows:
+            total = totals.setdefault(row['fish_id'], {'sold': Decimal('0.00'), 'rating_total': 0, 'ratings': 0})
+            total['sold'] += row['sold'] or 0
+            total['rating_total'] += row['rating_total'] or 0
+            total['ratings'] += row['ratings'] or 0
+
+    changed = []
+    for fish in Fish.objects.only('id', 'rating_sum', 'rating_count', 'sold_kg').iterator(chunk_size=batch_size):
+        row = totals.get(fish.id, {})
+        sold = row.get('sold') or Decimal('0.00')
+        rating_sum = row.get('rating_total') or 0
+        rating_count = row.get('ratings') or 0
+        if (fish.sold_kg, fish.rating_sum, fish.rating_count) != (sold, rating_sum, rating_count):
+            fish.sold_kg, fish.rating_sum, fish.rating_count = sold, rating_sum, rating_count
+            changed.append(fish)
+
+    with transaction.atomic():
+        Fish.objects.bulk_update(changed, ['sold_kg', 'rating_sum', 'rating_count'], batch_size=batch_size)
+    return len(changed)
@@ -0,0 +1,162 @@
+"""
+In-memory prefix index for search-box suggestions.
+
+Each worker process keeps a sorted array of lowercase word keys (every word
+of every fish and category name) and answers a prefix with two bisects, so a
+keystroke never touches the database. After the catalog names version
+changes (see myapp.catalog: names, categories, availability, but not the
+stock moves of every checkout), or after MAX_AGE seconds so stock and
+popularity ranks stay fresh, the next lookup starts a rebuild in a
+background thread and keeps answering from the previous index until the new
+one is swapped in. Only the very first lookup in a process builds the index
+inline.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from itertools import islice
+from operator import itemgetter
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from .catalog import get_names_version
+from .models import Fish, FishCategory
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE = 10 * 60  # seconds
+DEFAULT_LIMIT = 8
+# One- and two-letter prefixes cover the most words, so their top results are precomputed
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+
+class PrefixIndex:
+    """Sorted word array with ranked prefix lookup.
+
+    Entries are grouped by word and each group is kept in rank order, so a
+    prefix only has to merge the already-sorted groups of the words it
+    covers and stop after ``limit`` distinct results.
+    """
+
+    def __init__(self, entries, limit=DEFAULT_LIMIT):
+        # entries: dicts with 'label', 'type', 'id', 'url' and a sortable 'rank' (lower is better)
+        by_word = {}
+        for entry in entries:
+            entry['sort_key'] = (entry['rank'], entry['label'].lower())
+            for word in set(re.findall(r'\w+', entry['label'].lower())):
+                by_word.setdefault(word, []).append(entry)
+        self.words = sorted(by_word)
+        self.groups = [sorted(by_word[word], key=itemgetter('sort_key')) for word in self.words]
+        self.limit = limit
+        self.top = {}
+        for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1):
+            for prefix in {word[:length] for word in self.words if len(word) >= length}:
+                self.top[prefix] = list(islice(self._ranked(prefix), limit))
+
+    def _ranked(self, prefix):
+        """Entries whose words start with ``prefix``, best first, without duplicates."""
+        lo = bisect_left(self.words, prefix)
+        hi = bisect_left(self.words, prefix + '\uffff', lo)
+        seen = set()
+        for entry in heapq.merge(*self.groups[lo:hi], key=itemgetter('sort_key')):
+            marker = (entry['type'], entry['id'])
+            if marker not in seen:
+                seen.add(marker)
+                yield entry
+
+    def lookup(self, query, limit=None):
+        limit = min(limit or self.limit, self.limit)
+        words = re.findall(r'\w+', (query or '').lower())
+        if not words:
+            return []
+        if len(words) == 1 and words[0] in self.top:
+            return self.top[words[0]][:limit]
+        # Rank by the last (partially typed) word, then require the earlier words
+        earlier = [re.compile(rf'\b{re.escape(w)}') for w in words[:-1]]
+        results = []
+        for entry in self._ranked(words[-1]):
+            if all(pattern.search(entry['label'].lower()) for pattern in earlier):
+                results.append(entry)
+                if len(results) == limit:
+                    break
+        return results
+
+
+def _build_entries():
+    entries = []
+    fish_rows = Fish.objects.filter(is_available=True).values('id', 'name', 'stock_kg', 'sold_kg')
+    for row in fish_rows:
+        in_stock = row['stock_kg'] > 0
+        entries.append({
+            'label': row['name'],
+            'type': 'fish',
+            'id': row['id'],
+            'url': reverse('fish_detail', args=[row['id']]),
+            # In-stock fish first, then best sellers
+            'rank': (0 if in_stock else 1, -float(row['sold_kg'])),
+        })
+    categories = FishCategory.objects.annotate(
+        available=Count('fish', filter=Q(fish__is_available=True))
+    ).values('id', 'name', 'available')
+    for row in categories:
+        entries.append({
+            'label': row['name'],
+            'type': 'category',
+            'id': row['id'],
+            'url': f"{reverse('fish_list')}?category={row['id']}",
+            'rank': (0 if row['available'] else 1, -row['available']),
+        })
+    return entries
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'version': None, 'built_at': 0.0, 'builder': None}
+
+
+def _is_fresh(version):
+    return _state['version'] == version and time.monotonic() - _state['built_at'] <= MAX_AGE
+
+
+def _build(version):
+    index = PrefixIndex(_build_entries())
+    _state.update(index=index, version=version, built_at=time.monotonic())
+
+
+def _build_in_background(version):
+    try:
+        _build(version)
+    except Exception as e:
+        # Keep serving the previous index; the next lookup tries again
+        logger.error(f'Suggest index rebuild failed: {str(e)}', exc_info=True)
+    finally:
+        _state['builder'] = None
+        # This thread's own database connection
+        connection.close()
+
+
+def get_index():
+    """The process-wide index; a stale one is returned while its replacement builds."""
+    version = get_names_version()
+    if _state['index'] is not None and _is_fresh(version):
+        return _state['index']
+    with _lock:
+        if _state['index'] is None:
+            _build(version)
+        elif not _is_fresh(version) and _state['builder'] is None:
+            builder = threading.Thread(target=_build_in_background, args=(version,), daemon=True)
+            _state['builder'] = builder
+            builder.start()
+    return _state['index']
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    """Top suggestions for a partially typed query, as JSON-ready dicts."""
+    return [
+        {'label': e['label'], 'type': e['type'], 'id': e['id'], 'url': e['url']}
+        for e in get_index().lookup(query, limit)
+    ]
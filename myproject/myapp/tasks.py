@@ -0,0 +1,82 @@
+"""
+Job handlers for side effects of orders and feedback (see myapp.jobs).
+
+Handlers re-read their rows by id, since the state may have moved on between
+enqueue and run, and let errors propagate so the worker retries them.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+
+from .jobs import job
+from .models import Fish, Message, Order, OrderFeedback
+
+LOW_STOCK_THRESHOLD = Decimal('5.00')
+
+
+def _admin_user():
+    # Same routing as order_detail: the first staff user receives buyer messages
+    return User.objects.filter(is_staff=True).order_by('id').first()
+
+
+@job('order_confirmation_email')
+def order_confirmation_email(order_id):
+    order = Order.objects.select_related('user').filter(id=order_id).first()
+    if order is None or not order.user.email:
+        return
+    lines = [
+        f'- {item.fish.name}: {item.quantity_kg}kg x ₱{item.unit_price}'
+        for item in order.items.select_related('fish')
+    ]
+    send_mail(
+        subject=f'DailyFish order #{order.id} received',
+        message='\n'.join([
+            f'Hi {order.user.get_full_name() or order.user.username},',
+            '',
+            f'We received your order #{order.id}:',
+            *lines,
+            '',
+            f'Total: ₱{order.total_amount}',
+            f'Payment: {order.get_payment_method_display()}',
+        ]),
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        recipient_list=[order.user.email],
+    )
+
+
+@job('low_stock_alert')
+def low_stock_alert(fish_ids, order_id=None):
+    """Tell the admin which of the just-sold fish are running low."""
+    admin_user = _admin_user()
+    low = list(
+        Fish.objects.filter(id__in=fish_ids, stock_kg__lte=LOW_STOCK_THRESHOLD)
+        .order_by('name')
+        .values_list('name', 'stock_kg')
+    )
+    if admin_user is None or not low:
+        return
+    Message.objects.create(
+        sender=admin_user,
+        recipient=admin_user,
+        message_type='product',
+        subject=f'Low stock alert after order #{order_id}' if order_id else 'Low stock alert',
+        content='\n'.join(f'{name}: {stock}kg left' for name, stock in low),
+    )
+
+
+@job('feedback_admin_message')
+def feedback_admin_message(feedback_id):
+    """Open a message thread to the admin so the buyer can track their feedback."""
+    feedback = OrderFeedback.objects.select_related('order', 'buyer').filter(id=feedback_id).first()
+    admin_user = _admin_user()
+    if feedback is None or admin_user is None:
+        return
+    Message.objects.create(
+        sender=feedback.buyer,
+        recipient=admin_user,
+        message_type='product',
+        subject=f'Feedback for Order #{feedback.order_id}',
+        content=f'Rating: {feedback.rating}\nComment: {feedback.comment or "(no comment)"}',
+    )
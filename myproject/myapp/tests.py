@@ -1,3 +1,1259 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+import threading
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import login
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Q, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .archive import archive_orders, find_order, user_archived_orders
+from .cart import apply_cart_batch, get_cart_counters, get_guest_cart, save_guest_cart, sweep_stale_carts
+from .catalog import bump_catalog_version, category_counts, featured_fish, get_names_version
+from .conditional import admin_orders_etag, fish_detail_etag, fish_list_etag
+from .events import order_event, order_event_stream, order_events
+from .context_processors import cart_info
+from .exports import export_orders
+from .facets import filter_fish, get_facets, normalize_filters
+from .holds import (
+    active_holds, available_stock, expire_holds, hold_owner, reserve as reserve_stock, user_owner,
+    with_available_stock,
+)
+from .models import (
+    SHIPPING_FEE, ArchivedOrder, ArchivedOrderFeedback, ArchivedOrderItem, Cart, CartItem, Fish, FishCategory, Job,
+    Message, Order, OrderFeedback, OrderItem, StockHold,
+)
+from .order_filters import (
+    filter_admin_orders, filter_archived_orders, filter_orders, normalize_order_filters, rebuild_customer_keys,
+)
+from .orders import OutOfStock, place_order, transition_orders
+from .pagination import CursorPaginator, encode_cursor
+from .recommendations import build_recommendations, recommended_fish
+from .search import search_fish
+from .stats import recompute_fish_stats
+from . import jobs, suggest, views
+
+
+def make_buyer(username='buyer', **fields):
+    """A customer account; every test user has the password 'x'."""
+    return User.objects.create_user(username=username, password='x', **fields)
+
+
+def make_fish(name='Tuna', description=None, price='300.00', stock='10.00', category='Saltwater', **fields):
+    """A fish whose description is its name; ``category`` is an instance or a name created on first use."""
+    if isinstance(category, str):
+        category, _ = FishCategory.objects.get_or_create(name=category)
+    return Fish.objects.create(
+        name=name, description=name if description is None else description, category=category,
+        price_per_kg=Decimal(price), stock_kg=Decimal(stock), **fields,
+    )
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite-specific')
+class QueryPlanTests(TestCase):
+    """The hot query shapes must be answered from an index, never a full table scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_buyer()
+        cls.admin = make_buyer('staff', is_staff=True)
+        cls.fish = make_fish()
+        cls.category = cls.fish.category
+        cls.order = Order.objects.create(user=cls.buyer, status='completed')
+        OrderItem.objects.create(order=cls.order, fish=cls.fish, quantity_kg=Decimal('1.00'), unit_price=Decimal('300.00'))
+        OrderFeedback.objects.create(order=cls.order, buyer=cls.buyer, rating=5)
+        Message.objects.create(sender=cls.buyer, recipient=cls.admin, subject='Hi', content='Hello')
+
+    def assertNoFullScan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        full_scans = [step for step in plan if re.fullmatch(r'SCAN (TABLE )?\w+( AS \w+)?', step)]
+        self.assertEqual(full_scans, [], f'Full scan in plan for:\n{sql}\n' + '\n'.join(plan))
+
+    def admin_request(self, **params):
+        request = RequestFactory().get('/admin-panel/orders/data/', params)
+        request.user = self.admin
+        return request
+
+    def test_fish_list(self):
+        base = Fish.objects.filter(is_available=True)
+        self.assertNoFullScan(filter_fish(base, normalize_filters({})).order_by('name'))
+        filters = normalize_filters({'category': str(self.category.id)})
+        self.assertNoFullScan(filter_fish(base, filters).order_by('name'))
+
+    def test_order_history(self):
+        self.assertNoFullScan(Order.objects.filter(user=self.buyer).order_by('-created_at'))
+
+    def test_admin_orders_data(self):
+        self.assertNoFullScan(views._filter_admin_orders(self.admin_request()).order_by('-created_at')[:200])
+        self.assertNoFullScan(
+            views._filter_admin_orders(self.admin_request(status='pending')).order_by('-created_at')[:200]
+        )
+        ranged = self.admin_request(**{'from': '2024-01-01', 'to': '2024-01-31T12:00'})
+        self.assertNoFullScan(views._filter_admin_orders(ranged).order_by('-created_at')[:200])
+        self.assertNoFullScan(views._filter_admin_orders(self.admin_request(user='BUY')).order_by('-created_at')[:200])
+
+    def test_admin_order_filters(self):
+        filters = normalize_order_filters({'from': '2024-01-01', 'to': '2024-01-31', 'user': 'Búyer x', 'status': 'nope'})
+        self.assertEqual(filters['to'] - filters['from'], timedelta(days=31))
+        self.assertEqual((filters['customer'], filters['status']), (['buyer', 'x'], ''))
+        self.assertEqual(list(filter_orders(Order.objects.all(), normalize_order_filters({'user': 'buy'}))), [self.order])
+        self.assertFalse(filter_orders(Order.objects.all(), normalize_order_filters({'user': 'buy x'})).exists())
+
+    def test_order_change_feeds(self):
+        since = Q(updated_at__gt=self.order.updated_at) | Q(updated_at=self.order.updated_at, id__gt=self.order.id)
+        self.assertNoFullScan(Order.objects.filter(since).order_by('updated_at', 'id')[:201])
+        self.assertNoFullScan(Order.objects.filter(since, user=self.buyer).order_by('updated_at', 'id')[:201])
+
+    def test_message_center(self):
+        self.assertNoFullScan(
+            Message.objects.filter(Q(sender=self.buyer) | Q(recipient=self.buyer)).order_by('-created_at').distinct()
+        )
+        self.assertNoFullScan(Message.objects.filter(recipient=self.buyer, is_read=False))
+
+    def test_fish_detail(self):
+        self.assertNoFullScan(
+            Fish.objects.filter(category=self.category, is_available=True).exclude(id=self.fish.id)[:4]
+        )
+        self.assertNoFullScan(views._fish_reviews(self.fish))
+        self.assertNoFullScan(
+            OrderItem.objects.filter(order__user=self.buyer, order__status='completed', fish=self.fish)
+        )
+
+    def test_stock_holds(self):
+        self.assertNoFullScan(with_available_stock(Fish.objects.filter(id__in=[self.fish.id]), exclude_owner='u:1'))
+        self.assertNoFullScan(active_holds().filter(fish=self.fish).values('fish').annotate(total=Sum('quantity_kg')))
+
+
+class SearchTests(TestCase):
+    """Catalog search: prefix matching, name hits ranked first, safe with any input."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, description in [
+            ('Salmon', 'Tastes a little like tuna'),
+            ('Tuna', 'Fresh yellowfin'),
+            ('Tuna Belly', 'Fatty cut'),
+            ('Tilapia', 'Farmed'),
+        ]:
+            make_fish(name, description=description, price='100.00', stock='5.00')
+
+    def names(self, query):
+        return [fish.name for fish in search_fish(Fish.objects.all(), query).order_by('search_rank', 'name')]
+
+    def test_name_hits_rank_first(self):
+        self.assertEqual(self.names('tun')[-1], 'Salmon')
+        self.assertEqual(sorted(self.names('tun')[:2]), ['Tuna', 'Tuna Belly'])
+        self.assertEqual(self.names('tuna bel'), ['Tuna Belly'])
+
+    def test_empty_query_returns_queryset_unchanged(self):
+        queryset = Fish.objects.all()
+        self.assertIs(search_fish(queryset, '  '), queryset)
+        self.assertIs(search_fish(queryset, '"*()'), queryset)
+
+    def test_fts_syntax_is_not_interpreted(self):
+        self.assertEqual(self.names('tuna" OR * NEAR('), [])
+        self.assertEqual(sorted(self.names('"tuna"*')), ['Salmon', 'Tuna', 'Tuna Belly'])
+        self.assertEqual(self.names('NOT'), [])
+
+    def test_cursor_pages_over_ranked_results(self):
+        paginator = CursorPaginator(search_fish(Fish.objects.all(), 'tuna').order_by('search_rank', 'name'), 1)
+        page = paginator.get_page({})
+        seen = [fish.name for fish in page]
+        while page.has_next():
+            page = paginator.get_page({'cursor': page.next_cursor})
+            seen += [fish.name for fish in page]
+        self.assertEqual(seen, self.names('tuna'))
+
+
+class CursorPaginationTests(TestCase):
+    """Keyset pages must cover every row exactly once, even when the ordering key ties."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_buyer()
+        orders = Order.objects.bulk_create([Order(user=cls.buyer) for _ in range(7)])
+        # Five orders share one created_at, so only the id tiebreaker separates them
+        tied = orders[0].created_at
+        Order.objects.filter(id__in=[o.id for o in orders[1:6]]).update(created_at=tied)
+        cls.queryset = Order.objects.filter(user=cls.buyer).order_by('-created_at')
+        cls.expected = list(cls.queryset.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_forward_and_back_across_ties(self):
+        paginator = CursorPaginator(self.queryset, 2)
+        pages = [paginator.get_page({})]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page({'cursor': pages[-1].next_cursor}))
+        self.assertEqual([o.id for page in pages for o in page], self.expected)
+
+        back = [[o.id for o in pages[-1]]]
+        page = pages[-1]
+        while page.previous_cursor:
+            page = paginator.get_page({'cursor': page.previous_cursor})
+            back.insert(0, [o.id for o in page])
+        self.assertEqual(back, [[o.id for o in page] for page in pages])
+
+    def test_tampered_cursor_restarts(self):
+        page = CursorPaginator(self.queryset, 2).get_page({'cursor': 'not-a-cursor'})
+        self.assertEqual([o.id for o in page], self.expected[:2])
+
+
+class FishCounterTests(TestCase):
+    """Fish.sold_kg/rating_sum/rating_count follow completed orders and their feedback."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.fish = make_fish()
+        self.order = Order.objects.create(user=self.buyer, status='out_for_delivery')
+        OrderItem.objects.create(order=self.order, fish=self.fish, quantity_kg=Decimal('2.50'), unit_price=Decimal('300.00'))
+
+    def counters(self):
+        self.fish.refresh_from_db()
+        return (self.fish.sold_kg, self.fish.rating_sum, self.fish.rating_count)
+
+    def set_status(self, status):
+        self.order.status = status
+        self.order.save()
+
+    def test_completion_and_feedback(self):
+        self.assertEqual(self.counters(), (Decimal('0.00'), 0, 0))
+        self.set_status('completed')
+        self.assertEqual(self.counters(), (Decimal('2.50'), 0, 0))
+        feedback = OrderFeedback.objects.create(order=self.order, buyer=self.buyer, rating=4)
+        self.assertEqual(self.counters(), (Decimal('2.50'), 4, 1))
+        feedback.delete()
+        self.assertEqual(self.counters(), (Decimal('2.50'), 0, 0))
+
+    def test_uncompleting_removes_quantities_and_rating(self):
+        self.set_status('completed')
+        OrderFeedback.objects.create(order=self.order, buyer=self.buyer, rating=5)
+        self.set_status('cancelled')
+        self.assertEqual(self.counters(), (Decimal('0.00'), 0, 0))
+        # Saving again without a status change must not count twice
+        self.set_status('completed')
+        self.order.save()
+        self.assertEqual(self.counters(), (Decimal('2.50'), 5, 1))
+
+    def test_deleting_a_completed_order(self):
+        self.set_status('completed')
+        OrderFeedback.objects.create(order=self.order, buyer=self.buyer, rating=3)
+        self.order.delete()
+        self.assertEqual(self.counters(), (Decimal('0.00'), 0, 0))
+
+    def test_recompute_matches_incremental(self):
+        self.set_status('completed')
+        OrderFeedback.objects.create(order=self.order, buyer=self.buyer, rating=2)
+        expected = self.counters()
+        Fish.objects.filter(pk=self.fish.pk).update(sold_kg=0, rating_sum=0, rating_count=0)
+        self.assertEqual(recompute_fish_stats(), 1)
+        self.assertEqual(self.counters(), expected)
+
+
+class FishReviewTests(TestCase):
+    """fish_detail's rating summary and the paged review feed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        buyer = make_buyer()
+        cls.fish = make_fish()
+        cls.ratings = [5, 5, 4, 4, 4, 3, 2, 1, 5, 4, 3, 5]
+        # One more order that is still pending: its rating must not count
+        for i, rating in enumerate(cls.ratings + [1]):
+            status = 'completed' if i < len(cls.ratings) else 'pending'
+            order = Order.objects.create(user=buyer, status=status)
+            OrderItem.objects.create(order=order, fish=cls.fish, quantity_kg=Decimal('1.00'), unit_price=Decimal('300.00'))
+            OrderFeedback.objects.create(order=order, buyer=buyer, rating=rating)
+
+    def test_rating_summary(self):
+        average, count, histogram = views._rating_summary(views._fish_reviews(self.fish))
+        self.assertEqual(count, len(self.ratings))
+        self.assertAlmostEqual(average, sum(self.ratings) / len(self.ratings))
+        self.assertEqual(histogram, [{'stars': n, 'count': self.ratings.count(n)} for n in (5, 4, 3, 2, 1)])
+
+    def test_review_feed_pages(self):
+        request = RequestFactory().get(f'/fish/{self.fish.id}/reviews/')
+        first = json.loads(views.fish_reviews(request, self.fish.id).content)
+        self.assertEqual(len(first['reviews']), views.REVIEWS_PAGE_SIZE)
+        request = RequestFactory().get(f'/fish/{self.fish.id}/reviews/', {'cursor': first['next_cursor']})
+        second = json.loads(views.fish_reviews(request, self.fish.id).content)
+        self.assertIsNone(second['next_cursor'])
+        ids = [review['id'] for review in first['reviews'] + second['reviews']]
+        self.assertEqual(len(set(ids)), len(self.ratings))
+
+
+class FacetTests(TestCase):
+    """fish_list facet counts for the current filter context."""
+
+    def setUp(self):
+        self.saltwater = FishCategory.objects.create(name='Saltwater')
+        self.freshwater = FishCategory.objects.create(name='Freshwater')
+        for name, category, price, stock in [
+            ('Tuna', self.saltwater, '300.00', '20.00'),
+            ('Mackerel', self.saltwater, '90.00', '3.00'),
+            ('Tilapia', self.freshwater, '120.00', '0.00'),
+            ('Catfish', self.freshwater, '80.00', '12.00'),
+        ]:
+            make_fish(name, price=price, stock=stock, category=category)
+
+    def counts(self, facets, name):
+        return {row.get('key', row.get('name')): row['count'] for row in facets[name] if row['count']}
+
+    def test_counts_follow_filters(self):
+        facets = get_facets(normalize_filters({'category': str(self.saltwater.id)}))
+        # The category facet ignores the selected category; the others honour it
+        self.assertEqual(self.counts(facets, 'categories'), {'Freshwater': 2, 'Saltwater': 2})
+        self.assertEqual(self.counts(facets, 'stock'), {'available': 1, 'low': 1})
+        self.assertEqual(self.counts(facets, 'price'), {'0-100': 1, '250-500': 1})
+        facets = get_facets(normalize_filters({'price': '0-100'}))
+        self.assertEqual(self.counts(facets, 'categories'), {'Freshwater': 1, 'Saltwater': 1})
+
+    def test_invalid_filters_are_dropped(self):
+        filters = normalize_filters({'category': 'x', 'stock': 'plenty', 'price': '1-2'})
+        self.assertEqual((filters['category'], filters['stock'], filters['price']), (None, '', ''))
+
+    def test_catalog_write_refreshes_counts(self):
+        filters = normalize_filters({})
+        self.assertEqual(self.counts(get_facets(filters), 'stock')['out'], 1)
+        tilapia = Fish.objects.get(name='Tilapia')
+        tilapia.stock_kg = Decimal('8.00')
+        tilapia.save()  # bumps the catalog version
+        self.assertNotIn('out', self.counts(get_facets(filters), 'stock'))
+
+
+class CatalogCacheTests(TestCase):
+    """Home and list fragments are shared from the cache until the catalog version moves."""
+
+    def setUp(self):
+        cache.clear()
+        self.fish = make_fish()
+
+    def fragments(self):
+        return featured_fish(6), category_counts(4), get_facets(normalize_filters({}))
+
+    def test_fragments_are_cached_until_a_bump(self):
+        self.fragments()
+        # A write that skips the signals leaves the cached fragments in place
+        Fish.objects.filter(id=self.fish.id).update(is_available=False)
+        with self.assertNumQueries(0):
+            featured, categories, _ = self.fragments()
+        self.assertEqual(featured, [self.fish])
+        self.assertEqual([(c.name, c.fish_count) for c in categories], [('Saltwater', 1)])
+        bump_catalog_version()
+        featured, categories, _ = self.fragments()
+        self.assertEqual((featured, categories), ([], []))
+        with self.assertNumQueries(0):
+            self.fragments()
+
+
+class RecommendationTests(TestCase):
+    """Co-purchase neighbours are built offline and invalidate fish_detail validators."""
+
+    def setUp(self):
+        buyer = make_buyer()
+        self.tuna, self.salmon, self.squid = [make_fish(name, price='100.00') for name in ('Tuna', 'Salmon', 'Squid')]
+        for fish_list in ([self.tuna, self.salmon], [self.tuna, self.salmon], [self.tuna, self.squid]):
+            order = Order.objects.create(user=buyer, status='completed')
+            for fish in fish_list:
+                OrderItem.objects.create(order=order, fish=fish, quantity_kg=Decimal('1.00'), unit_price=Decimal('100.00'))
+
+    def test_neighbours_ranked_by_co_purchases(self):
+        self.assertEqual(build_recommendations(), 3)
+        self.assertEqual(recommended_fish([self.tuna.id]), [self.salmon, self.squid])
+        self.assertEqual(recommended_fish([self.squid.id]), [self.tuna])
+
+    def test_unavailable_neighbours_are_skipped(self):
+        cod = make_fish('Cod', price='100.00')
+        order = Order.objects.create(user=User.objects.get(username='buyer'), status='completed')
+        for fish in (self.tuna, cod):
+            OrderItem.objects.create(order=order, fish=fish, quantity_kg=Decimal('1.00'), unit_price=Decimal('100.00'))
+        build_recommendations()
+        Fish.objects.filter(id__in=[self.salmon.id, self.squid.id]).update(is_available=False)
+        with self.assertNumQueries(2):
+            self.assertEqual(recommended_fish([self.tuna.id], limit=1), [cod])
+
+    def test_rebuild_changes_fish_detail_etag(self):
+        request = RequestFactory().get(f'/fish/{self.tuna.id}/')
+        request.user = AnonymousUser()
+        before = fish_detail_etag(request, self.tuna.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            build_recommendations()
+        request = RequestFactory().get(f'/fish/{self.tuna.id}/')
+        request.user = AnonymousUser()
+        self.assertNotEqual(fish_detail_etag(request, self.tuna.id), before)
+
+
+class SuggestTests(TransactionTestCase):
+    """Typeahead prefixes follow catalog edits, rebuilt off the request path."""
+
+    def setUp(self):
+        suggest._state.update(index=None, version=None, built_at=0.0, builder=None)
+        self.fish = make_fish('Yellowfin Tuna')
+
+    def labels(self, query):
+        return [row['label'] for row in suggest.suggest(query)]
+
+    def wait_for_rebuild(self):
+        builder = suggest._state['builder']
+        if builder is not None:
+            builder.join(5)
+
+    def test_prefix_matches_any_word(self):
+        self.assertEqual(self.labels('tu'), ['Yellowfin Tuna'])
+        self.assertEqual(self.labels('yellowfin t'), ['Yellowfin Tuna'])
+        self.assertEqual(self.labels('salt'), ['Saltwater'])
+        self.assertEqual(self.labels('x'), [])
+
+    def test_rename_is_picked_up_in_the_background(self):
+        self.assertEqual(self.labels('tu'), ['Yellowfin Tuna'])
+        self.fish.name = 'Bonito'
+        self.fish.save()  # bumps the catalog version
+        # The lookup that notices the change still answers from the old index
+        self.assertEqual(self.labels('tu'), ['Yellowfin Tuna'])
+        self.wait_for_rebuild()
+        self.assertEqual(self.labels('bon'), ['Bonito'])
+        self.assertEqual(self.labels('tu'), [])
+
+    def test_checkouts_rebuild_only_when_a_fish_sells_out(self):
+        buyer = make_buyer()
+        self.labels('tu')
+        version = get_names_version()
+        place_order(buyer, {self.fish.id: Decimal('4.00')})
+        self.labels('tu')
+        self.assertEqual(get_names_version(), version)
+        self.assertIsNone(suggest._state['builder'])
+        place_order(buyer, {self.fish.id: Decimal('6.00')})  # sells out
+        self.assertNotEqual(get_names_version(), version)
+        self.labels('tu')
+        self.wait_for_rebuild()
+        self.assertEqual(self.labels('tu'), [])
+
+
+class CartCounterTests(TestCase):
+    """The navbar cart badge comes from cached counters that follow every cart change."""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = make_buyer()
+        self.fish = make_fish()
+        self.cart = Cart.objects.create(user=self.buyer)
+        self.line = CartItem.objects.create(cart=self.cart, fish=self.fish, quantity_kg=Decimal('1.50'))
+
+    def test_cache_hit_needs_no_query(self):
+        self.assertEqual(get_cart_counters(self.buyer), {'items': Decimal('1.50'), 'total': Decimal('450.00')})
+        with self.assertNumQueries(0):
+            get_cart_counters(self.buyer)
+
+    def test_changes_outside_the_cart_views_invalidate(self):
+        get_cart_counters(self.buyer)
+        self.line.quantity_kg = Decimal('2.00')
+        self.line.save()
+        self.assertEqual(get_cart_counters(self.buyer)['items'], Decimal('2.00'))
+        self.line.delete()
+        self.assertEqual(get_cart_counters(self.buyer), {'items': Decimal('0.00'), 'total': Decimal('0.00')})
+
+    def test_cart_info_reads_the_badge(self):
+        request = RequestFactory().get('/')
+        request.user = self.buyer
+        self.assertEqual(cart_info(request)['cart_item_count'], Decimal('1.50'))
+
+
+class CartSummaryTests(TestCase):
+    """Cart totals come from one aggregate, shared by every caller holding the cart."""
+
+    def setUp(self):
+        buyer = make_buyer()
+        tuna, squid = [make_fish(name, price=price) for name, price in (('Tuna', '300.00'), ('Squid', '125.50'))]
+        self.cart = Cart.objects.create(user=buyer)
+        CartItem.objects.create(cart=self.cart, fish=tuna, quantity_kg=Decimal('1.50'))
+        self.squid_line = CartItem.objects.create(cart=self.cart, fish=squid, quantity_kg=Decimal('2.00'))
+
+    def test_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cart.get_total_items(), Decimal('3.50'))
+            self.assertEqual(self.cart.get_total_amount(), Decimal('701.00'))
+            self.assertEqual(self.cart.get_total_with_shipping(), Decimal('701.00') + SHIPPING_FEE)
+            self.assertEqual(self.cart.summary().line_count, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual([line.fish.name for line in self.cart.summary().lines], ['Tuna', 'Squid'])
+
+    def test_invalidate_after_change(self):
+        self.cart.get_total_amount()
+        self.squid_line.delete()
+        self.assertEqual(self.cart.get_total_amount(), Decimal('701.00'))  # memoized
+        self.cart.invalidate_summary()
+        self.assertEqual(self.cart.get_total_amount(), Decimal('450.00'))
+
+
+class StockHoldTests(TestCase):
+    """Reservations never exceed stock, expire, and move with their cart."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.fish = make_fish(price='100.00', stock='3.00')
+
+    def hold(self, owner):
+        return StockHold.objects.filter(owner=owner, fish=self.fish).values_list('quantity_kg', 'expires_at').first()
+
+    def test_short_reservation_keeps_the_previous_hold(self):
+        self.assertEqual(reserve_stock('s:other', {self.fish.id: Decimal('2.00')}), [])
+        self.assertEqual(reserve_stock('s:mine', {self.fish.id: Decimal('1.00')}, ttl=timedelta(minutes=5)), [])
+        before = self.hold('s:mine')
+        self.assertEqual(reserve_stock('s:mine', {self.fish.id: Decimal('2.00')}), [self.fish.id])
+        self.assertEqual(self.hold('s:mine'), before)
+        # No previous hold: nothing is left behind
+        self.assertEqual(reserve_stock('s:late', {self.fish.id: Decimal('1.00')}), [self.fish.id])
+        self.assertIsNone(self.hold('s:late'))
+
+    def test_expired_holds_free_the_stock(self):
+        reserve_stock('s:other', {self.fish.id: Decimal('3.00')}, ttl=timedelta(minutes=-1))
+        self.assertEqual(available_stock([self.fish.id]), {self.fish.id: Decimal('3.00')})
+        self.assertEqual(reserve_stock('s:mine', {self.fish.id: Decimal('3.00')}), [])
+        self.assertEqual(expire_holds(), 1)
+        self.assertIsNone(self.hold('s:other'))
+
+    def test_cart_batch_holds_follow_the_cart(self):
+        apply_cart_batch(self.buyer, [{'op': 'add', 'fish_id': self.fish.id, 'quantity': '2'}])
+        self.assertEqual(self.hold(user_owner(self.buyer))[0], Decimal('2.00'))
+        with self.assertRaises(ValueError):
+            apply_cart_batch(self.buyer, [
+                {'op': 'set', 'fish_id': self.fish.id, 'quantity': '3'},
+                {'op': 'add', 'fish_id': self.fish.id + 1, 'quantity': '1'},
+            ])
+        self.assertEqual(self.hold(user_owner(self.buyer))[0], Decimal('2.00'))
+        self.assertEqual(CartItem.objects.get(cart__user=self.buyer).quantity_kg, Decimal('2.00'))
+
+    def test_failed_batch_creates_nothing(self):
+        with self.assertRaises(ValueError):
+            apply_cart_batch(self.buyer, [{'op': 'add', 'fish_id': self.fish.id, 'quantity': '4'}])
+        self.assertFalse(Cart.objects.filter(user=self.buyer).exists())
+        self.assertIsNone(self.hold(user_owner(self.buyer)))
+
+
+class GuestCartTests(TestCase):
+    """Anonymous carts live in a signed-cookie session and move into Cart on login."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.tuna, self.squid = [make_fish(name, price='100.00', stock='3.00') for name in ('Tuna', 'Squid')]
+
+    def guest_request(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: HttpResponse()).process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    def test_guest_cart_writes_no_session_rows(self):
+        request = self.guest_request()
+        save_guest_cart(request, {self.tuna.id: Decimal('1.00')})
+        hold_owner(request)
+        request.session.save()
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(get_guest_cart(request), {self.tuna.id: Decimal('1.00')})
+
+    def test_login_merges_cart_and_hands_over_holds(self):
+        CartItem.objects.create(cart=Cart.objects.create(user=self.buyer), fish=self.tuna, quantity_kg=Decimal('2.00'))
+        request = self.guest_request()
+        save_guest_cart(request, {self.tuna.id: Decimal('2.00'), self.squid.id: Decimal('1.00')})
+        guest = hold_owner(request)
+        reserve_stock(guest, {self.tuna.id: Decimal('2.00'), self.squid.id: Decimal('1.00')})
+
+        login(request, self.buyer)
+
+        lines = dict(CartItem.objects.filter(cart__user=self.buyer).values_list('fish_id', 'quantity_kg'))
+        # 2 kg already in the cart + 2 kg from the guest cart, capped at the 3 kg in stock
+        self.assertEqual(lines, {self.tuna.id: Decimal('3.00'), self.squid.id: Decimal('1.00')})
+        self.assertEqual(get_guest_cart(request), {})
+        self.assertFalse(active_holds().filter(owner=guest).exists())
+        self.assertEqual(
+            dict(active_holds().filter(owner=user_owner(self.buyer)).values_list('fish_id', 'quantity_kg')),
+            lines,
+        )
+
+    def test_merge_leaves_other_buyers_holds_alone(self):
+        reserve_stock('s:someone', {self.tuna.id: Decimal('2.00')})
+        request = self.guest_request()
+        request._messages = FallbackStorage(request)
+        save_guest_cart(request, {self.tuna.id: Decimal('2.00'), self.squid.id: Decimal('1.00')})
+        login(request, self.buyer)
+
+        lines = dict(CartItem.objects.filter(cart__user=self.buyer).values_list('fish_id', 'quantity_kg'))
+        self.assertEqual(lines, {self.tuna.id: Decimal('1.00'), self.squid.id: Decimal('1.00')})
+        self.assertEqual(
+            dict(active_holds().filter(owner=user_owner(self.buyer)).values_list('fish_id', 'quantity_kg')), lines
+        )
+        self.assertIn('Tuna', [str(message) for message in get_messages(request)][0])
+
+    def test_line_lost_to_a_concurrent_reservation_is_dropped(self):
+        request = self.guest_request()
+        save_guest_cart(request, {self.tuna.id: Decimal('1.00'), self.squid.id: Decimal('1.00')})
+        with mock.patch('myapp.holds.reserve', return_value=[self.tuna.id]):
+            login(request, self.buyer)
+        lines = dict(CartItem.objects.filter(cart__user=self.buyer).values_list('fish_id', 'quantity_kg'))
+        self.assertEqual(lines, {self.squid.id: Decimal('1.00')})
+
+
+class StaleCartSweepTests(TestCase):
+    """The sweep removes lines untouched since the cutoff and carts that are still empty."""
+
+    def setUp(self):
+        cache.clear()
+        self.fish = make_fish()
+        self.old = timezone.now() - timedelta(days=60)
+        self.cutoff = timezone.now() - timedelta(days=30)
+
+    def make_cart(self, username, lines=()):
+        cart = Cart.objects.create(user=make_buyer(username))
+        for fish in lines:
+            CartItem.objects.create(cart=cart, fish=fish, quantity_kg=Decimal('1.00'))
+        Cart.objects.filter(pk=cart.pk).update(updated_at=self.old)
+        CartItem.objects.filter(cart=cart).update(added_at=self.old, updated_at=self.old)
+        return cart
+
+    def test_stale_lines_and_empty_carts_go(self):
+        stale = self.make_cart('stale', [self.fish])
+        empty = self.make_cart('empty')
+        get_cart_counters(stale.user)
+        self.assertEqual(sweep_stale_carts(self.cutoff), {'items': 1, 'carts': 2})
+        self.assertFalse(Cart.objects.filter(pk__in=[stale.pk, empty.pk]).exists())
+        self.assertEqual(get_cart_counters(stale.user)['items'], 0)
+
+    def test_recently_edited_line_stays(self):
+        cart = self.make_cart('editor', [self.fish])
+        line = cart.items.get()
+        line.quantity_kg = Decimal('2.00')
+        line.save()
+        self.assertEqual(sweep_stale_carts(self.cutoff), {'items': 0, 'carts': 0})
+        self.assertTrue(CartItem.objects.filter(pk=line.pk).exists())
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_dry_run_only_counts(self):
+        self.make_cart('stale', [self.fish])
+        self.make_cart('empty')
+        self.assertEqual(sweep_stale_carts(self.cutoff, dry_run=True), {'items': 1, 'carts': 1})
+        self.assertEqual((Cart.objects.count(), CartItem.objects.count()), (2, 1))
+
+
+class PlaceOrderTests(TestCase):
+    """The order, the cart clean-up and the hold release commit or roll back together."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.tuna, self.squid = [make_fish(name, price='100.00', stock='2.00') for name in ('Tuna', 'Squid')]
+        self.cart = Cart.objects.create(user=self.buyer)
+        for fish in (self.tuna, self.squid):
+            CartItem.objects.create(cart=self.cart, fish=fish, quantity_kg=Decimal('1.00'))
+        self.owner = user_owner(self.buyer)
+        reserve_stock(self.owner, {self.tuna.id: Decimal('1.00'), self.squid.id: Decimal('1.00')})
+
+    def test_ordered_lines_and_holds_go_with_the_order(self):
+        place_order(self.buyer, {self.tuna.id: Decimal('1.00')}, cart=self.cart, hold_owner=self.owner)
+        self.assertEqual(list(self.cart.items.values_list('fish_id', flat=True)), [self.squid.id])
+        self.assertFalse(StockHold.objects.filter(owner=self.owner).exists())
+
+    def test_out_of_stock_keeps_cart_and_holds(self):
+        with self.assertRaises(OutOfStock):
+            place_order(self.buyer, {self.tuna.id: Decimal('5.00')}, cart=self.cart, hold_owner=self.owner)
+        self.assertEqual(self.cart.items.count(), 2)
+        self.assertEqual(StockHold.objects.filter(owner=self.owner).count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stock_held_by_others_is_not_for_sale(self):
+        reserve_stock('s:other', {self.tuna.id: Decimal('1.00')})
+        with self.assertRaises(OutOfStock):
+            place_order(self.buyer, {self.tuna.id: Decimal('1.50')}, hold_owner=self.owner)
+        place_order(self.buyer, {self.tuna.id: Decimal('1.00')}, hold_owner=self.owner)
+        self.tuna.refresh_from_db()
+        self.assertEqual(self.tuna.stock_kg, Decimal('1.00'))
+
+    def test_order_now_drops_its_hold_when_placing_fails(self):
+        request = RequestFactory().post('/order-now/', {
+            'fish_id': self.tuna.id, 'quantity': '1.00', 'contact_number': '09171234567',
+        })
+        request.user = self.buyer
+        request.session = {}
+        with mock.patch.object(views, 'place_order', side_effect=RuntimeError('boom')):
+            self.assertEqual(views.order_now(request).status_code, 500)
+        self.assertFalse(StockHold.objects.filter(owner=f'{self.owner}:now').exists())
+
+
+class IdempotencyTests(TransactionTestCase):
+    """A repeated Idempotency-Key replays the first result instead of placing another order."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.fish = make_fish()
+
+    def order_now(self, key, quantity='1.00', user=None):
+        request = RequestFactory().post('/order-now/', {
+            'fish_id': self.fish.id, 'quantity': quantity, 'contact_number': '09171234567', 'address': 'Pier 1',
+        }, HTTP_IDEMPOTENCY_KEY=key)
+        request.user = user or self.buyer
+        request.session = {}
+        return views.order_now(request)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.order_now('abc')
+        retry = self.order_now('abc')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_same_key_with_a_different_body_is_rejected(self):
+        self.order_now('abc')
+        self.assertEqual(self.order_now('abc', quantity='2.00').status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_concurrent_duplicates_place_one_order(self):
+        start = threading.Barrier(2)
+        statuses = []
+
+        def post():
+            try:
+                start.wait()
+                statuses.append(self.order_now('race').status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=post) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertIn(200, statuses)
+        self.assertTrue(set(statuses) <= {200, 409}, statuses)
+        self.assertEqual(self.order_now('race').status_code, 200)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_concurrent_keyed_orders_do_not_fail_on_locks(self):
+        # Half a kilo stays, so the fish remains on sale and the losers get "Not enough stock"
+        Fish.objects.filter(pk=self.fish.pk).update(stock_kg=Decimal('10.50'))
+        buyers = User.objects.bulk_create([User(username=f'buyer{i}') for i in range(20)])
+        start = threading.Barrier(len(buyers))
+        statuses = []
+
+        def post(user):
+            try:
+                start.wait()
+                response = self.order_now(f'key-{user.id}', user=user)
+                statuses.append(response.status_code if response.status_code != 500 else response.content)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=post, args=(user,)) for user in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses, key=str), [200] * 10 + [400] * 10, statuses)
+        self.assertEqual(Order.objects.count(), 10)
+
+
+class JobQueueTests(TestCase):
+    """Queued jobs are claimed by one worker, retried with backoff and given up on after max_attempts."""
+
+    def setUp(self):
+        self.calls = []
+
+        def flaky(fail=True):
+            self.calls.append(fail)
+            if fail:
+                raise RuntimeError('smtp down')
+
+        jobs.HANDLERS['test_flaky'] = flaky
+        self.addCleanup(jobs.HANDLERS.pop, 'test_flaky')
+
+    def test_a_claimed_job_is_not_claimed_again(self):
+        queued = jobs.enqueue('test_flaky', fail=False)
+        self.assertEqual([job.id for job in jobs.claim_jobs('a')], [queued.id])
+        self.assertEqual(jobs.claim_jobs('b'), [])
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.locked_by), ('running', 'a'))
+
+    def test_failure_is_retried_with_backoff(self):
+        jobs.enqueue('test_flaky', max_attempts=3)
+        job = jobs.claim_jobs('a')[0]
+        before = timezone.now()
+        with self.assertLogs('myapp.jobs', 'WARNING'):
+            self.assertFalse(jobs.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('pending', 1, 'RuntimeError: smtp down'))
+        self.assertGreaterEqual(job.run_after, before + timedelta(seconds=jobs.BACKOFF_BASE))
+        # Not due again until the backoff has passed
+        self.assertEqual(jobs.claim_jobs('a'), [])
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        job = jobs.claim_jobs('a')[0]
+        with self.assertLogs('myapp.jobs', 'WARNING'):
+            jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertGreaterEqual(job.run_after, timezone.now() + timedelta(seconds=jobs.BACKOFF_BASE))
+
+    def test_last_failed_attempt_marks_the_job_failed(self):
+        queued = jobs.enqueue('test_flaky', max_attempts=2)
+        Job.objects.filter(id=queued.id).update(attempts=1)
+        with self.assertLogs('myapp.jobs', 'WARNING'):
+            self.assertEqual(jobs.work(worker_id='a', once=True), {'done': 0, 'failed': 1})
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 2))
+        self.assertEqual(jobs.claim_jobs('a'), [])
+
+
+class ArchiveTests(TestCase):
+    """Archiving moves old finished orders whole, keeps their ids and leaves the Fish counters alone."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.fish = make_fish()
+        self.old = Order.objects.create(user=self.buyer, status='ready')
+        self.item = OrderItem.objects.create(
+            order=self.old, fish=self.fish, quantity_kg=Decimal('2.00'), unit_price=Decimal('300.00')
+        )
+        self.old.status = 'completed'
+        self.old.save()
+        self.feedback = OrderFeedback.objects.create(order=self.old, buyer=self.buyer, rating=4)
+        self.recent = Order.objects.create(user=self.buyer, status='completed')
+        Order.objects.filter(id=self.old.id).update(
+            updated_at=timezone.now() - timedelta(days=200), created_at=timezone.now() - timedelta(days=200)
+        )
+        self.cutoff = timezone.now() - timedelta(days=90)
+
+    def counters(self):
+        self.fish.refresh_from_db()
+        return (self.fish.sold_kg, self.fish.rating_sum, self.fish.rating_count)
+
+    def test_rows_move_with_their_ids(self):
+        before = self.counters()
+        self.assertEqual(before, (Decimal('2.00'), 4, 1))
+        self.assertEqual(archive_orders(self.cutoff), 1)
+        self.assertFalse(Order.objects.filter(id=self.old.id).exists())
+        self.assertFalse(OrderItem.objects.filter(id=self.item.id).exists())
+        self.assertFalse(OrderFeedback.objects.filter(id=self.feedback.id).exists())
+        self.assertTrue(Order.objects.filter(id=self.recent.id).exists())
+        self.assertEqual(ArchivedOrderItem.objects.get(id=self.item.id).order_id, self.old.id)
+        self.assertEqual(ArchivedOrderFeedback.objects.get(id=self.feedback.id).rating, 4)
+        self.assertEqual(self.counters(), before)
+
+    def test_archived_orders_are_still_found(self):
+        archive_orders(self.cutoff)
+        self.assertIsInstance(find_order(self.old.id, user=self.buyer), ArchivedOrder)
+        self.assertIsInstance(find_order(self.recent.id, user=self.buyer), Order)
+        self.assertIsNone(find_order(self.old.id, user=make_buyer('other')))
+
+        orders = Order.objects.filter(user=self.buyer).order_by('-created_at')
+        extra = [user_archived_orders(self.buyer).order_by('-created_at')]
+        page = CursorPaginator(orders, 10, extra=extra).get_page({})
+        self.assertEqual([order.id for order in page], [self.recent.id, self.old.id])
+
+    def test_dry_run_changes_nothing(self):
+        self.assertEqual(archive_orders(self.cutoff, dry_run=True), 1)
+        self.assertTrue(Order.objects.filter(id=self.old.id).exists())
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+
+class OrderExportTests(TestCase):
+    """Exports stream live and archived orders, including orders without lines."""
+
+    def setUp(self):
+        buyer = make_buyer(email='buyer@example.com')
+        tuna, squid = [make_fish(name, price='100.00') for name in ('Tuna', 'Squid')]
+        self.archived = Order.objects.create(user=buyer, status='completed')
+        OrderItem.objects.create(order=self.archived, fish=tuna, quantity_kg=Decimal('1.00'), unit_price=Decimal('100.00'))
+        Order.objects.filter(id=self.archived.id).update(updated_at=timezone.now() - timedelta(days=200))
+        archive_orders(timezone.now() - timedelta(days=90))
+        self.live = Order.objects.create(user=buyer)
+        for fish in (tuna, squid):
+            OrderItem.objects.create(order=self.live, fish=fish, quantity_kg=Decimal('2.00'), unit_price=Decimal('100.00'))
+        self.empty = Order.objects.create(user=buyer)
+
+    def export(self, fmt):
+        return ''.join(export_orders(filter_admin_orders({}), fmt, extra=[filter_archived_orders({})]))
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+        self.assertEqual(
+            [(int(row['order_id']), row['fish']) for row in rows],
+            [(self.archived.id, 'Tuna'), (self.live.id, 'Tuna'), (self.live.id, 'Squid'), (self.empty.id, '')],
+        )
+        self.assertEqual(rows[0]['status'], 'completed')
+        self.assertEqual(rows[1]['quantity_kg'], '2.00')
+
+    def test_csv_escapes_formulas(self):
+        Order.objects.filter(id=self.empty.id).update(delivery_address='=HYPERLINK("http://x")', payment_method='@SUM(A1)')
+        row = list(csv.DictReader(io.StringIO(self.export('csv'))))[-1]
+        self.assertEqual(row['delivery_address'], '\'=HYPERLINK("http://x")')
+        self.assertEqual(row['payment_method'], "'@SUM(A1)")
+        self.assertEqual(row['total_amount'], '0.00')
+
+    def test_ndjson(self):
+        orders = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual([order['order_id'] for order in orders], [self.archived.id, self.live.id, self.empty.id])
+        self.assertEqual([[item['fish'] for item in order['items']] for order in orders], [['Tuna'], ['Tuna', 'Squid'], []])
+        self.assertEqual(orders[0]['customer'], 'buyer')
+
+
+class CustomerSearchKeyTests(TestCase):
+    """The admin customer filter matches name-word prefixes, including users indexed by the rebuild."""
+
+    def setUp(self):
+        self.liz = make_buyer('lizzy', first_name='Élise')
+        self.order = Order.objects.create(user=self.liz)
+
+    def matches(self, text):
+        return list(filter_orders(Order.objects.all(), normalize_order_filters({'user': text})))
+
+    def test_prefixes_up_to_the_last_letter(self):
+        self.assertEqual(self.matches('liz'), [self.order])
+        self.assertEqual(self.matches('eli'), [self.order])
+        self.assertEqual(self.matches('lizzy'), [self.order])
+        self.assertEqual(self.matches('lj'), [])
+
+    def test_rebuild_indexes_users_saved_without_signals(self):
+        bulk = User.objects.bulk_create([User(username='bulk', first_name='Zed')])[0]
+        User.objects.filter(pk=self.liz.pk).update(last_name='Quinn')
+        Order.objects.create(user=bulk)
+        self.assertEqual(self.matches('zed'), [])
+        rebuild_customer_keys(User.objects.all())
+        self.assertEqual([order.user_id for order in self.matches('zed')], [bulk.id])
+        self.assertEqual(self.matches('quinn'), [self.order])
+
+
+class ConcurrentReserveTests(TransactionTestCase):
+    """Buyers racing to hold the same fish all get an answer, and the holds never exceed the stock."""
+
+    BUYERS = 20
+
+    def test_no_overbooking_and_no_lock_errors(self):
+        fish = make_fish()
+        start = threading.Barrier(self.BUYERS)
+        results = []
+
+        def hold(owner):
+            try:
+                start.wait()
+                results.append('short' if reserve_stock(owner, {fish.id: Decimal('1.00')}) else 'ok')
+            except Exception as e:
+                results.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=hold, args=(f's:buyer{i}',)) for i in range(self.BUYERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(set(results)), ['ok', 'short'], results)
+        self.assertEqual(results.count('ok'), 10)
+        self.assertEqual(StockHold.objects.aggregate(total=Sum('quantity_kg'))['total'], Decimal('10.00'))
+
+
+class OrderEventStreamTests(TestCase):
+    """The SSE stream sends each user only their orders, catches up from Last-Event-ID and ends by itself."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.other = make_buyer('other')
+        self.staff = make_buyer('staff', is_staff=True)
+        self.mine = Order.objects.create(user=self.buyer)
+        self.theirs = Order.objects.create(user=self.other)
+        Order.objects.update(updated_at=timezone.now() - timedelta(minutes=1))
+        self.since = encode_cursor([timezone.now() - timedelta(minutes=2), 0], 'n')
+
+    def read(self, user, cursor=None, count=3):
+        async def take():
+            stream = order_event_stream(user, cursor)
+            try:
+                return [await stream.__anext__() for _ in range(count)]
+            finally:
+                await stream.aclose()
+        return async_to_sync(take)()
+
+    def order_ids(self, chunks):
+        return [
+            json.loads(line[len('data: '):])['order']['id']
+            for chunk in chunks for line in chunk.splitlines() if line.startswith('data: ')
+        ]
+
+    def test_catch_up_from_last_event_id(self):
+        chunks = self.read(self.buyer, self.since)
+        self.assertTrue(chunks[0].startswith('retry: '))
+        self.assertEqual(self.order_ids(chunks), [self.mine.id])
+        self.assertIn('keep-alive', chunks[-1])
+        self.assertEqual(self.order_ids(self.read(self.staff, self.since, count=4)), [self.mine.id, self.theirs.id])
+
+    def test_live_events_are_filtered_by_user(self):
+        async def take():
+            stream = order_event_stream(self.buyer)
+            try:
+                await stream.__anext__()  # retry
+                await stream.__anext__()  # keep-alive, nothing to catch up
+                order_events.publish(order_event(self.theirs, 'status'))
+                order_events.publish(order_event(self.mine, 'status'))
+                return await stream.__anext__()
+            finally:
+                await stream.aclose()
+        self.assertEqual(self.order_ids([async_to_sync(take)()]), [self.mine.id])
+        self.assertEqual(order_events._subscribers, set())
+
+    def test_stream_ends_after_its_lifetime(self):
+        async def drain():
+            return [chunk async for chunk in order_event_stream(self.buyer)]
+        with mock.patch('myapp.events.STREAM_LIFETIME', 0.05):
+            chunks = async_to_sync(drain)()
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(order_events._subscribers, set())
+
+
+class OrderChangeFeedTests(TestCase):
+    """?since= feeds page through every changed order once and report orders that left the filter."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.staff = make_buyer('staff', is_staff=True)
+        Order.objects.bulk_create([Order(user=self.buyer) for _ in range(5)])
+        # One bulk UPDATE: every order shares the same updated_at
+        Order.objects.update(updated_at=timezone.now() - timedelta(minutes=1))
+        self.since = encode_cursor([timezone.now() - timedelta(minutes=2), 0], 'n')
+
+    def get(self, view, user, **params):
+        request = RequestFactory().get('/orders/data/', params)
+        request.user = user
+        return json.loads(view(request).content)
+
+    def test_pages_through_a_shared_timestamp(self):
+        seen, cursor, has_more = [], self.since, True
+        with mock.patch.object(views, 'ORDER_FEED_LIMIT', 2):
+            while has_more:
+                data = self.get(views.user_orders_data, self.buyer, since=cursor)
+                self.assertTrue(data['incremental'])
+                seen += [order['id'] for order in data['orders']]
+                cursor, has_more = data['cursor'], data['has_more']
+        self.assertEqual(sorted(seen), sorted(Order.objects.values_list('id', flat=True)))
+        # A change still inside the settle window waits for a later poll, with the cursor kept
+        Order.objects.create(user=self.buyer)
+        data = self.get(views.user_orders_data, self.buyer, since=cursor)
+        self.assertEqual((data['orders'], data['cursor']), ([], cursor))
+
+    def test_admin_feed_reports_orders_leaving_the_filter(self):
+        moved = Order.objects.order_by('id').first()
+        Order.objects.filter(id=moved.id).update(status='confirmed', updated_at=timezone.now() - timedelta(seconds=30))
+        data = self.get(views.admin_orders_data, self.staff, since=self.since, status='pending')
+        self.assertEqual(data['removed'], [moved.id])
+        self.assertEqual(len(data['orders']), 4)
+        self.assertNotIn(moved.id, [order['id'] for order in data['orders']])
+
+
+class ConditionalGetTests(TestCase):
+    """A client holding the current validator gets a 304 before the view does any work."""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = make_buyer()
+        self.staff = make_buyer('staff', is_staff=True)
+        self.fish = make_fish()
+
+    def request(self, user, path='/', **headers):
+        request = RequestFactory().get(path, **headers)
+        request.user = user
+        request.session = {}
+        return request
+
+    def test_fish_pages(self):
+        etag = fish_list_etag(self.request(AnonymousUser()))
+        response = views.fish_list(self.request(AnonymousUser(), HTTP_IF_NONE_MATCH=f'"{etag}"'))
+        self.assertEqual(response.status_code, 304)
+
+        etag = fish_detail_etag(self.request(self.buyer), self.fish.id)
+        response = views.fish_detail(self.request(self.buyer, HTTP_IF_NONE_MATCH=f'"{etag}"'), self.fish.id)
+        self.assertEqual(response.status_code, 304)
+        self.fish.price_per_kg = Decimal('320.00')
+        self.fish.save()
+        self.assertNotEqual(fish_detail_etag(self.request(self.buyer), self.fish.id), etag)
+
+    def test_admin_board_revalidates_by_etag_only(self):
+        orders = [Order.objects.create(user=self.buyer) for _ in range(2)]
+        path = '/admin-panel/orders/data/?status=pending'
+        etag = admin_orders_etag(self.request(self.staff, path), views._filter_admin_orders(self.request(self.staff, path)))
+        response = views.admin_orders_data(self.request(self.staff, path, HTTP_IF_NONE_MATCH=f'"{etag}"'))
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # Leaving the filter changes the board even though no matching order changed
+        transition_orders([orders[0].id], 'confirmed')
+        response = views.admin_orders_data(self.request(self.staff, path, HTTP_IF_NONE_MATCH=f'"{etag}"'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['id'] for order in json.loads(response.content)['orders']], [orders[1].id])
+
+    def test_user_orders_if_modified_since(self):
+        Order.objects.create(user=self.buyer)
+        Order.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        since = http_date(timezone.now().timestamp())
+        response = views.user_orders_data(self.request(self.buyer, HTTP_IF_MODIFIED_SINCE=since))
+        self.assertEqual(response.status_code, 304)
+
+
+class CartBatchViewTests(TestCase):
+    """/cart/batch/ applies a whole edit in a fixed number of queries and answers with the new cart."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.tuna, self.squid, self.cod = [
+            make_fish(name, price='100.00', stock='5.00')
+            for name in ('Tuna', 'Squid', 'Cod')
+        ]
+
+    def post(self, operations, user=None, session=None):
+        request = RequestFactory().post(
+            '/cart/batch/', data=json.dumps({'operations': operations}), content_type='application/json',
+        )
+        SessionMiddleware(lambda request: HttpResponse()).process_request(request)
+        if session is not None:
+            request.session.update(session)
+        request.user = user or AnonymousUser()
+        response = views.cart_batch(request)
+        return response, json.loads(response.content), request
+
+    def test_logged_in_batch_returns_the_cart(self):
+        response, data, _ = self.post([
+            {'op': 'add', 'fish_id': self.tuna.id, 'quantity': '1.5'},
+            {'op': 'add', 'fish_id': self.squid.id, 'quantity': '2'},
+            {'op': 'set', 'fish_id': self.squid.id, 'quantity': '1'},
+        ], user=self.buyer)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(
+            [(item['fish_id'], item['name'], item['quantity'], item['item_total']) for item in data['items']],
+            [(self.tuna.id, 'Tuna', '1.50', 150.0), (self.squid.id, 'Squid', '1.00', 100.0)],
+        )
+        self.assertEqual((data['cart_total'], data['cart_count']), (250.0, '2.5'))
+        self.assertEqual(CartItem.objects.filter(cart__user=self.buyer).count(), 2)
+
+    def test_guest_batch_uses_the_session_cart(self):
+        response, data, request = self.post(
+            [{'op': 'remove', 'fish_id': self.tuna.id}, {'op': 'add', 'fish_id': self.cod.id, 'quantity': '2'}],
+            session={'guest_cart': {str(self.tuna.id): '1.00'}},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['id'], item['name']) for item in data['items']], [(self.cod.id, 'Cod')])
+        self.assertEqual(get_guest_cart(request), {self.cod.id: Decimal('2')})
+        self.assertFalse(Cart.objects.exists())
+
+    def test_bad_operations_reject_the_whole_batch(self):
+        for operations in (
+            [],
+            [{'op': 'eat', 'fish_id': self.tuna.id}],
+            [{'op': 'add', 'fish_id': self.tuna.id, 'quantity': '-1'}],
+            [{'op': 'add', 'fish_id': self.tuna.id, 'quantity': '1'}, {'op': 'add', 'fish_id': 0, 'quantity': '1'}],
+            [{'op': 'add', 'fish_id': self.tuna.id, 'quantity': '6'}],
+        ):
+            response, data, _ = self.post(operations, user=self.buyer)
+            self.assertEqual(response.status_code, 400, operations)
+            self.assertFalse(data['success'])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        self.post([{'op': 'add', 'fish_id': self.tuna.id, 'quantity': '1'}], user=self.buyer)
+        operations = [{'op': 'add', 'fish_id': fish.id, 'quantity': '1'} for fish in (self.tuna, self.squid, self.cod)]
+        # Cart, its lines, one stock check, the holds (lock, read, upsert,
+        # re-check), one line upsert, the counters and the response lines,
+        # plus the four savepoint statements of the two atomic blocks
+        for batch in (operations[:1], operations):
+            with self.assertNumQueries(14):
+                self.post(batch, user=self.buyer)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Many buyers checking out the same fish at once must never oversell it, nor fail on a locked database."""
+
+    BUYERS = 50
+
+    def test_no_overselling(self):
+        fish = make_fish()
+        buyers = User.objects.bulk_create([User(username=f'buyer{i}') for i in range(self.BUYERS)])
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in buyers])
+        CartItem.objects.bulk_create([CartItem(cart=cart, fish=fish, quantity_kg=Decimal('1.00')) for cart in carts])
+        start = threading.Barrier(self.BUYERS)
+        results = []
+
+        def buy(user, cart):
+            # The checkout view's steps: refresh the holds, then place the order
+            try:
+                start.wait()
+                owner = user_owner(user)
+                if reserve_stock(owner, {fish.id: Decimal('1.00')}):
+                    raise OutOfStock([fish.id], [fish.name])
+                place_order(user, {fish.id: Decimal('1.00')}, cart=cart, hold_owner=owner, payment_method='cod')
+                results.append('ok')
+            except OutOfStock:
+                results.append('out')
+            except Exception as e:
+                results.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy, args=(user, cart)) for user, cart in zip(buyers, carts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        fish.refresh_from_db()
+        self.assertEqual(sorted(set(results)), ['ok', 'out'], results)
+        self.assertEqual(results.count('ok'), 10)
+        self.assertEqual(fish.stock_kg, Decimal('0.00'))
+        self.assertFalse(fish.is_available)
+        self.assertEqual(OrderItem.objects.filter(fish=fish).count(), 10)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(CartItem.objects.count(), self.BUYERS - 10)
+        self.assertFalse(StockHold.objects.exists())
+
+
+class OrderTransitionTests(TestCase):
+    """Bulk status changes skip the Order signals, so they must apply their effects themselves."""
+
+    def setUp(self):
+        self.buyer = make_buyer()
+        self.fish = make_fish(stock='2.00')
+        self.orders = [place_order(self.buyer, {self.fish.id: Decimal('1.00')}) for _ in range(2)]
+        self.ids = [order.id for order in self.orders]
+
+    def test_only_allowed_orders_move(self):
+        Order.objects.filter(id=self.ids[0]).update(status='ready')
+        self.assertEqual(transition_orders(self.ids, 'out_for_delivery'), [self.ids[0]])
+        self.assertEqual(Order.objects.get(id=self.ids[1]).status, 'pending')
+        with self.assertRaises(ValueError):
+            transition_orders(self.ids, 'shipped')
+
+    def test_completion_and_cancellation_effects(self):
+        Order.objects.filter(id=self.ids[0]).update(status='ready')
+        transition_orders([self.ids[0]], 'completed')
+        self.assertEqual(transition_orders(self.ids, 'cancelled'), [self.ids[1]])
+        self.fish.refresh_from_db()
+        self.assertEqual(self.fish.sold_kg, Decimal('1.00'))
+        self.assertEqual(self.fish.stock_kg, Decimal('1.00'))
+        self.assertTrue(self.fish.is_available)
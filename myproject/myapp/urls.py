@@ -22,16 +22,20 @@ urlpatterns = [
     path('admin/fish/<int:fish_id>/delete/', views.admin_fish_delete, name='admin_fish_delete'),
     path('location/select/', views.location_select, name='location_select'),
     path('fish/', views.fish_list, name='fish_list'),
+    path('fish/suggest/', views.fish_suggest, name='fish_suggest'),
     path('fish/<int:fish_id>/', views.fish_detail, name='fish_detail'),
     path('fish/<int:fish_id>/feedback/', views.submit_feedback, name='submit_feedback'),
+    path('fish/<int:fish_id>/reviews/', views.fish_reviews, name='fish_reviews'),
     path('cart/', views.cart_view, name='cart'),
     path('cart/add/<int:fish_id>/', views.add_to_cart, name='add_to_cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
     path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('orders/', views.order_history, name='order_history'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
     path('orders/data/', views.user_orders_data, name='user_orders_data'),
+    path('orders/events/', views.order_events, name='order_events'),
     path('orders/now/', views.order_now, name='order_now'),
     
     # Admin Panel (custom)
@@ -39,6 +43,8 @@ urlpatterns = [
    path('admin-panel/products/<int:fish_id>/', views.admin_products, name='admin_product_edit'),
     path('admin-panel/orders/', views.admin_orders, name='admin_orders'),
     path('admin-panel/orders/data/', views.admin_orders_data, name='admin_orders_data'),
+    path('admin-panel/orders/export/', views.admin_orders_export, name='admin_orders_export'),
+    path('admin-panel/orders/bulk-status/', views.admin_orders_bulk_status, name='admin_orders_bulk_status'),
     
     # Messaging System URLs
     path('messages/', views.message_center, name='message_center'),
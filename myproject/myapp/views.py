@@ -1,13 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404, HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout, update_session_auth_hash, get_user_model
+from django.contrib.auth import authenticate, login, logout, update_session_auth_hash, get_user_model, get_user
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordChangeForm
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseServerError
+from django.http import Http404, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseServerError, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction, IntegrityError, DatabaseError
-from django.db.models import Q, Sum, F, Count, Case, When, Value, IntegerField, ProtectedError, Avg
+from django.db.models import Q, Sum, F, Count, Case, When, Value, IntegerField, ProtectedError, Avg, prefetch_related_objects
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.exceptions import ValidationError, PermissionDenied, ObjectDoesNotExist
 from django.core.validators import validate_email, URLValidator
@@ -56,6 +58,8 @@ logger = logging.getLogger(__name__)
 MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
 PAGINATION_DEFAULT = 10
 PAGINATION_MAX = 100
+REVIEWS_PAGE_SIZE = 10
+ORDER_FEED_LIMIT = 200
 
 # Custom exceptions
 class DailyFishException(Exception):
@@ -131,62 +135,53 @@ from .models import (
     Fish, FishCategory, Cart, CartItem, Order, 
     OrderItem, UserProfile, Message, OrderFeedback
 )
+from .archive import archived_fish_reviews, find_order, user_archived_orders
+from .cart import (
+    GuestCart, apply_cart_batch, apply_cart_operations, get_guest_cart, refresh_cart_counters,
+    reserve_cart_lines, save_guest_cart, set_cart_counters,
+)
+from .holds import available_stock, hold_owner, release as release_stock, reserve as reserve_stock
+from .idempotency import idempotent
+from .jobs import enqueue
+from .catalog import category_counts, featured_fish
+from .conditional import (
+    admin_orders_etag, fish_detail_etag, fish_list_etag, user_orders_etag, user_orders_last_modified,
+)
+from .events import order_event_stream
+from .exports import EXPORT_FORMATS, aexport_orders, export_orders
+from .facets import filter_fish, get_facets, normalize_filters
+from .order_filters import filter_admin_orders, filter_archived_orders, filter_orders, normalize_order_filters
+from .orders import OutOfStock, place_order, transition_orders
+from .pagination import SINCE_PARAM, CursorPaginator, changes_since, feed_cursor
+from .recommendations import recommended_fish
+from .search import search_fish
+from .suggest import DEFAULT_LIMIT as SUGGEST_DEFAULT, suggest
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Custom decorators
 @login_required
-@cache_control(public=True, max_age=300)  # Cache for 5 minutes
-@vary_on_cookie
+@cache_control(private=True, no_cache=True)
 def home(request):
     """Home view showing featured fish and categories with caching and error handling.
 
+    Featured fish and category counts come from the shared catalog cache
+    (myapp.catalog); the per-user parts (cart badge, location) are added by
+    context processors at render time.
+
     Returns:
         HttpResponse: Rendered home page or error page
     """
-    cache_key = f'home_page_{request.user.id}'
-    cached_response = cache.get(cache_key)
-
-    # Return cached response if available
-    if cached_response is not None and not request.GET.get('refresh'):
-        return cached_response
-
     try:
-        with transaction.atomic():
-            # Get featured fish with related data in a single query
-            featured_fish = (
-                Fish.objects.select_related('category')
-                .filter(is_available=True, stock_kg__gt=0)
-                .order_by('-created_at')[:6]
-            )
-
-            # Get categories with fish count
-            categories = (
-                FishCategory.objects.annotate(
-                    fish_count=Count(
-                        'fish',
-                        filter=Q(fish__is_available=True) & Q(fish__stock_kg__gt=0),
-                        distinct=True,
-                    )
-                )
-                .filter(fish_count__gt=0)
-                .order_by('name')[:4]
-            )
-
-            context = {
-                'featured_fish': list(featured_fish),  # Force evaluation of queryset
-                'categories': list(categories),  # Force evaluation of queryset
-                'current_time': timezone.now(),
-            }
-
-            # Render template (buyer home) – use existing home.html
-            response = render(request, 'home.html', context)
-
-            # Cache the response
-            cache.set(cache_key, response, 300)  # Cache for 5 minutes
+        context = {
+            'featured_fish': featured_fish(6),
+            'categories': category_counts(4),
+            'current_time': timezone.now(),
+        }
 
-            return response
+        # Render template (buyer home) – use existing home.html
+        return render(request, 'home.html', context)
 
     except DatabaseError as e:
         logger.error(f"Database error in home view: {str(e)}\n{traceback.format_exc()}")
@@ -320,8 +315,8 @@ def register_view(request):
                     is_staff=False
                 )
                 
-                # Create related objects
-                Cart.objects.create(user=user)
+                # Create related objects (the Cart is created on first use
+                # or when login() merges a guest cart)
                 profile = UserProfile.objects.create(user=user)
 
                 # Add to buyer group
@@ -455,9 +450,9 @@ def admin_dashboard(request):
         
         # Try to get additional data safely
         try:
-            from .models import Fish, Order
+            from .models import ArchivedOrder, Fish, Order
             total_fish = Fish.objects.count()
-            total_orders = Order.objects.count()
+            total_orders = Order.objects.count() + ArchivedOrder.objects.count()
             
             # Get recent orders with user info
             recent_orders = Order.objects.select_related('user').order_by('-created_at')[:5]
@@ -536,10 +531,8 @@ def admin_dashboard(request):
 def admin_users(request):
     """Admin users management page"""
     try:
-        from django.core.paginator import Paginator
-        
         search_query = request.GET.get('search', '')
-        users = User.objects.filter(is_staff=False)
+        users = User.objects.filter(is_staff=False).order_by('-date_joined')
         
         if search_query:
             users = users.filter(
@@ -548,9 +541,8 @@ def admin_users(request):
             )
         
         # Pagination
-        paginator = Paginator(users, 10)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        paginator = CursorPaginator(users, 10, with_total=True)
+        page_obj = paginator.get_page(request.GET)
         
         context = {
             'users': page_obj,
@@ -569,7 +561,6 @@ def admin_users(request):
 def admin_fish(request):
     """Admin fish products management page"""
     try:
-        from django.core.paginator import Paginator
         from .models import Fish, FishCategory
         
         search_query = request.GET.get('search', '')
@@ -578,10 +569,7 @@ def admin_fish(request):
         fish_products = Fish.objects.select_related('category').all()
         
         if search_query:
-            fish_products = fish_products.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
+            fish_products = search_fish(fish_products, search_query).order_by('search_rank', '-created_at')
         
         if category_filter:
             fish_products = fish_products.filter(category_id=category_filter)
@@ -593,9 +581,8 @@ def admin_fish(request):
         low_stock_products = Fish.objects.filter(stock_kg__gt=0, stock_kg__lte=5).select_related('category')
         
         # Pagination
-        paginator = Paginator(fish_products, 10)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        paginator = CursorPaginator(fish_products, 10, with_total=True)
+        page_obj = paginator.get_page(request.GET)
         
         context = {
             'fish_products': page_obj,
@@ -873,33 +860,26 @@ def buyer_dashboard(request):
 
 
 
-@login_required
+@condition(etag_func=fish_list_etag)
 def fish_list(request):
     # Get search and filter parameters
     search_query = request.GET.get('search', '')
     category_id = request.GET.get('category', '')
+    filters = normalize_filters(request.GET)
     
-    # Start with all available fish
-    fish_items = Fish.objects.filter(is_available=True)
-    
-    # Apply search filter
-    if search_query:
-        fish_items = fish_items.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
-    
-    # Apply category filter
-    if category_id:
-        fish_items = fish_items.filter(category_id=category_id)
+    # Start with all available fish, then apply search (full-text index,
+    # best matches first), category, stock and price filters
+    fish_items = filter_fish(Fish.objects.filter(is_available=True), filters)
     
     # Apply a consistent default ordering without exposing sorting controls
-    fish_items = fish_items.order_by('name')
+    if filters['search']:
+        fish_items = fish_items.order_by('search_rank', 'name')
+    else:
+        fish_items = fish_items.order_by('name')
     
     # Pagination
-    paginator = Paginator(fish_items, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(fish_items, 12)
+    page_obj = paginator.get_page(request.GET)
     
     # Get categories for filter dropdown
     categories = FishCategory.objects.all()
@@ -908,58 +888,41 @@ def fish_list(request):
         'page_obj': page_obj,
         'fish_items': page_obj,
         'categories': categories,
+        'facets': get_facets(filters),
         'search_query': search_query,
         'selected_category': category_id,
+        'selected_stock': filters['stock'],
+        'selected_price': filters['price'],
         # sorting removed from UI; keep ordering internal only
     }
     return render(request, 'fish_list.html', context)
 
-@login_required
+@condition(etag_func=fish_detail_etag)
 def fish_detail(request, fish_id):
     fish = get_object_or_404(Fish, id=fish_id, is_available=True)
-    related_fish = Fish.objects.filter(
+    # Frequently bought together; fall back to the same category
+    related_fish = recommended_fish([fish.id], limit=4) or Fish.objects.filter(
         category=fish.category, 
         is_available=True
     ).exclude(id=fish_id)[:4]
     
-    # Get feedback for this fish from completed orders
-    feedback_list = []
-    
-    # Get all order items for this fish that have been completed
-    completed_order_items = OrderItem.objects.filter(
-        fish=fish,
-        order__status='completed'
-    ).select_related('order')
-    
-    # Get the order IDs for these items
-    order_ids = completed_order_items.values_list('order_id', flat=True).distinct()
+    reviews = _fish_reviews(fish)
+    archived_reviews = archived_fish_reviews(fish)
+    average_rating, rating_count, rating_histogram = _rating_summary(reviews, archived_reviews)
     
-    # Get feedback for these orders
-    feedback_list = OrderFeedback.objects.filter(
-        order_id__in=order_ids
-    ).select_related('buyer', 'order').order_by('-created_at')
-    
-    # Calculate average rating and count for this fish
-    if feedback_list.exists():
-        average_rating = sum(f.rating for f in feedback_list) / len(feedback_list)
-        rating_count = len(feedback_list)
-    else:
-        average_rating = 0
-        rating_count = 0
+    # Only the first page of reviews; the rest stream in from fish_reviews
+    feedback_list = CursorPaginator(reviews, REVIEWS_PAGE_SIZE, extra=[archived_reviews.order_by('-created_at')]).get_page()
     
-    # Check if the current user has purchased this fish
-    has_purchased = OrderItem.objects.filter(
-        order__user=request.user,
-        order__status='completed',
-        fish=fish
-    ).exists()
-    
-    # Check if user can leave feedback
-    can_leave_feedback = has_purchased and not OrderFeedback.objects.filter(
-        order__user=request.user,
-        order__items__fish=fish,
-        order__status='completed'
-    ).exists()
+    # Purchase and review status for the current user in one query
+    has_purchased = can_leave_feedback = False
+    if request.user.is_authenticated:
+        purchase = OrderItem.objects.filter(
+            order__user=request.user,
+            order__status='completed',
+            fish=fish
+        ).aggregate(purchased=Count('id'), reviewed=Count('order__feedback'))
+        has_purchased = purchase['purchased'] > 0
+        can_leave_feedback = has_purchased and not purchase['reviewed']
     
     context = {
         'fish': fish,
@@ -967,6 +930,8 @@ def fish_detail(request, fish_id):
         'feedback_list': feedback_list,
         'average_rating': average_rating,
         'rating_count': rating_count,
+        'rating_histogram': rating_histogram,
+        'reviews_next_cursor': feedback_list.next_cursor,
         'can_leave_feedback': can_leave_feedback,
         'has_purchased': has_purchased,
     }
@@ -974,6 +939,61 @@ def fish_detail(request, fish_id):
     return render(request, 'fish_detail.html', context)
 
 
+@require_GET
+def fish_suggest(request):
+    """Typeahead suggestions for the search box, served from the in-memory prefix index."""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', SUGGEST_DEFAULT)), SUGGEST_DEFAULT))
+    except (TypeError, ValueError):
+        limit = SUGGEST_DEFAULT
+    return JsonResponse({'suggestions': suggest(request.GET.get('q', ''), limit)})
+
+
+def _rating_summary(*querysets):
+    """(average, count, per-star histogram) of feedback querysets, one aggregate per table."""
+    summary = {}
+    for queryset in querysets:
+        totals = queryset.aggregate(
+            rating_sum=Sum('rating'),
+            count=Count('id'),
+            **{f'stars_{n}': Count('id', filter=Q(rating=n)) for n, _ in OrderFeedback.RATING_CHOICES}
+        )
+        for name, value in totals.items():
+            summary[name] = summary.get(name, 0) + (value or 0)
+    rating_count = summary['count']
+    average_rating = summary['rating_sum'] / rating_count if rating_count else 0
+    rating_histogram = [
+        {'stars': n, 'count': summary[f'stars_{n}']}
+        for n, _ in reversed(OrderFeedback.RATING_CHOICES)
+    ]
+    return average_rating, rating_count, rating_histogram
+
+
+def _fish_reviews(fish):
+    """Feedback left on completed orders that contain this fish, newest first."""
+    return OrderFeedback.objects.filter(
+        order__items__fish=fish,
+        order__status='completed'
+    ).select_related('buyer').order_by('-created_at')
+
+
+@require_GET
+def fish_reviews(request, fish_id):
+    """JSON review stream for fish_detail, paged with ?cursor=."""
+    fish = get_object_or_404(Fish, id=fish_id, is_available=True)
+    page_obj = CursorPaginator(
+        _fish_reviews(fish), REVIEWS_PAGE_SIZE, extra=[archived_fish_reviews(fish).order_by('-created_at')]
+    ).get_page(request.GET)
+    data = [{
+        'id': f.id,
+        'buyer': f.buyer.username,
+        'rating': f.rating,
+        'comment': f.comment,
+        'created_at': localtime(f.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+    } for f in page_obj]
+    return JsonResponse({'reviews': data, 'next_cursor': page_obj.next_cursor})
+
+
 @login_required
 def submit_feedback(request, fish_id):
     """Allow a buyer who purchased this fish to submit a rating and comment."""
@@ -1012,47 +1032,64 @@ def submit_feedback(request, fish_id):
         messages.error(request, 'Please select a valid rating.')
         return redirect('fish_detail', fish_id=fish.id)
 
-    OrderFeedback.objects.create(
-        order=order,
-        buyer=request.user,
-        rating=rating,
-        comment=comment,
-    )
+    # Counters on Fish are bumped by a post_save signal in the same transaction
+    with transaction.atomic():
+        OrderFeedback.objects.create(
+            order=order,
+            buyer=request.user,
+            rating=rating,
+            comment=comment,
+        )
 
     messages.success(request, 'Thank you for your review!')
     return redirect('fish_detail', fish_id=fish.id)
 
-@login_required
 def add_to_cart(request, fish_id):
     if request.method == 'POST':
         try:
             fish = get_object_or_404(Fish, id=fish_id, is_available=True)
-            cart, created = Cart.objects.get_or_create(user=request.user)
             
             quantity_kg = Decimal(request.POST.get('quantity', '1'))
             
             if quantity_kg <= 0:
                 return JsonResponse({'success': False, 'message': 'Invalid quantity'})
             
-            if quantity_kg > fish.stock_kg:
+            # Stock held by other buyers' carts is not available
+            owner = hold_owner(request)
+            available = available_stock([fish.id], exclude_owner=owner).get(fish.id, Decimal('0'))
+            if quantity_kg > available:
                 return JsonResponse({'success': False, 'message': 'Not enough stock available'})
             
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                fish=fish,
-                defaults={'quantity_kg': quantity_kg}
-            )
+            # Anonymous visitors get a session cart, merged into Cart on login
+            if not request.user.is_authenticated:
+                items = get_guest_cart(request)
+                items[fish.id] = min(items.get(fish.id, Decimal('0')) + quantity_kg, available)
+                if reserve_stock(owner, {fish.id: items[fish.id]}):
+                    return JsonResponse({'success': False, 'message': 'Not enough stock available'})
+                save_guest_cart(request, items)
+                return JsonResponse({
+                    'success': True,
+                    'message': f'{fish.name} added to cart',
+                    'cart_count': sum(items.values())
+                })
             
-            if not created:
-                cart_item.quantity_kg += quantity_kg
-                if cart_item.quantity_kg > fish.stock_kg:
-                    cart_item.quantity_kg = fish.stock_kg
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            cart_item = CartItem.objects.filter(cart=cart, fish=fish).first()
+            new_quantity = min((cart_item.quantity_kg if cart_item else Decimal('0')) + quantity_kg, available)
+            if reserve_stock(owner, {fish.id: new_quantity}):
+                return JsonResponse({'success': False, 'message': 'Not enough stock available'})
+            
+            if cart_item:
+                cart_item.quantity_kg = new_quantity
                 cart_item.save()
+            else:
+                CartItem.objects.create(cart=cart, fish=fish, quantity_kg=new_quantity)
             
+            counters = refresh_cart_counters(request.user)
             return JsonResponse({
                 'success': True, 
                 'message': f'{fish.name} added to cart',
-                'cart_count': cart.get_total_items()
+                'cart_count': counters['items']
             })
             
         except Exception as e:
@@ -1060,39 +1097,51 @@ def add_to_cart(request, fish_id):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
-@login_required
 def cart_view(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    if request.user.is_authenticated:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart_items = cart.summary().lines
+    else:
+        cart = GuestCart(request)
+        cart_items = cart.lines
     
     context = {
         'cart': cart,
         'cart_items': cart_items,
+        'recommended_fish': recommended_fish([item.fish_id for item in cart_items], limit=4),
     }
     return render(request, 'cart.html', context)
 
-@login_required
 def update_cart_item(request, item_id):
     if request.method == 'POST':
+        if not request.user.is_authenticated:
+            return _update_guest_cart_item(request, fish_id=item_id)
         try:
-            cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+            cart_item = get_object_or_404(
+                CartItem.objects.select_related('cart', 'fish'), id=item_id, cart__user=request.user
+            )
             quantity_kg = Decimal(request.POST.get('quantity', '0'))
+            owner = hold_owner(request)
             
             if quantity_kg <= 0:
                 cart_item.delete()
+                release_stock(owner, [cart_item.fish_id])
+                refresh_cart_counters(request.user)
                 return JsonResponse({'success': True, 'message': 'Item removed from cart'})
             
-            if quantity_kg > cart_item.fish.stock_kg:
+            if reserve_stock(owner, {cart_item.fish_id: quantity_kg}):
                 return JsonResponse({'success': False, 'message': 'Not enough stock available'})
             
             cart_item.quantity_kg = quantity_kg
             cart_item.save()
             
+            counters = refresh_cart_counters(request.user)
             return JsonResponse({
                 'success': True,
                 'message': 'Cart updated',
                 'item_total': float(cart_item.total_price),
-                'cart_total': float(cart_item.cart.get_total_amount())
+                'cart_total': float(counters['total']),
+                'cart_count': counters['items']
             })
             
         except Exception as e:
@@ -1100,17 +1149,52 @@ def update_cart_item(request, item_id):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
-@login_required
+def _update_guest_cart_item(request, fish_id, remove=False):
+    """update_cart_item/remove_from_cart for a session cart, where item ids are fish ids."""
+    try:
+        items = get_guest_cart(request)
+        if fish_id not in items:
+            return JsonResponse({'success': False, 'message': 'Item not found in cart'}, status=404)
+        fish = get_object_or_404(Fish, id=fish_id)
+        quantity_kg = Decimal('0') if remove else Decimal(request.POST.get('quantity', '0'))
+        
+        # A quantity of 0 releases the hold
+        if reserve_stock(hold_owner(request), {fish_id: max(quantity_kg, Decimal('0'))}):
+            return JsonResponse({'success': False, 'message': 'Not enough stock available'})
+        
+        items[fish_id] = quantity_kg
+        save_guest_cart(request, items)
+        cart = GuestCart(request)
+        if quantity_kg <= 0:
+            message = f'{fish.name} removed from cart' if remove else 'Item removed from cart'
+            return JsonResponse({'success': True, 'message': message, 'cart_count': cart.get_total_items()})
+        return JsonResponse({
+            'success': True,
+            'message': 'Cart updated',
+            'item_total': float(quantity_kg * fish.price_per_kg),
+            'cart_total': float(cart.get_total_amount()),
+            'cart_count': cart.get_total_items()
+        })
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
 def remove_from_cart(request, item_id):
     if request.method == 'POST':
+        if not request.user.is_authenticated:
+            return _update_guest_cart_item(request, fish_id=item_id, remove=True)
         try:
-            cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+            cart_item = get_object_or_404(
+                CartItem.objects.select_related('cart', 'fish'), id=item_id, cart__user=request.user
+            )
             fish_name = cart_item.fish.name
             cart_item.delete()
+            release_stock(hold_owner(request), [cart_item.fish_id])
             
+            counters = refresh_cart_counters(request.user)
             return JsonResponse({
                 'success': True,
-                'message': f'{fish_name} removed from cart'
+                'message': f'{fish_name} removed from cart',
+                'cart_count': counters['items']
             })
             
         except Exception as e:
@@ -1118,12 +1202,62 @@ def remove_from_cart(request, item_id):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
+@require_POST
+def cart_batch(request):
+    """Apply several add/set/remove operations in one request and return the cart summary.
+
+    Body: {"operations": [{"op": "add"|"set"|"remove", "fish_id": 1, "quantity": "1.5"}, ...]}
+    """
+    try:
+        data = json.loads(request.body)
+        operations = data.get('operations') if isinstance(data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return JsonResponse({'success': False, 'message': 'No operations given'}, status=400)
+        
+        if request.user.is_authenticated:
+            counters = apply_cart_batch(request.user, operations)
+            lines = CartItem.objects.filter(cart__user=request.user).select_related('fish').order_by('added_at', 'id')
+        else:
+            owner = hold_owner(request)
+            current = get_guest_cart(request)
+            items = apply_cart_operations(current, operations, owner)
+            reserve_cart_lines(owner, current, items)
+            save_guest_cart(request, items)
+            cart = GuestCart(request)
+            lines = cart.lines
+            counters = {'items': cart.get_total_items(), 'total': cart.get_total_amount()}
+        
+        return JsonResponse({
+            'success': True,
+            'message': 'Cart updated',
+            'items': [
+                {
+                    'id': line.id,
+                    'fish_id': line.fish.id,
+                    'name': line.fish.name,
+                    'quantity': line.quantity_kg,
+                    'item_total': float(line.total_price),
+                }
+                for line in lines
+            ],
+            'cart_total': float(counters['total']),
+            'cart_count': counters['items'],
+        })
+    except ValueError as e:
+        # Also covers malformed JSON (JSONDecodeError)
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f'Cart batch error: {str(e)}', exc_info=True)
+        return JsonResponse({'success': False, 'message': str(e)})
+
 @login_required
+@idempotent('checkout')
 def checkout(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    summary = cart.summary()
+    cart_items = summary.lines
     
-    if not cart_items.exists():
+    if not summary.line_count:
         messages.warning(request, 'Your cart is empty.')
         return redirect('cart')
     
@@ -1154,40 +1288,35 @@ def checkout(request):
                 address_snapshot = f"{address_snapshot}\nContact: {contact_number}"
             else:
                 address_snapshot = f"Contact: {contact_number}"
-            order = Order.objects.create(
-                user=request.user,
-                total_amount=cart.get_total_amount(),
-                notes=request.POST.get('notes', ''),
-                payment_method=payment_method,
-                delivery_address=address_snapshot
-            )
             
-            # Create order items
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    fish=cart_item.fish,
-                    quantity_kg=cart_item.quantity_kg,
-                    unit_price=cart_item.fish.price_per_kg
+            # Refresh this buyer's holds; fails if other buyers hold the stock
+            owner = hold_owner(request)
+            short = reserve_stock(owner, {ci.fish_id: ci.quantity_kg for ci in cart_items})
+            if short:
+                names = ', '.join(ci.fish.name for ci in cart_items if ci.fish_id in short)
+                messages.error(request, f'Not enough stock available for {names}.')
+                return render(request, 'checkout.html', {'cart': cart, 'cart_items': cart_items})
+            
+            # One transaction: stock decrements, the order and its lines, and
+            # clearing the ordered cart lines and this buyer's holds
+            try:
+                order = place_order(
+                    request.user,
+                    {ci.fish_id: ci.quantity_kg for ci in cart_items},
+                    cart=cart,
+                    hold_owner=owner,
+                    notes=request.POST.get('notes', ''),
+                    payment_method=payment_method,
+                    delivery_address=address_snapshot,
                 )
-                
-                # Update fish stock and availability
-                fish = cart_item.fish
-                fish.stock_kg -= cart_item.quantity_kg
-                if fish.stock_kg <= 0:
-                    fish.stock_kg = Decimal('0.00')
-                    fish.is_available = False
-                fish.save()
+            except OutOfStock as e:
+                messages.error(request, f'{e}.')
+                return render(request, 'checkout.html', {'cart': cart, 'cart_items': cart_items})
             
-            # Clear cart
-            cart_items.delete()
+            cart.invalidate_summary()
+            set_cart_counters(request.user)
             
-            # Low stock notification for admin if any item falls below threshold
-            LOW_STOCK_THRESHOLD = Decimal('5.00')
-            low_stock_fish = [oi.fish.name for oi in order.items.all() if oi.fish.stock_kg <= LOW_STOCK_THRESHOLD]
-            if low_stock_fish:
-                messages.warning(request, f"Low stock alert: {', '.join(low_stock_fish)}")
-
+            # Confirmation email and the admin's low-stock alert are queued by place_order
             messages.success(request, f'Order #{order.id} placed successfully!')
             return redirect('order_detail', order_id=order.id)
             
@@ -1202,7 +1331,10 @@ def checkout(request):
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    # Old completed/cancelled orders live in the archive tables
+    order = find_order(order_id, user=request.user)
+    if order is None:
+        raise Http404('No order matches the given query.')
     
     # Add success message if this is a newly created order (no messages yet)
     if not request.GET.get('no_message'):
@@ -1221,10 +1353,9 @@ def order_detail(request, order_id):
 def order_history(request):
     orders = Order.objects.filter(user=request.user).order_by('-created_at')
     
-    # Pagination
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination (archived orders continue the same list)
+    paginator = CursorPaginator(orders, 10, extra=[user_archived_orders(request.user).order_by('-created_at')])
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -1235,6 +1366,7 @@ def order_history(request):
 
 @login_required
 @require_POST
+@idempotent('order_now')
 def order_now(request):
     """Create an order directly from the 'Order Now' modal for a single fish item."""
     try:
@@ -1257,9 +1389,6 @@ def order_now(request):
         except (DecimalException, ValueError):
             return JsonResponse({'success': False, 'message': 'Invalid quantity value'}, status=400)
 
-        if qty > fish.stock_kg:
-            return JsonResponse({'success': False, 'message': 'Not enough stock available'}, status=400)
-
         # Validate payment method
         valid_methods = dict(Order._meta.get_field('payment_method').choices).keys()
         if payment_method not in valid_methods:
@@ -1282,28 +1411,28 @@ def order_now(request):
         else:
             address_snapshot = f"Contact: {contact_number}"
 
-        # Create order and item
-        order = Order.objects.create(
-            user=request.user,
-            total_amount=qty * fish.price_per_kg,
-            notes=notes,
-            payment_method=payment_method,
-            delivery_address=address_snapshot,
-        )
-
-        OrderItem.objects.create(
-            order=order,
-            fish=fish,
-            quantity_kg=qty,
-            unit_price=fish.price_per_kg,
-        )
+        # Hold the stock while the order is created, separately from the buyer's cart holds
+        owner = f'{hold_owner(request)}:now'
+        if reserve_stock(owner, {fish.id: qty}):
+            return JsonResponse({'success': False, 'message': 'Not enough stock available'}, status=400)
 
-        # Update stock
-        fish.stock_kg -= qty
-        if fish.stock_kg <= 0:
-            fish.stock_kg = Decimal('0.00')
-            fish.is_available = False
-        fish.save()
+        # Create order and item, taking the stock and dropping the hold atomically
+        order = None
+        try:
+            order = place_order(
+                request.user,
+                {fish.id: qty},
+                hold_owner=owner,
+                notes=notes,
+                payment_method=payment_method,
+                delivery_address=address_snapshot,
+            )
+        except OutOfStock:
+            return JsonResponse({'success': False, 'message': 'Not enough stock available'}, status=400)
+        finally:
+            # Without a committed order the hold must not linger until it expires
+            if order is None:
+                release_stock(owner)
 
         return JsonResponse({
             'success': True,
@@ -1361,12 +1490,12 @@ def admin_products(request):
     if not request.user.is_staff:
         return redirect('home')
     search = request.GET.get('search', '')
-    qs = Fish.objects.all()
+    qs = Fish.objects.all().order_by('-updated_at')
     if search:
-        qs = qs.filter(Q(name__icontains=search) | Q(description__icontains=search))
+        qs = search_fish(qs, search).order_by('search_rank', '-updated_at')
     categories = FishCategory.objects.all()
     return render(request, 'admin/products.html', {
-        'fish_list': qs.order_by('-updated_at')[:200],
+        'fish_list': qs[:200],
         'categories': categories,
     })
 
@@ -1374,63 +1503,174 @@ def admin_products(request):
 def admin_orders(request):
     if not request.user.is_staff:
         return redirect('home')
-    status = request.GET.get('status', '')
-    user_q = request.GET.get('user', '')
-    date = request.GET.get('date', '')
-    orders = Order.objects.all()
-    if status:
-        orders = orders.filter(status=status)
-    if user_q:
-        orders = orders.filter(Q(user__username__icontains=user_q) | Q(user__first_name__icontains=user_q) | Q(user__last_name__icontains=user_q))
-    if date:
-        orders = orders.filter(created_at__date=date)
-    return render(request, 'admin/orders.html', {'orders': orders.order_by('-created_at')[:200]})
+    filters = normalize_order_filters(request.GET)
+    orders = filter_orders(Order.objects.all(), filters)
+    return render(request, 'admin/orders.html', {'orders': orders.order_by('-created_at')[:200], 'filters': filters})
+
+
+def _filter_admin_orders(request):
+    """Orders matching the admin order board filters (status, user, from/to, date)."""
+    return filter_admin_orders(request.GET)
 
 
 @login_required
+@condition(etag_func=lambda request: admin_orders_etag(request, _filter_admin_orders(request)))
 def admin_orders_data(request):
+    """Order board feed. With ?since=<cursor> only orders created or changed after it are sent.
+
+    Incremental replies list changed orders that match the filters in
+    ``orders`` and those that stopped matching (e.g. a new status) in
+    ``removed``; the client merges both by id and polls again with ``cursor``.
+    """
     if not request.user.is_staff:
         return JsonResponse({'error': 'Forbidden'}, status=403)
-    status = request.GET.get('status', '')
-    user_q = request.GET.get('user', '')
-    date = request.GET.get('date', '')
-    orders = Order.objects.all()
-    if status:
-        orders = orders.filter(status=status)
-    if user_q:
-        orders = orders.filter(Q(user__username__icontains=user_q) | Q(user__first_name__icontains=user_q) | Q(user__last_name__icontains=user_q))
-    if date:
-        orders = orders.filter(created_at__date=date)
-    data = []
-    for o in orders.select_related('user').prefetch_related('items__fish')[:200]:
-        data.append({
-            'id': o.id,
-            'user': o.user.username,
-            'items': [{'fish': i.fish.name, 'qty': float(i.quantity_kg)} for i in o.items.all()],
-            'total': float(o.total_amount),
-            'payment': o.payment_method,
-            'address': o.delivery_address,
-            'created_at': localtime(o.created_at).strftime('%Y-%m-%d %H:%M:%S'),
-            'status': o.status,
+    orders = _filter_admin_orders(request)
+    
+    changes = changes_since(Order.objects.all(), request.GET.get(SINCE_PARAM), limit=ORDER_FEED_LIMIT)
+    if changes is not None:
+        changed, cursor, has_more = changes
+        changed_ids = [o.id for o in changed]
+        matching = orders.filter(id__in=changed_ids).select_related('user').prefetch_related('items__fish')
+        data = [_admin_order_json(o) for o in matching.order_by('updated_at', 'id')]
+        matched_ids = {row['id'] for row in data}
+        return JsonResponse({
+            'orders': data,
+            'removed': [order_id for order_id in changed_ids if order_id not in matched_ids],
+            'cursor': cursor,
+            'has_more': has_more,
+            'incremental': True,
         })
-    return JsonResponse({'orders': data})
+    
+    data = [
+        _admin_order_json(o)
+        for o in orders.select_related('user').prefetch_related('items__fish')[:ORDER_FEED_LIMIT]
+    ]
+    return JsonResponse({'orders': data, 'cursor': feed_cursor(Order.objects.all()), 'incremental': False})
 
 
 @login_required
+@require_POST
+def admin_orders_bulk_status(request):
+    """Move many orders to one status, e.g. every ready order out for delivery.
+
+    Body: {"order_ids": [1, 2, ...], "status": "out_for_delivery"}. Orders
+    whose status does not allow the move are skipped; the reply lists the
+    ids that changed so the board can patch them in place.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Forbidden'}, status=403)
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict) or not isinstance(data.get('order_ids'), list):
+            return JsonResponse({'success': False, 'message': 'No orders given'}, status=400)
+        status = data.get('status')
+        updated = transition_orders(data['order_ids'], status)
+    except ValueError as e:
+        # Also covers malformed JSON (JSONDecodeError)
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f'Bulk order status error: {str(e)}', exc_info=True)
+        return JsonResponse({'success': False, 'message': 'Could not update orders'}, status=500)
+
+    requested = {int(order_id) for order_id in data['order_ids']}
+    return JsonResponse({
+        'success': True,
+        'message': f'{len(updated)} orders marked {dict(Order.STATUS_CHOICES)[status]}',
+        'status': status,
+        'updated': updated,
+        'skipped': sorted(requested - set(updated)),
+    })
+
+
+@login_required
+def admin_orders_export(request):
+    """Stream every order matching the board filters with its lines (?format=csv|ndjson).
+
+    Unlike admin_orders_data this has no row cap and includes archived
+    orders; rows are streamed as they are read (see myapp.exports).
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'Unknown format: {fmt}'}, status=400)
+    orders = _filter_admin_orders(request)
+    extra = [filter_archived_orders(request.GET)]
+    # Under ASGI a sync iterator would be read into memory before sending
+    if isinstance(request, ASGIRequest):
+        stream = aexport_orders(orders, fmt, extra)
+    else:
+        stream = export_orders(orders, fmt, extra)
+    response = StreamingHttpResponse(stream, content_type=EXPORT_FORMATS[fmt])
+    filename = f"orders-{localtime(now()).strftime('%Y%m%d-%H%M')}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _admin_order_json(o):
+    return {
+        'id': o.id,
+        'user': o.user.username,
+        'items': [{'fish': i.fish.name, 'qty': float(i.quantity_kg)} for i in o.items.all()],
+        'total': float(o.total_amount),
+        'payment': o.payment_method,
+        'address': o.delivery_address,
+        'created_at': localtime(o.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+        'status': o.status,
+    }
+
+
+def _user_order_json(o):
+    return {
+        'id': o.id,
+        'created_at': localtime(o.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+        'status': o.get_status_display(),
+        'total': float(o.total_amount),
+        'items': [{'fish': i.fish.name, 'qty': float(i.quantity_kg)} for i in o.items.all()],
+    }
+
+
+async def order_events(request):
+    """Server-Sent Events stream of order changes (own orders; all orders for staff).
+
+    Replaces polling user_orders_data/admin_orders_data. Needs the ASGI
+    entry point (myproject.asgi) so open streams do not each hold a worker.
+    Reconnects resume from the Last-Event-ID header (or ?since=<cursor>);
+    streams end after events.STREAM_LIFETIME so a closed tab's stream does
+    not run on, and the browser reconnects by itself.
+    """
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get(SINCE_PARAM)
+    response = StreamingHttpResponse(order_event_stream(user, cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@condition(etag_func=user_orders_etag, last_modified_func=user_orders_last_modified)
 def user_orders_data(request):
-    # Return current user's orders for live updates in order_history
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    data = []
-    for o in orders.prefetch_related('items__fish')[:200]:
-        data.append({
-            'id': o.id,
-            'created_at': localtime(o.created_at).strftime('%Y-%m-%d %H:%M:%S'),
-            'status': o.get_status_display(),
-            'total': float(o.total_amount),
-            'items': [{'fish': i.fish.name, 'qty': float(i.quantity_kg)} for i in o.items.all()],
+    # Return current user's orders for live updates in order_history;
+    # ?since=<cursor> returns only orders created or changed after it
+    orders = Order.objects.filter(user=request.user)
+    changes = changes_since(orders, request.GET.get(SINCE_PARAM), limit=ORDER_FEED_LIMIT)
+    if changes is not None:
+        changed, cursor, has_more = changes
+        prefetch_related_objects(changed, 'items__fish')
+        return JsonResponse({
+            'orders': [_user_order_json(o) for o in changed],
+            'cursor': cursor,
+            'has_more': has_more,
+            'incremental': True,
         })
+    
+    data = [_user_order_json(o) for o in orders.order_by('-created_at').prefetch_related('items__fish')[:ORDER_FEED_LIMIT]]
     # Return the assembled data as JSON
-    return JsonResponse({'orders': data})
+    return JsonResponse({'orders': data, 'cursor': feed_cursor(orders), 'incremental': False})
 
 
 # --- Messaging System Views ---
@@ -1571,25 +1811,15 @@ def order_feedback(request, order_id):
             return redirect('order_feedback', order_id=order_id)
         
         try:
-            OrderFeedback.objects.create(
-                order=order,
-                buyer=request.user,
-                rating=int(rating),
-                comment=comment
-            )
-            # Auto-create a message thread to the admin so the buyer can track it
-            admin_user = User.objects.filter(is_staff=True).order_by('id').first()
-            if admin_user:
-                try:
-                    Message.objects.create(
-                        sender=request.user,
-                        recipient=admin_user,
-                        message_type='product',
-                        subject=f'Feedback for Order #{order.id}',
-                        content=f'Rating: {int(rating)}\nComment: {comment or "(no comment)"}'
-                    )
-                except Exception:
-                    pass
+            with transaction.atomic():
+                feedback = OrderFeedback.objects.create(
+                    order=order,
+                    buyer=request.user,
+                    rating=int(rating),
+                    comment=comment
+                )
+                # Message thread to the admin so the buyer can track it, created by the worker
+                enqueue('feedback_admin_message', feedback_id=feedback.id)
             
             messages.success(request, 'Thank you for your feedback!')
             return redirect('order_detail', order_id=order_id)
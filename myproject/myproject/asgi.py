@@ -3,6 +3,10 @@ ASGI config for myproject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the site through this entry point (gunicorn with uvicorn workers, see
+render.yaml) so the async order event stream (myapp.views.order_events) can
+hold many open connections without tying up a worker each.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -82,10 +82,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file, not the default in-memory test database: its locking matches
+        # production, which the concurrent checkout tests depend on
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# Local memory by default, so the per-request reads (catalog version, cart
+# badge) never touch disk or network. It is per process: catalog bumps made by
+# another process (a second worker, a management command) are only seen there.
+# Set REDIS_URL (needs the redis package) to share one cache between processes
+# and hosts, or CACHE_BACKEND/CACHE_LOCATION for any other backend, e.g. the
+# file cache.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'dailyfish'),
+        }
+    }
+
+
+# Email
+# Sent by the job worker (manage.py run_worker, see myapp.tasks), never in a
+# request. Set EMAIL_HOST (and EMAIL_HOST_USER/EMAIL_HOST_PASSWORD) to send
+# through SMTP; without it, mail is printed to the worker's log.
+
+EMAIL_HOST = os.environ.get('EMAIL_HOST', '')
+EMAIL_BACKEND = os.environ.get(
+    'EMAIL_BACKEND',
+    'django.core.mail.backends.smtp.EmailBackend' if EMAIL_HOST else 'django.core.mail.backends.console.EmailBackend',
+)
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', '587'))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'DailyFish <noreply@dailyfish.local>')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -129,6 +174,13 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Sessions
+# Signed cookies: the guest cart and stock-hold token (myapp.cart, myapp.holds)
+# live in the session, so anonymous browsing and carting never write session
+# rows. The guest cart is a few fish ids and quantities, well under the ~4 KB
+# cookie limit.
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
 LOGIN_REDIRECT_URL = 'fish_list'
 LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+set -o errexit
+
+# Background job worker (order emails, low-stock alerts), restarted if it exits.
+# With a shared database (PostgreSQL) run it as its own service instead:
+#   python manage.py run_worker
+while true; do
+  python manage.py run_worker || true
+  sleep 5
+done &
+
+exec gunicorn myproject.asgi:application -k uvicorn.workers.UvicornWorker